@@ -0,0 +1,104 @@
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+import pandas as pd
+from pandas import DataFrame
+
+
+class CellCountsIndex:
+    """
+    Integer-coded index over the dimension (non-numeric) columns of a cell counts dataframe.
+
+    Each dimension column is stored as an array of integer term codes, one per row, alongside the distinct term ids.
+    Selecting the rows for a set of term ids is then a lookup of the selected codes rather than a string comparison
+    of every row, and the row masks of several dimensions are intersected with a bitwise and.
+    """
+
+    def __init__(self, df: DataFrame):
+        self.n_rows = df.shape[0]
+        self._codes: Dict[str, np.ndarray] = {}
+        self._term_ids: Dict[str, pd.Index] = {}
+        for col in df.columns:
+            if pd.api.types.is_numeric_dtype(df[col].dtype):
+                continue
+            codes, term_ids = pd.factorize(df[col])
+            self._codes[col] = codes.astype(np.min_scalar_type(-len(term_ids) - 1))
+            self._term_ids[col] = pd.Index(term_ids)
+
+    def __contains__(self, dim: str) -> bool:
+        return dim in self._codes
+
+    @property
+    def dims(self) -> List[str]:
+        return list(self._codes)
+
+    def dim_mask(self, dim: str, term_ids: Iterable[str]) -> np.ndarray:
+        """
+        Return the mask of the rows whose `dim` is one of `term_ids`.
+        """
+        # the extra, never selected, slot at the end is looked up by the -1 code of missing values
+        is_selected = np.zeros(len(self._term_ids[dim]) + 1, dtype=bool)
+        codes = self._term_ids[dim].get_indexer(list(term_ids))
+        is_selected[codes[codes >= 0]] = True
+        return is_selected[self._codes[dim]]
+
+    def dim_masks(self, filters: Dict[str, Iterable[str]]) -> Dict[str, np.ndarray]:
+        """
+        Return the row mask of each indexed dimension with a non-empty filter.
+        """
+        return {dim: self.dim_mask(dim, term_ids) for dim, term_ids in filters.items() if dim in self and term_ids}
+
+    def mask(self, filters: Dict[str, Iterable[str]]) -> np.ndarray:
+        """
+        Return the mask of the rows that match all of the filters. Filters on dimensions that are not indexed, and
+        empty filters, match all rows.
+        """
+        return intersect_masks(self.dim_masks(filters).values(), self.n_rows)
+
+    def available_term_ids(self, filters: Dict[str, Iterable[str]]) -> Dict[str, List[str]]:
+        """
+        Return, for each indexed dimension, the distinct term ids in the rows that match all of the filters except
+        the one on that dimension (if any).
+
+        The row masks of the filters are computed once. The mask excluding a single filter is the intersection of
+        the prefix and suffix intersections of the other masks, so each dimension costs one extra bitwise and.
+        """
+        dim_masks = self.dim_masks(filters)
+        masks = list(dim_masks.values())
+
+        # prefix[i] is the intersection of masks[:i], suffix[i] the intersection of masks[i:]
+        prefix = [np.ones(self.n_rows, dtype=bool)]
+        for dim_mask in masks:
+            prefix.append(prefix[-1] & dim_mask)
+        suffix = [np.ones(self.n_rows, dtype=bool)]
+        for dim_mask in reversed(masks):
+            suffix.append(suffix[-1] & dim_mask)
+        suffix.reverse()
+
+        all_criteria_mask = prefix[-1]
+        other_criteria_masks = {dim: prefix[i] & suffix[i + 1] for i, dim in enumerate(dim_masks)}
+        return {dim: self.term_ids(dim, other_criteria_masks.get(dim, all_criteria_mask)) for dim in self.dims}
+
+    def term_ids(self, dim: str, mask: Optional[np.ndarray] = None) -> List[str]:
+        """
+        Return the distinct term ids of `dim` in the rows selected by `mask` (all rows if None), in order of first
+        appearance, like `DataFrame[dim].unique()`.
+        """
+        codes = self._codes[dim] if mask is None else self._codes[dim][mask]
+        codes = pd.unique(codes)
+        return self._term_ids[dim][codes[codes >= 0]].tolist()
+
+    def term_counts(self, dim: str, mask: Optional[np.ndarray] = None) -> pd.Series:
+        """
+        Return the number of rows selected by `mask` (all rows if None) for each term id of `dim`.
+        """
+        codes = self._codes[dim] if mask is None else self._codes[dim][mask]
+        counts = np.bincount(codes[codes >= 0], minlength=len(self._term_ids[dim]))
+        return pd.Series(counts, index=self._term_ids[dim])
+
+
+def intersect_masks(masks: Iterable[np.ndarray], n_rows: int) -> np.ndarray:
+    mask = np.ones(n_rows, dtype=bool)
+    for dim_mask in masks:
+        mask &= dim_mask
+    return mask
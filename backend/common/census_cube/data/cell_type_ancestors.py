@@ -0,0 +1,85 @@
+from dataclasses import dataclass
+from typing import Iterable
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+
+@dataclass(frozen=True)
+class CellTypeAncestorMatrix:
+    """
+    Sparse ancestor-indicator matrix over integer-coded cell types.
+
+    `ancestors[i, j]` is set iff `cell_type_ontology_term_ids[j]` is an ancestor of (or is)
+    `cell_type_ontology_term_ids[i]`. The cell type ids are sorted, so the integer codes preserve the lexicographic
+    order of the ids.
+    """
+
+    cell_type_ontology_term_ids: pd.Index
+    ancestors: sparse.csr_matrix
+
+    def codes(self, cell_type_ontology_term_ids: Iterable[str]) -> np.ndarray:
+        """
+        Return the integer codes of the given cell type ids. Cell types that are not in the matrix are coded as -1.
+        """
+        return self.cell_type_ontology_term_ids.get_indexer(cell_type_ontology_term_ids)
+
+    def with_cell_types(self, cell_type_ontology_term_ids: Iterable[str]) -> "CellTypeAncestorMatrix":
+        """
+        Return a matrix that also covers the given cell types. Cell types that are not in this matrix have no
+        known ancestors, so they are their own only ancestor.
+        """
+        missing = pd.Index(cell_type_ontology_term_ids).unique().difference(self.cell_type_ontology_term_ids)
+        if missing.empty:
+            return self
+
+        ancestor_pairs = self.ancestors.tocoo()
+        return _build_from_pairs(
+            self.cell_type_ontology_term_ids.append(missing),
+            self.cell_type_ontology_term_ids[ancestor_pairs.row].append(missing),
+            self.cell_type_ontology_term_ids[ancestor_pairs.col].append(missing),
+        )
+
+
+def build_cell_type_ancestor_matrix(
+    cell_type_ancestors: pd.Series, cell_type_ontology_term_ids: Iterable[str]
+) -> CellTypeAncestorMatrix:
+    """
+    Build the ancestor-indicator matrix over the given cell types and their ancestors.
+
+    Args:
+        cell_type_ancestors (pd.Series): The ancestors (including self) of each cell type, indexed by cell type id.
+        cell_type_ontology_term_ids (Iterable[str]): The cell types to build the matrix for. Cell types that are
+            not in the index of `cell_type_ancestors` have no known ancestors, so they are their own only ancestor.
+
+    Returns:
+        CellTypeAncestorMatrix: The ancestor-indicator matrix.
+    """
+    cell_type_ontology_term_ids = pd.Index(pd.unique(np.asarray(list(cell_type_ontology_term_ids), dtype=object)))
+    unknown_cell_type_ontology_term_ids = cell_type_ontology_term_ids.difference(cell_type_ancestors.index)
+    ancestors = (
+        cell_type_ancestors[cell_type_ontology_term_ids.difference(unknown_cell_type_ontology_term_ids)]
+        .explode()
+        .dropna()
+    )
+    all_cell_type_ontology_term_ids = cell_type_ontology_term_ids.union(pd.Index(ancestors.unique()))
+    return _build_from_pairs(
+        all_cell_type_ontology_term_ids,
+        ancestors.index.append(unknown_cell_type_ontology_term_ids),
+        pd.Index(ancestors.to_numpy()).append(unknown_cell_type_ontology_term_ids),
+    )
+
+
+def _build_from_pairs(
+    cell_type_ontology_term_ids: pd.Index, descendant_ids: Iterable[str], ancestor_ids: Iterable[str]
+) -> CellTypeAncestorMatrix:
+    cell_type_ontology_term_ids = cell_type_ontology_term_ids.sort_values()
+    rows = cell_type_ontology_term_ids.get_indexer(descendant_ids)
+    cols = cell_type_ontology_term_ids.get_indexer(ancestor_ids)
+    n_cell_types = len(cell_type_ontology_term_ids)
+    ancestors = sparse.csr_matrix((np.ones(len(rows), dtype=np.int8), (rows, cols)), shape=(n_cell_types, n_cell_types))
+    # duplicate (descendant, ancestor) pairs are summed by the constructor; the matrix is an indicator
+    ancestors.data[:] = 1
+    ancestors.sort_indices()
+    return CellTypeAncestorMatrix(cell_type_ontology_term_ids=cell_type_ontology_term_ids, ancestors=ancestors)
@@ -0,0 +1,159 @@
+import logging
+from typing import Dict, List, Set
+
+import tiledb
+from ddtrace import tracer
+from tiledb import Array
+
+from backend.common.census_cube.data.native_threads import native_lock
+
+logger = logging.getLogger("wmg")
+
+# The cube handles of every snapshot that still has open cubes
+_open_cube_handles: Set["CubeHandles"] = set()
+_open_cube_handles_lock = native_lock()
+
+
+class CubeHandles:
+    """
+    Reference-counted set of the TileDB arrays opened for one snapshot.
+
+    All of the arrays of a snapshot share a single TileDB context, and thereby a single tile cache. Users of the
+    snapshot `acquire` the handles before reading from the arrays and `release` them when they are done. Once the
+    snapshot is replaced by a newer one, it is `retire`d, and its arrays are closed as soon as the last user releases
+    them, instead of holding on to their tile cache and fragment metadata for the lifetime of the process.
+    """
+
+    def __init__(self, snapshot_identifier: str, ctx: tiledb.Ctx):
+        self.snapshot_identifier = snapshot_identifier
+        self.ctx = ctx
+        self._arrays: List[Array] = []
+        self._ref_count = 0
+        self._retired = False
+        self._closed = False
+        self._lock = native_lock()
+
+        with _open_cube_handles_lock:
+            _open_cube_handles.add(self)
+
+    @property
+    def n_open_arrays(self) -> int:
+        return len(self._arrays)
+
+    @property
+    def ref_count(self) -> int:
+        return self._ref_count
+
+    @property
+    def retired(self) -> bool:
+        return self._retired
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    @property
+    def tile_cache_budget(self) -> int:
+        """
+        The configured tile cache budget (`sm.tile_cache_size`), in bytes, of the context shared by the arrays. TileDB
+        does not report how much of it is in use.
+        """
+        try:
+            return int(self.ctx.config()["sm.tile_cache_size"])
+        except KeyError:
+            # the tile cache is only configured by contexts created with `create_ctx`
+            return 0
+
+    def open(self, uri: str) -> Array:
+        """
+        Open the array at `uri` for reading and track it, so that it is closed along with the snapshot.
+        """
+        array = tiledb.open(uri, ctx=self.ctx)
+        with self._lock:
+            if self._closed:
+                array.close()
+                raise ValueError(f"The cubes of snapshot {self.snapshot_identifier} are closed")
+            self._arrays.append(array)
+        return array
+
+    def acquire(self) -> bool:
+        """
+        Take a reference to the arrays. Returns False, without taking a reference, if the arrays are already closed.
+        """
+        with self._lock:
+            if self._closed:
+                return False
+            self._ref_count += 1
+            return True
+
+    def release(self) -> None:
+        """
+        Drop a reference to the arrays, closing them if this was the last reference to a retired snapshot.
+        """
+        with self._lock:
+            self._ref_count = max(self._ref_count - 1, 0)
+            should_close = self._retired and self._ref_count == 0
+        if should_close:
+            self.close()
+
+    def retire(self) -> None:
+        """
+        Mark the snapshot as replaced. The arrays are closed immediately if there are no references to them,
+        otherwise when the last reference is released.
+        """
+        with self._lock:
+            self._retired = True
+            should_close = self._ref_count == 0
+        if should_close:
+            self.close()
+
+    def close(self) -> None:
+        """
+        Close all of the arrays, regardless of the references to them.
+        """
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            arrays, self._arrays = self._arrays, []
+
+        for array in arrays:
+            try:
+                array.close()
+            except Exception:
+                logger.exception(f"Failed to close cube {array.uri} of snapshot {self.snapshot_identifier}")
+
+        with _open_cube_handles_lock:
+            _open_cube_handles.discard(self)
+
+        logger.info(f"Closed {len(arrays)} cubes of snapshot {self.snapshot_identifier}")
+        report_cube_handle_metrics()
+
+
+def cube_handle_metrics() -> Dict[str, int]:
+    """
+    Return the number of snapshots with open cubes, of those that have been replaced but are still in use, of the
+    open cubes and of the references to them, and the total tile cache budget of the open cubes in bytes.
+    """
+    with _open_cube_handles_lock:
+        cube_handles = list(_open_cube_handles)
+
+    return {
+        "census_cube.snapshots.open": len(cube_handles),
+        "census_cube.snapshots.retired": sum(handles.retired for handles in cube_handles),
+        "census_cube.cubes.open": sum(handles.n_open_arrays for handles in cube_handles),
+        "census_cube.cubes.references": sum(handles.ref_count for handles in cube_handles),
+        "census_cube.tile_cache.budget_bytes": sum(handles.tile_cache_budget for handles in cube_handles),
+    }
+
+
+def report_cube_handle_metrics() -> None:
+    """
+    Attach the cube handle metrics to the current trace, if any.
+    """
+    span = tracer.current_root_span()
+    if span is None:
+        return
+
+    for name, value in cube_handle_metrics().items():
+        span.set_metric(name, value)
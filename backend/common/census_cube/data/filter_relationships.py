@@ -0,0 +1,172 @@
+import io
+from itertools import permutations
+from typing import Dict, Iterable, List, Tuple
+
+import numpy as np
+import pandas as pd
+from pandas import DataFrame
+from scipy import sparse
+
+
+class FilterRelationships:
+    """
+    Integer-coded graph of the filter values (term ids) that co-occur in at least one row of a cell counts dataframe.
+
+    The distinct term ids of each filter dimension are numbered by their position in `term_ids[dim]`. For each
+    ordered pair of distinct dimensions (a, b), `links[a, b]` is a boolean CSR matrix whose row i holds the codes of
+    the terms of b that co-occur with the i-th term of a. The graph is symmetric: `links[b, a]` is the transpose of
+    `links[a, b]`. Terms never co-occur with other terms of their own dimension, so there are no (a, a) links.
+    """
+
+    def __init__(self, term_ids: Dict[str, pd.Index], links: Dict[Tuple[str, str], sparse.csr_matrix]):
+        self.term_ids = term_ids
+        self.links = links
+
+    @property
+    def dims(self) -> List[str]:
+        return list(self.term_ids)
+
+    def codes(self, dim: str, term_ids: Iterable[str]) -> np.ndarray:
+        """
+        Return the codes of the `term_ids` of `dim`, skipping term ids that are not in the graph.
+        """
+        if dim not in self.term_ids:
+            return np.array([], dtype=np.intp)
+        codes = self.term_ids[dim].get_indexer(list(term_ids))
+        return codes[codes >= 0]
+
+    def linked(self, dim: str, codes: np.ndarray, linked_dim: str) -> np.ndarray:
+        """
+        Return the mask of the terms of `linked_dim` that co-occur with at least one of the terms of `dim` with the
+        given `codes`.
+        """
+        mask = np.zeros(len(self.term_ids.get(linked_dim, ())), dtype=bool)
+        if (dim, linked_dim) in self.links and len(codes) > 0:
+            mask[self.links[dim, linked_dim][codes].indices] = True
+        return mask
+
+    def to_arrays(self) -> Dict[str, np.ndarray]:
+        """
+        Return the graph as flat numpy arrays, see `from_arrays`.
+        """
+        dims = self.dims
+        arrays = {"dims": np.array(dims, dtype=str)}
+        for i, dim in enumerate(dims):
+            arrays[f"term_ids_{i}"] = np.array(self.term_ids[dim], dtype=str)
+        for (i, dim), (j, linked_dim) in permutations(enumerate(dims), 2):
+            matrix = self.links[dim, linked_dim]
+            arrays[f"indptr_{i}_{j}"] = matrix.indptr
+            arrays[f"indices_{i}_{j}"] = matrix.indices
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, arrays) -> "FilterRelationships":
+        """
+        Rebuild the graph from the arrays of `to_arrays`. The arrays are not copied, so they may be memory-mapped.
+        """
+        dims = [str(dim) for dim in arrays["dims"]]
+        term_ids = {dim: pd.Index(arrays[f"term_ids_{i}"], dtype=object) for i, dim in enumerate(dims)}
+        links = {}
+        for (i, dim), (j, linked_dim) in permutations(enumerate(dims), 2):
+            indices = arrays[f"indices_{i}_{j}"]
+            links[dim, linked_dim] = sparse.csr_matrix(
+                (np.ones(len(indices), dtype=bool), indices, arrays[f"indptr_{i}_{j}"]),
+                shape=(len(term_ids[dim]), len(term_ids[linked_dim])),
+            )
+        return cls(term_ids, links)
+
+    def save(self, file) -> None:
+        """
+        Write the graph to `file` (a path or a binary file object) as a compressed `.npz` archive.
+        """
+        np.savez_compressed(file, **self.to_arrays())
+
+    @classmethod
+    def load(cls, data: bytes) -> "FilterRelationships":
+        """
+        Read the graph from the content of a `.npz` archive written by `save`.
+        """
+        with np.load(io.BytesIO(data), allow_pickle=False) as arrays:
+            return cls.from_arrays({name: arrays[name] for name in arrays.files})
+
+    @classmethod
+    def from_cell_counts(cls, cell_counts_df: DataFrame) -> "FilterRelationships":
+        """
+        Build the graph of the filter values that co-occur in at least one row of `cell_counts_df`, over all of its
+        non-numeric columns.
+
+        Each column is factorized once into integer codes, and the links of each pair of columns are the distinct
+        (code, code) pairs of its rows, deduplicated by a sparse matrix rather than by comparing strings.
+        """
+        df_filters = cell_counts_df.select_dtypes(exclude="number")
+
+        term_ids: Dict[str, pd.Index] = {}
+        codes: Dict[str, np.ndarray] = {}
+        for dim in df_filters.columns:
+            dim_codes, dim_term_ids = pd.factorize(df_filters[dim], sort=True)
+            codes[dim] = dim_codes
+            term_ids[dim] = pd.Index(dim_term_ids, dtype=object)
+
+        links = {}
+        for dim, linked_dim in permutations(term_ids, 2):
+            # rows with a missing value in either column do not link the columns
+            is_valid = (codes[dim] >= 0) & (codes[linked_dim] >= 0)
+            links[dim, linked_dim] = _link_matrix(
+                codes[dim][is_valid], codes[linked_dim][is_valid], (len(term_ids[dim]), len(term_ids[linked_dim]))
+            )
+        return cls(term_ids, links)
+
+    @classmethod
+    def from_dict(cls, filter_relationships: Dict[str, Dict[str, List[str]]]) -> "FilterRelationships":
+        """
+        Build the graph from its legacy representation: a dictionary that maps each "<dim>__<term id>" to a
+        dictionary of the linked "<linked dim>__<term id>"s of each linked dimension.
+        """
+        edges = []
+        for key, linked_filters in filter_relationships.items():
+            dim, term_id = key.split("__", 1)
+            for linked_dim, linked_keys in linked_filters.items():
+                edges.extend((dim, term_id, linked_dim, linked_key.split("__", 1)[1]) for linked_key in linked_keys)
+        edges_df = pd.DataFrame(edges, columns=["dim", "term_id", "linked_dim", "linked_term_id"])
+
+        dims = sorted(set(edges_df["dim"]) | set(edges_df["linked_dim"]))
+        term_ids = {
+            dim: pd.Index(
+                sorted(
+                    set(edges_df.loc[edges_df["dim"] == dim, "term_id"])
+                    | set(edges_df.loc[edges_df["linked_dim"] == dim, "linked_term_id"])
+                ),
+                dtype=object,
+            )
+            for dim in dims
+        }
+        links = {}
+        for dim, linked_dim in permutations(dims, 2):
+            pair_edges = edges_df[(edges_df["dim"] == dim) & (edges_df["linked_dim"] == linked_dim)]
+            links[dim, linked_dim] = _link_matrix(
+                term_ids[dim].get_indexer(pair_edges["term_id"]),
+                term_ids[linked_dim].get_indexer(pair_edges["linked_term_id"]),
+                (len(term_ids[dim]), len(term_ids[linked_dim])),
+            )
+        return cls(term_ids, links)
+
+    def to_dict(self) -> Dict[str, Dict[str, List[str]]]:
+        """
+        Return the graph in its legacy representation, see `from_dict`.
+        """
+        filter_relationships: Dict[str, Dict[str, List[str]]] = {}
+        for (dim, linked_dim), matrix in self.links.items():
+            linked_keys = linked_dim + "__" + np.array(self.term_ids[linked_dim], dtype=object)
+            for code in np.flatnonzero(np.diff(matrix.indptr)):
+                row = matrix.indices[matrix.indptr[code] : matrix.indptr[code + 1]]
+                filter_relationships.setdefault(f"{dim}__{self.term_ids[dim][code]}", {})[linked_dim] = list(
+                    linked_keys[row]
+                )
+        return filter_relationships
+
+
+def _link_matrix(rows: np.ndarray, cols: np.ndarray, shape: Tuple[int, int]) -> sparse.csr_matrix:
+    matrix = sparse.csr_matrix((np.ones(len(rows), dtype=np.int32), (rows, cols)), shape=shape)
+    # converting from coordinates sums duplicate pairs and sorts the indices of each row
+    matrix.data = np.ones(matrix.nnz, dtype=bool)
+    return matrix
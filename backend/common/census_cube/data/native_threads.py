@@ -0,0 +1,56 @@
+import threading
+from concurrent.futures import Executor, ThreadPoolExecutor
+from functools import lru_cache
+
+import pyarrow as pa
+
+# Code that runs on the native threads of these pools must not contend for locks created by a `threading` module that
+# gevent has patched: gevent's locks deadlock when two native threads wait for them. Locks shared with native threads
+# are created with `native_lock` instead.
+
+
+def is_threading_patched() -> bool:
+    """
+    Return whether gevent has monkey-patched `threading`, as it does in the gevent workers that serve the APIs.
+    """
+    try:
+        from gevent import monkey
+    except ImportError:
+        return False
+    return monkey.is_module_patched("threading")
+
+
+def native_lock() -> threading.Lock:
+    """
+    Return a lock that native threads can contend for, even in gevent workers. The lock blocks the event loop thread
+    while a greenlet waits for it, so it must only guard short sections that do not yield to other greenlets.
+    """
+    if is_threading_patched():
+        from gevent import monkey
+
+        return monkey.get_original("threading", "Lock")()
+    return threading.Lock()
+
+
+def native_thread_pool(max_workers: int, thread_name_prefix: str = "") -> Executor:
+    """
+    Return a thread pool whose workers are native threads, even in gevent workers.
+
+    gevent workers patch `threading` to spawn greenlets, so a `ThreadPoolExecutor` would run its work one task at a
+    time on the event loop thread, and block every other request of the process while a task blocks in TileDB, pandas
+    or S3. When `threading` is patched, the work runs on gevent's pool of native threads instead, whose futures are
+    waited on without blocking the event loop.
+    """
+    if is_threading_patched():
+        from gevent.threadpool import ThreadPoolExecutor as GeventThreadPoolExecutor
+
+        _initialize_pyarrow_pandas_api()
+        return GeventThreadPoolExecutor(max_workers=max_workers)
+    return ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=thread_name_prefix)
+
+
+@lru_cache(maxsize=None)
+def _initialize_pyarrow_pandas_api() -> None:
+    # pyarrow imports pandas on its first conversion to pandas, under a lock of the patched `threading` module that
+    # the native threads converting TileDB reads at the same time would deadlock on
+    pa.array([]).to_pandas()
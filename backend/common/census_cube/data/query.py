@@ -1,24 +1,40 @@
+from concurrent.futures import Executor
+from functools import lru_cache
 from typing import Dict, List, Optional, Union
 
 import numpy as np
 import pandas as pd
+import pyarrow as pa
 from ddtrace import tracer
 from pandas import DataFrame
 from tiledb import Array
 
+from backend.common.census_cube.data.cell_counts_index import CellCountsIndex
 from backend.common.census_cube.data.criteria import (
     BaseQueryCriteria,
     CensusCubeQueryCriteria,
     MarkerGeneQueryCriteria,
 )
+from backend.common.census_cube.data.native_threads import native_thread_pool
+from backend.common.census_cube.data.query_plan import CubeQueryPlan, plan_cube_query
 from backend.common.census_cube.data.schemas.cube_schema_diffexp import cell_counts_indexed_dims
 from backend.common.census_cube.data.snapshot import CensusCubeSnapshot
 
 
 class CensusCubeQueryParams:
-    def __init__(self, cube_query_valid_attrs, cube_query_valid_dims):
+    def __init__(
+        self,
+        cube_query_valid_attrs,
+        cube_query_valid_dims,
+        read_partition_size: Optional[int] = None,
+        read_pool_size: int = 1,
+    ):
         self.cube_query_valid_attrs = cube_query_valid_attrs
         self.cube_query_valid_dims = cube_query_valid_dims
+        # reads of more than `read_partition_size` values of the leading cube dimension are split into partitions of
+        # at most that many values, which are read concurrently on a pool of `read_pool_size` threads
+        self.read_partition_size = read_partition_size
+        self.read_pool_size = read_pool_size
 
     def get_indexed_dims_to_lookup_query_criteria(self, cube: Array, pluralize: bool = True) -> list[str]:
         return [self._transform_cube_index_name(i.name, pluralize) for i in cube.schema.domain]
@@ -41,6 +57,10 @@ class CensusCubeQuery:
         self._snapshot = snapshot
         self._cube_query_params = cube_query_params
 
+    @property
+    def snapshot_identifier(self) -> str:
+        return self._snapshot.snapshot_identifier
+
     @tracer.wrap(name="expression_summary", service="wmg-api", resource="_query", span_type="wmg-api")
     def expression_summary(self, criteria: CensusCubeQueryCriteria, compare_dimension=None) -> DataFrame:
         return self._query(
@@ -49,6 +69,14 @@ class CensusCubeQuery:
             compare_dimension=compare_dimension,
         )
 
+    @tracer.wrap(name="expression_summary_table", service="wmg-api", resource="_query", span_type="wmg-api")
+    def expression_summary_table(self, criteria: CensusCubeQueryCriteria, compare_dimension=None) -> pa.Table:
+        return self._query_table(
+            cube=self._snapshot.expression_summary_cube,
+            criteria=criteria,
+            compare_dimension=compare_dimension,
+        )
+
     @tracer.wrap(name="expression_summary_default", service="wmg-api", resource="_query", span_type="wmg-api")
     def expression_summary_default(self, criteria: CensusCubeQueryCriteria) -> DataFrame:
         return self._query(
@@ -56,6 +84,13 @@ class CensusCubeQuery:
             criteria=criteria,
         )
 
+    @tracer.wrap(name="expression_summary_default_table", service="wmg-api", resource="_query", span_type="wmg-api")
+    def expression_summary_default_table(self, criteria: CensusCubeQueryCriteria) -> pa.Table:
+        return self._query_table(
+            cube=self._snapshot.expression_summary_default_cube,
+            criteria=criteria,
+        )
+
     @tracer.wrap(name="marker_genes", service="wmg-api", resource="_query", span_type="wmg-api")
     def marker_genes(self, criteria: MarkerGeneQueryCriteria) -> DataFrame:
         return self._query(
@@ -73,50 +108,79 @@ class CensusCubeQuery:
         cell_counts.rename(columns={"n_cells": "n_total_cells"}, inplace=True)  # expressed & non-expressed cells
         return cell_counts
 
+    @tracer.wrap(name="cell_counts_table", service="wmg-api", resource="_query", span_type="wmg-api")
+    def cell_counts_table(self, criteria: BaseQueryCriteria, compare_dimension=None) -> pa.Table:
+        cell_counts = self._query_table(
+            cube=self._snapshot.cell_counts_cube,
+            criteria=criteria.copy(exclude={"gene_ontology_term_ids"}),
+            compare_dimension=compare_dimension,
+        )
+        # expressed & non-expressed cells
+        return cell_counts.rename_columns(
+            ["n_total_cells" if name == "n_cells" else name for name in cell_counts.column_names]
+        )
+
     def cell_counts_df(self, criteria: BaseQueryCriteria) -> DataFrame:
         df = self._snapshot.cell_counts_df
-        mask = np.array([True] * len(df))
-        for key, values in dict(criteria).items():
-            values = values if isinstance(values, list) else [values]
-            key = depluralize(key)
-            if key in df.columns and values:
-                mask &= df[key].isin(values)
+        mask = self.cell_counts_index().mask(criteria_filters(criteria))
         return df[mask].rename(columns={"n_cells": "n_total_cells"})
 
     def cell_counts_diffexp_df(self, criteria: BaseQueryCriteria) -> DataFrame:
         df = self._snapshot.cell_counts_diffexp_df
-        mask = np.array([True] * len(df))
-        for key, values in dict(criteria).items():
-            values = values if isinstance(values, list) else [values]
-            key = depluralize(key)
-            if key in df.columns and values:
-                mask &= df[key].isin(values)
-
+        mask = self.cell_counts_diffexp_index().mask(criteria_filters(criteria))
         return df[mask].rename(columns={"n_cells": "n_total_cells"})
 
+    def cell_counts_index(self) -> CellCountsIndex:
+        # snapshots that are not built by the snapshot loader (e.g. test fixtures) are indexed on first use
+        if self._snapshot.cell_counts_index is None:
+            self._snapshot.cell_counts_index = CellCountsIndex(self._snapshot.cell_counts_df)
+        return self._snapshot.cell_counts_index
+
+    def cell_counts_diffexp_index(self) -> CellCountsIndex:
+        if self._snapshot.cell_counts_diffexp_index is None:
+            self._snapshot.cell_counts_diffexp_index = CellCountsIndex(self._snapshot.cell_counts_diffexp_df)
+        return self._snapshot.cell_counts_diffexp_index
+
     @tracer.wrap(
         name="expression_summary_and_cell_counts_diffexp", service="de-api", resource="_query", span_type="de-api"
     )
     def expression_summary_and_cell_counts_diffexp(
-        self, criteria: BaseQueryCriteria, use_simple: bool
+        self, criteria: BaseQueryCriteria, use_simple: bool, gene_ontology_term_ids: Optional[List[str]] = None
     ) -> tuple[DataFrame, DataFrame]:
+        """
+        Return the expression summary rows and the cell counts of the diffexp groups that match `criteria`.
+
+        If `gene_ontology_term_ids` is given, only the rows of those genes are read: the genes are applied as a query
+        condition of the read, which TileDB evaluates before the rows are copied out of the cube.
+        """
         cell_counts_diffexp_df = self.cell_counts_diffexp_df(criteria)
-        cell_counts_group_id_key = "group_id_simple" if use_simple else "group_id"
+        group_ids = diffexp_group_ids(cell_counts_diffexp_df, use_simple)
+        return (
+            self.expression_summary_diffexp(group_ids.tolist(), use_simple, gene_ontology_term_ids),
+            cell_counts_diffexp_df,
+        )
+
+    @tracer.wrap(name="expression_summary_diffexp", service="de-api", resource="_query", span_type="de-api")
+    def expression_summary_diffexp(
+        self, group_ids: List[int], use_simple: bool, gene_ontology_term_ids: Optional[List[str]] = None
+    ) -> DataFrame:
+        """
+        Return the expression summary rows of the diffexp groups `group_ids`, of the genes `gene_ontology_term_ids`
+        if given.
+        """
         cube = (
             self._snapshot.expression_summary_diffexp_simple_cube
             if use_simple
             else self._snapshot.expression_summary_diffexp_cube
         )
-        group_ids = cell_counts_diffexp_df[cell_counts_group_id_key].unique().tolist()
-        return (
-            pd.concat(
-                cube.query(
-                    return_incomplete=True,
-                    use_arrow=True,
-                    dims=["group_id"],
-                ).df[group_ids]
-            ),
-            cell_counts_diffexp_df,
+        cond = plan_cube_query(cube.schema, dict(gene_ontology_term_ids=gene_ontology_term_ids or [])).cond
+        return pd.concat(
+            cube.query(
+                cond=cond,
+                return_incomplete=True,
+                use_arrow=True,
+                dims=["group_id"],
+            ).df[group_ids]
         )
 
     # TODO: refactor for readability: https://app.zenhub.com/workspaces/single-cell-5e2a191dad828d52cc78b028/issues
@@ -127,34 +191,15 @@ class CensusCubeQuery:
         criteria: Union[BaseQueryCriteria, CensusCubeQueryCriteria, MarkerGeneQueryCriteria],
         compare_dimension=None,
     ) -> DataFrame:
-        indexed_dims = [dim.name for dim in cube.schema.domain]
-
-        query_cond = ""
-        attrs = {}
-        for attr_name, vals in criteria.dict(exclude=set(indexed_dims)).items():
-            attr = depluralize(attr_name)
-            if query_cond and len(vals) > 0:
-                query_cond += " and "
-            if len(vals) == 1 and vals[0] != "":
-                attrs[attr] = vals[0]
-                query_cond += f"{attr} == val('{vals[0]}')"
-            elif len(vals) > 1:
-                attrs[attr] = vals
-                query_cond += f"{attr} in {vals}"
-
-        tiledb_dims_query = []
-        criteria_dict = criteria.dict()
-        for dim_name in indexed_dims:
-            if dim_name not in criteria_dict:
-                dim_name = pluralize(dim_name)
-            if criteria_dict.get(dim_name, []):
-                tiledb_dims_query.append(criteria_dict[dim_name])
-            # If an "indexed" dimension is not included in the criteria,
-            # then all values will be selected.
-            else:
-                tiledb_dims_query.append([])
-
-        tiledb_dims_query = tuple(tiledb_dims_query)
+        return self._query_table(cube, criteria, compare_dimension).to_pandas()
+
+    def _query_table(
+        self,
+        cube: Array,
+        criteria: Union[BaseQueryCriteria, CensusCubeQueryCriteria, MarkerGeneQueryCriteria],
+        compare_dimension=None,
+    ) -> pa.Table:
+        plan = plan_cube_query(cube.schema, criteria.dict())
         numeric_attrs = [attr.name for attr in cube.schema if np.issubdtype(attr.dtype, np.number)]
 
         # get valid attributes from schema
@@ -173,19 +218,24 @@ class CensusCubeQuery:
         # if self._cube_query_params is None, then all dimensions are valid
         dims = self._cube_query_params.get_dims_for_cube_query(cube) if self._cube_query_params else None
 
-        query_result_df = pd.concat(
-            cube.query(
-                cond=query_cond or None,
-                return_incomplete=True,
-                use_arrow=True,
-                attrs=attrs,
-                dims=dims,
-            ).df[tiledb_dims_query]
-        )
-
-        return query_result_df
+        partition_size = self._cube_query_params.read_partition_size if self._cube_query_params else None
+        pool_size = self._cube_query_params.read_pool_size if self._cube_query_params else 1
+        partitions = plan.partitions(partition_size) if partition_size else [plan]
+        if len(partitions) == 1 or pool_size <= 1:
+            tables = [_read_cube(cube, partition, attrs, dims) for partition in partitions]
+        else:
+            # the TileDB core releases the GIL while reading, so the partitions are read concurrently. `map` returns
+            # the partitions in order, so the result does not depend on which read completes first.
+            tables = list(
+                _read_executor(pool_size).map(lambda partition: _read_cube(cube, partition, attrs, dims), partitions)
+            )
+        return pa.concat_tables(tables)
 
     def list_primary_filter_dimension_term_ids(self, primary_dim_name: str):
+        organism_term_ids = self._precomputed_primary_filter_dimension_term_ids(primary_dim_name)
+        if organism_term_ids is not None:
+            return sorted(set().union(*organism_term_ids.values()))
+
         return (
             self._snapshot.cell_counts_cube.query(attrs=[], dims=[primary_dim_name])
             .df[:]
@@ -197,6 +247,11 @@ class CensusCubeQuery:
     def list_grouped_primary_filter_dimensions_term_ids(
         self, primary_dim_name: str, group_by_dim: str
     ) -> Dict[str, List[str]]:
+        if group_by_dim == "organism_ontology_term_id":
+            organism_term_ids = self._precomputed_primary_filter_dimension_term_ids(primary_dim_name)
+            if organism_term_ids is not None:
+                return {organism: list(term_ids) for organism, term_ids in organism_term_ids.items()}
+
         return (
             self._snapshot.cell_counts_cube.query(attrs=[], dims=[primary_dim_name, group_by_dim])
             .df[:]
@@ -206,6 +261,55 @@ class CensusCubeQuery:
             .to_dict()[primary_dim_name]
         )
 
+    def _precomputed_primary_filter_dimension_term_ids(self, primary_dim_name: str) -> Optional[Dict[str, List[str]]]:
+        """
+        Return the term ids of `primary_dim_name` per organism from the snapshot artifact, or None if the snapshot
+        predates the artifact, in which case the term ids are read from the cell counts cube.
+        """
+        if self._snapshot.primary_filter_dimension_term_ids is None:
+            return None
+        return self._snapshot.primary_filter_dimension_term_ids.get(primary_dim_name)
+
+
+def _read_cube(cube: Array, plan: CubeQueryPlan, attrs: Optional[List[str]], dims: Optional[List[str]]) -> pa.Table:
+    # the chunks of the incomplete query are concatenated as Arrow tables, which does not copy them. The pandas
+    # metadata of each chunk describes the index of that chunk only, so it is dropped.
+    return pa.concat_tables(
+        cube.query(
+            cond=plan.cond,
+            return_incomplete=True,
+            use_arrow=True,
+            return_arrow=True,
+            attrs=attrs,
+            dims=dims,
+        ).df[plan.ranges]
+    ).replace_schema_metadata()
+
+
+@lru_cache(maxsize=None)
+def _read_executor(pool_size: int) -> Executor:
+    """
+    Return the thread pool, shared by all queries, that reads cube partitions concurrently.
+    """
+    return native_thread_pool(pool_size, thread_name_prefix="census-cube-read")
+
+
+def criteria_filters(criteria: BaseQueryCriteria) -> Dict[str, List[str]]:
+    """
+    Return the criteria as a mapping of (depluralized) dimension name to the list of term ids to filter by.
+    """
+    return {
+        depluralize(key): values if isinstance(values, list) else [values] for key, values in dict(criteria).items()
+    }
+
+
+def diffexp_group_ids(cell_counts_diffexp_df: DataFrame, use_simple: bool) -> np.ndarray:
+    """
+    Return the sorted, distinct ids of the diffexp groups of the cell counts, which index the rows of the simple
+    diffexp cube if `use_simple`, or of the diffexp cube otherwise.
+    """
+    return np.unique(cell_counts_diffexp_df["group_id_simple" if use_simple else "group_id"].to_numpy())
+
 
 def should_use_simple_group_ids(criteria: BaseQueryCriteria):
     return not any(
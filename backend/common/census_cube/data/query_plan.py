@@ -0,0 +1,85 @@
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple, Union
+
+import tiledb
+
+CriteriaValues = Union[str, List[str]]
+
+
+@dataclass(frozen=True)
+class CubeQueryPlan:
+    """
+    The TileDB read of a cube query.
+
+    `ranges` holds the term ids to slice each dimension of the cube by, in domain order. An empty list selects the
+    whole dimension. `cond` is the query condition applied to the attributes of the cells in those ranges, or None
+    if there are no attribute criteria.
+    """
+
+    ranges: Tuple[List[str], ...]
+    cond: Optional[str]
+
+    def partitions(self, partition_size: int) -> List["CubeQueryPlan"]:
+        """
+        Split the read into reads of at most `partition_size` consecutive ranges of the leading dimension (e.g.
+        gene ids), in order. A read that selects the whole leading dimension, or at most `partition_size` ranges of
+        it, is not split.
+        """
+        leading_ranges = self.ranges[0]
+        if len(leading_ranges) <= partition_size:
+            return [self]
+
+        return [
+            CubeQueryPlan(ranges=(leading_ranges[i : i + partition_size],) + self.ranges[1:], cond=self.cond)
+            for i in range(0, len(leading_ranges), partition_size)
+        ]
+
+
+def plan_cube_query(cube_schema: tiledb.ArraySchema, criteria: Dict[str, CriteriaValues]) -> CubeQueryPlan:
+    """
+    Split the query criteria into the dimension ranges and the attribute condition of the read of a cube.
+
+    Criteria on a dimension of the cube are only applied as ranges of the subarray, which TileDB uses to skip the
+    tiles that do not intersect them. All other criteria are compiled into a single query condition, which TileDB
+    evaluates on the attributes of the cells read from the subarray.
+
+    Args:
+        cube_schema (tiledb.ArraySchema): The schema of the cube to query.
+        criteria (Dict[str, CriteriaValues]): The query criteria, keyed by (possibly pluralized) dimension or
+            attribute name.
+
+    Returns:
+        CubeQueryPlan: The dimension ranges and attribute condition of the read.
+    """
+    dim_names = [dim.name for dim in cube_schema.domain]
+
+    ranges = {dim_name: [] for dim_name in dim_names}
+    clauses = []
+    for key, values in criteria.items():
+        name = key if key in ranges else _depluralize(key)
+        values = ([values] if values else []) if isinstance(values, str) else list(values)
+        if name in ranges:
+            # sorted, distinct ranges let TileDB merge them without re-sorting
+            ranges[name] = sorted(set(values))
+        elif clause := _condition_clause(name, values):
+            # criteria on names that are not in the schema are left for TileDB to reject
+            clauses.append(clause)
+
+    return CubeQueryPlan(
+        ranges=tuple(ranges[dim_name] for dim_name in dim_names),
+        cond=" and ".join(clauses) or None,
+    )
+
+
+def _condition_clause(attr_name: str, values: List[str]) -> Optional[str]:
+    # values are quoted with `repr`, which the query condition parser reads back as Python string literals, so term
+    # ids and citations that contain quotes are matched verbatim
+    if len(values) == 1 and values[0] != "":
+        return f"{attr_name} == val({values[0]!r})"
+    if len(values) > 1:
+        return f"{attr_name} in [{', '.join(repr(value) for value in values)}]"
+    return None
+
+
+def _depluralize(name: str) -> str:
+    return name[:-1] if name[-1] == "s" else name
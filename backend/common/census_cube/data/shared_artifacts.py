@@ -0,0 +1,143 @@
+import fcntl
+import logging
+import os
+import shutil
+from typing import Callable, Dict, Optional
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from pandas import DataFrame
+
+logger = logging.getLogger("wmg")
+
+# Snapshot artifacts are written as uncompressed Arrow IPC files, which are mapped into memory without decoding.
+# Every process that maps the same file shares its pages through the OS page cache.
+# Arrays are written as a directory of uncompressed `.npy` files, which are mapped into memory the same way.
+ARROW_FILE_SUFFIX = ".arrow"
+ARRAYS_DIR_SUFFIX = ".arrays"
+NPY_FILE_SUFFIX = ".npy"
+LOCK_FILENAME = ".lock"
+
+
+def share_dataframe(shared_dir: str, name: str, build: Callable[[], DataFrame]) -> DataFrame:
+    """
+    Return the DataFrame `name` backed by a read-only memory map of the Arrow file in `shared_dir`.
+
+    The first process on the host to ask for the DataFrame calls `build` and writes the result to the Arrow file.
+    Every other process maps the file, so the columns of the DataFrame are held in memory once per host rather than
+    once per process.
+
+    The string columns of the returned DataFrame are pyarrow-backed strings, and its numeric columns are read-only
+    views of the memory map.
+
+    Args:
+        shared_dir (str): The directory of the shared artifacts of the snapshot.
+        name (str): The name of the artifact.
+        build (Callable[[], DataFrame]): Builds the DataFrame if it has not been written yet.
+
+    Returns:
+        DataFrame: The memory-mapped DataFrame.
+    """
+    path = _materialize(
+        shared_dir,
+        f"{name}{ARROW_FILE_SUFFIX}",
+        lambda tmp_path: _write_table(tmp_path, pa.Table.from_pandas(build(), preserve_index=None)),
+    )
+    return _map_table(path).to_pandas(split_blocks=True, types_mapper=_string_types_mapper)
+
+
+def share_arrays(
+    shared_dir: str, name: str, build: Callable[[], Optional[Dict[str, np.ndarray]]]
+) -> Optional[Dict[str, np.ndarray]]:
+    """
+    Return the numpy arrays `name` as read-only memory maps of the `.npy` files in a directory of `shared_dir`. The
+    arrays are built and written by the first process on the host to ask for them, see `share_dataframe`.
+
+    Args:
+        shared_dir (str): The directory of the shared artifacts of the snapshot.
+        name (str): The name of the artifact.
+        build (Callable[[], Optional[Dict[str, np.ndarray]]]): Builds the arrays, keyed by name, if they have not
+            been written yet. May return None if the snapshot does not have the artifact, in which case nothing is
+            written and the next call builds the arrays again.
+
+    Returns:
+        Optional[Dict[str, np.ndarray]]: The memory-mapped arrays, or None if the snapshot does not have the
+            artifact.
+    """
+
+    def write(tmp_path: str):
+        arrays = build()
+        if arrays is None:
+            return False
+        os.makedirs(tmp_path)
+        for array_name, array in arrays.items():
+            np.save(os.path.join(tmp_path, f"{array_name}{NPY_FILE_SUFFIX}"), array, allow_pickle=False)
+        return True
+
+    path = _materialize(shared_dir, f"{name}{ARRAYS_DIR_SUFFIX}", write)
+    if path is None:
+        return None
+    return {
+        filename[: -len(NPY_FILE_SUFFIX)]: np.load(os.path.join(path, filename), mmap_mode="r", allow_pickle=False)
+        for filename in os.listdir(path)
+    }
+
+
+def _materialize(shared_dir: str, filename: str, write: Callable[[str], Optional[bool]]) -> Optional[str]:
+    """
+    Return the path of the file (or directory) `filename` in `shared_dir`, calling `write` with a temporary path to
+    write it first if it does not exist yet. `write` may return False if there is nothing to write, in which case
+    None is returned.
+
+    Neither a False from `write` nor an exception it raises is recorded, so that an artifact that could not be
+    built, e.g. because of a transient read error, is built again by the next process that asks for it, rather than
+    being missing for every process on the host until the shared files are deleted.
+
+    Processes that materialize the same file wait on a lock on `shared_dir` for the first one to write it, and the
+    file is moved into place only once it is complete, so a partially written file is never mapped.
+    """
+    path = os.path.join(shared_dir, filename)
+    if os.path.exists(path):
+        return path
+
+    os.makedirs(shared_dir, exist_ok=True)
+    with open(os.path.join(shared_dir, LOCK_FILENAME), "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            if os.path.exists(path):
+                return path
+
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            try:
+                written = write(tmp_path)
+                if written is False:
+                    return None
+                os.replace(tmp_path, path)
+            finally:
+                if os.path.isdir(tmp_path):
+                    shutil.rmtree(tmp_path)
+                elif os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+
+            logger.info(f"Materialized shared snapshot artifact {path}")
+            return path
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _map_table(path: str) -> pa.Table:
+    # the buffers of the table point into the memory map, which stays open for as long as they are referenced
+    return pa.ipc.open_file(pa.memory_map(path, "r")).read_all()
+
+
+def _string_types_mapper(arrow_type: pa.DataType) -> Optional[pd.api.extensions.ExtensionDtype]:
+    # strings are kept in their Arrow buffers, instead of being decoded into a Python object per row
+    if pa.types.is_string(arrow_type) or pa.types.is_large_string(arrow_type):
+        return pd.StringDtype("pyarrow")
+    return None
+
+
+def _write_table(path: str, table: pa.Table) -> None:
+    with pa.OSFile(path, "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table)
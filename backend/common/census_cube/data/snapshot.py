@@ -1,23 +1,33 @@
 import json
 import logging
 import os
+import threading
+import time
 from dataclasses import dataclass, field
-from typing import Dict, Optional
+from typing import Any, Callable, Dict, Iterable, List, Optional
 
 import pandas as pd
 import tiledb
 from ddtrace import tracer
+from flask import g, has_request_context
 from pandas import DataFrame
 from tiledb import Array
 
 from backend.common.census_cube.config import CensusCubeConfig
+from backend.common.census_cube.data.cell_counts_index import CellCountsIndex
+from backend.common.census_cube.data.cell_type_ancestors import CellTypeAncestorMatrix, build_cell_type_ancestor_matrix
 from backend.common.census_cube.data.constants import CENSUS_CUBE_SNAPSHOT_FS_CACHE_ROOT_PATH
+from backend.common.census_cube.data.cube_handles import CubeHandles, report_cube_handle_metrics
+from backend.common.census_cube.data.filter_relationships import FilterRelationships
+from backend.common.census_cube.data.native_threads import native_thread_pool
+from backend.common.census_cube.data.shared_artifacts import share_arrays, share_dataframe
 from backend.common.census_cube.data.tiledb import create_ctx
 from backend.common.utils.s3_buckets import buckets
 
 # Snapshot data artifact file/dir names
 CELL_TYPE_ORDERINGS_FILENAME = "cell_type_orderings.json"
 PRIMARY_FILTER_DIMENSIONS_FILENAME = "primary_filter_dimensions.json"
+PRIMARY_FILTER_DIMENSION_TERM_IDS_FILENAME = "primary_filter_dimension_term_ids.json"
 EXPRESSION_SUMMARY_CUBE_NAME = "expression_summary"
 EXPRESSION_SUMMARY_DEFAULT_CUBE_NAME = "expression_summary_default"
 CELL_COUNTS_CUBE_NAME = "cell_counts"
@@ -26,6 +36,7 @@ EXPRESSION_SUMMARY_DIFFEXP_SIMPLE_CUBE_NAME = "expression_summary_diffexp_simple
 CELL_COUNTS_DIFFEXP_CUBE_NAME = "cell_counts_diffexp"
 MARKER_GENES_CUBE_NAME = "marker_genes"
 FILTER_RELATIONSHIPS_FILENAME = "filter_relationships.json"
+FILTER_RELATIONSHIPS_CSR_FILENAME = "filter_relationships.npz"
 DATASET_METADATA_FILENAME = "dataset_metadata.json"
 CELL_TYPE_ANCESTORS_FILENAME = "cell_type_ancestors.json"
 
@@ -37,11 +48,65 @@ CENSUS_CUBE_ROOT_DIR_PATH = STACK_NAME.strip("/") if STACK_NAME else ""
 DEPLOYMENT_STAGE = os.environ.get("DEPLOYMENT_STAGE", "")
 SNAPSHOT_FS_ROOT_PATH = CENSUS_CUBE_SNAPSHOT_FS_CACHE_ROOT_PATH if (DEPLOYMENT_STAGE != "test") else None
 
+# number of snapshot artifacts that are read concurrently while loading a snapshot
+SNAPSHOT_LOAD_MAX_WORKERS = 8
+
+# When enabled, the cell counts DataFrames and the filter relationships of a snapshot are written once per host, as
+# Arrow and .npy files under SNAPSHOT_FS_ROOT_PATH, and every worker process maps them read-only instead of building
+# its own copy.
+SNAPSHOT_SHARED_MEMORY_ENABLED = os.environ.get("CENSUS_CUBE_SNAPSHOT_SHARED_MEMORY", "false").lower() == "true"
+SHARED_ARTIFACTS_DIR_NAME = "shared"
+
+SELF_REPORTED_ETHNICITY_DIM = "self_reported_ethnicity_ontology_term_id"
+
 logger = logging.getLogger("wmg")
 
 ###################################### PUBLIC INTERFACE #################################
 
 
+class LazyArtifact:
+    """
+    A snapshot artifact that is not read until it is first accessed.
+
+    Assigning a `LazyArtifact` to a lazily loaded field of `CensusCubeSnapshot` defers calling `load` until the
+    field is first read. The load time is recorded in `load_timings` under `name`.
+    """
+
+    def __init__(self, name: str, load: Callable[[], Any], load_timings: Optional[Dict[str, float]] = None):
+        self.name = name
+        self.load = load
+        self.load_timings = load_timings
+        self.lock = threading.Lock()
+
+
+class _LazyField:
+    """
+    Descriptor of a `CensusCubeSnapshot` field that may be assigned a `LazyArtifact`, which is loaded, once, on the
+    first read of the field. Any other value is stored and read as is.
+    """
+
+    def __set_name__(self, owner, name: str):
+        self._attr_name = f"_{name}"
+
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            # the default value of the dataclass field
+            return None
+
+        value = obj.__dict__.get(self._attr_name)
+        if not isinstance(value, LazyArtifact):
+            return value
+
+        with value.lock:
+            # another thread may have loaded the artifact while this one waited for the lock
+            if obj.__dict__.get(self._attr_name) is value:
+                obj.__dict__[self._attr_name] = _timed(value.name, value.load, value.load_timings)()
+        return obj.__dict__[self._attr_name]
+
+    def __set__(self, obj, value):
+        obj.__dict__[self._attr_name] = value
+
+
 @dataclass
 class CensusCubeSnapshot:
     """
@@ -85,31 +150,61 @@ class CensusCubeSnapshot:
     # precomputed list of ids for all gene and tissue ontology term ids per organism
     primary_filter_dimensions: Optional[Dict] = field(default=None)
 
+    # precomputed distinct term ids of each indexed dimension of the cell counts cube, per organism. None for
+    # snapshots that predate this artifact.
+    primary_filter_dimension_term_ids: Optional[Dict[str, Dict[str, List[str]]]] = field(default=None)
+
     # precomputed filter relationships graph
-    filter_relationships: Optional[Dict] = field(default=None)
+    filter_relationships: Optional[FilterRelationships] = field(default=None)
 
-    # dataset metadata dictionary
-    dataset_metadata: Optional[Dict] = field(default=None)
+    # dataset metadata dictionary, loaded on first access
+    dataset_metadata: Optional[Dict] = _LazyField()
 
     # cell type ancestors pandas Series
     cell_type_ancestors: Optional[pd.Series] = field(default=None)
 
+    # sparse ancestor-indicator matrix over the integer-coded cell types in `cell_counts_df`, used to roll up
+    # cell types without exploding rows across `cell_type_ancestors`
+    cell_type_ancestor_matrix: Optional[CellTypeAncestorMatrix] = field(default=None)
+
     # cell counts dataframe
     cell_counts_df: Optional[DataFrame] = field(default=None)
 
     # cell counts diffexp dataframe
     cell_counts_diffexp_df: Optional[DataFrame] = field(default=None)
 
+    # composite (comma-delimited) self reported ethnicity term ids of `cell_counts_df` that contain each atomic
+    # self reported ethnicity term id
+    self_reported_ethnicity_composite_term_ids: Optional[Dict[str, List[str]]] = field(default=None)
+
+    # integer-coded indexes over the dimensions of `cell_counts_df` and `cell_counts_diffexp_df`
+    cell_counts_index: Optional[CellCountsIndex] = field(default=None)
+    cell_counts_diffexp_index: Optional[CellCountsIndex] = field(default=None)
+
     # expression summary diffexp cube
     expression_summary_diffexp_cube: Optional[Array] = field(default=None)
 
     # expression summary diffexp simple cube
     expression_summary_diffexp_simple_cube: Optional[Array] = field(default=None)
 
+    # reference-counted handles of the cubes above, which closes them once the snapshot is replaced and drained
+    cube_handles: Optional[CubeHandles] = field(default=None)
+
+    # seconds spent loading each artifact of the snapshot, and the whole snapshot ("total"). Lazily loaded
+    # artifacts are added once they are first accessed.
+    load_timings: Optional[Dict[str, float]] = field(default=None)
+
 
 # Cached data
 cached_snapshot: Optional[CensusCubeSnapshot] = None
 
+# Serializes blocking snapshot loads on the request path so that concurrent requests arriving before
+# the first snapshot is cached do not each load their own copy of the snapshot.
+_snapshot_load_lock = threading.Lock()
+
+# Background thread that polls for snapshot id updates when a refresh TTL is configured.
+_snapshot_refresher: Optional["_SnapshotRefresher"] = None
+
 
 @tracer.wrap(name="load_snapshot", service="wmg-api", resource="query", span_type="wmg-api")
 def load_snapshot(
@@ -117,6 +212,7 @@ def load_snapshot(
     snapshot_schema_version: str,
     explicit_snapshot_id_to_load: Optional[str] = None,
     snapshot_fs_root_path: Optional[str] = SNAPSHOT_FS_ROOT_PATH,
+    snapshot_refresh_ttl_seconds: Optional[float] = None,
 ) -> CensusCubeSnapshot:
     """
     Loads and caches the snapshot identified by the snapshot schema version and a snapshot id.
@@ -128,10 +224,23 @@ def load_snapshot(
     The snapshot representation is cached in memory. Therefore, multiple calls to this function
     will simply return the cached snapshot if there isn't a newer snapshot id.
 
+    If `snapshot_refresh_ttl_seconds` is given, checking for a newer snapshot id is moved off the
+    request path: once a snapshot is cached, this function returns it without any disk or S3 access,
+    and a background thread checks for a newer snapshot id every `snapshot_refresh_ttl_seconds`
+    seconds. A newer snapshot is fully loaded by the background thread before it replaces the cached
+    snapshot with a single reference assignment. Callers that still hold the previous snapshot continue
+    to use it (and its open cubes) until they release it.
+
+    When called while handling a request, a reference to the cubes of the returned snapshot is held until
+    `release_request_snapshots` is called on request teardown. The cubes of a replaced snapshot are closed
+    once the last request that uses them completes.
+
     Args:
         snapshot_schema_version (str): The version of the snapshot schema.
         explicit_snapshot_id_to_load (str, optional): The explicit snapshot id to load. Defaults to None.
         snapshot_fs_root_path (str, optional): The root path of the snapshot on the local filesystem. Defaults to None.
+        snapshot_refresh_ttl_seconds (float, optional): The interval at which the background thread checks for
+            a newer snapshot id. Defaults to None, which checks for a newer snapshot id on every call.
 
     Returns:
         CensusCubeSnapshot: The loaded snapshot.
@@ -139,33 +248,258 @@ def load_snapshot(
     """
     global cached_snapshot
 
-    if not (
-        snapshot_fs_root_path
-        and _local_disk_snapshot_is_valid(
+    snapshot = cached_snapshot
+    if snapshot_refresh_ttl_seconds and _is_cached_snapshot_servable(
+        snapshot,
+        snapshot_schema_version=snapshot_schema_version,
+        explicit_snapshot_id_to_load=explicit_snapshot_id_to_load,
+    ):
+        return _hold_for_request(snapshot)
+
+    with _snapshot_load_lock:
+        resolved_snapshot_fs_root_path = _resolve_snapshot_fs_root_path(
             snapshot_fs_root_path=snapshot_fs_root_path,
             snapshot_schema_version=snapshot_schema_version,
             explicit_snapshot_id_to_load=explicit_snapshot_id_to_load,
         )
-    ):
-        snapshot_fs_root_path = None
 
-    should_reload, snapshot_id = _should_reload_snapshot(
+        should_reload, snapshot_id = _should_reload_snapshot(
+            snapshot_schema_version=snapshot_schema_version,
+            explicit_snapshot_id_to_load=explicit_snapshot_id_to_load,
+            snapshot_fs_root_path=resolved_snapshot_fs_root_path,
+        )
+
+        if should_reload:
+            _replace_cached_snapshot(
+                _load_snapshot(
+                    snapshot_schema_version=snapshot_schema_version,
+                    snapshot_id=snapshot_id,
+                    snapshot_fs_root_path=resolved_snapshot_fs_root_path,
+                )
+            )
+
+        # An explicit snapshot id never changes for the lifetime of the process, so there is nothing to poll for.
+        if snapshot_refresh_ttl_seconds and explicit_snapshot_id_to_load is None:
+            _start_snapshot_refresher(
+                snapshot_schema_version=snapshot_schema_version,
+                snapshot_fs_root_path=snapshot_fs_root_path,
+                ttl_seconds=snapshot_refresh_ttl_seconds,
+            )
+
+        return _hold_for_request(cached_snapshot)
+
+
+def release_request_snapshots(exception: Optional[BaseException] = None) -> None:
+    """
+    Release the references to the snapshot cubes held by the current request. Registered as a request teardown
+    function of the apps that serve snapshots.
+
+    Args:
+        exception (BaseException, optional): The exception that ended the request, if any. Unused.
+    """
+    for snapshot in g.pop("census_cube_snapshots", []):
+        snapshot.cube_handles.release()
+
+
+def report_snapshot_load_timings(snapshot: CensusCubeSnapshot) -> None:
+    """
+    Attach the load time of each artifact of the snapshot, in seconds, to the current trace, if any.
+
+    Args:
+        snapshot (CensusCubeSnapshot): The loaded snapshot.
+    """
+    span = tracer.current_root_span()
+    if span is None or not snapshot.load_timings:
+        return
+
+    for name, seconds in list(snapshot.load_timings.items()):
+        span.set_metric(f"census_cube.snapshot.load.{name}.seconds", seconds)
+
+
+def build_self_reported_ethnicity_composite_term_ids(term_ids: Iterable[str]) -> Dict[str, List[str]]:
+    """
+    Map each atomic self reported ethnicity term id to the composite term ids that contain it. A composite term id
+    encodes mixed ethnicities as the comma-delimited atomic term ids (e.g. "HANCESTRO:0005,HANCESTRO:0014").
+
+    Args:
+        term_ids (Iterable[str]): The distinct self reported ethnicity term ids.
+
+    Returns:
+        Dict[str, List[str]]: The sorted composite term ids that contain each atomic term id. Atomic term ids that
+            are not part of any composite term id are mapped to an empty list.
+    """
+    composite_term_ids: Dict[str, List[str]] = {}
+    for term_id in sorted(term_ids):
+        for atomic_term_id in term_id.split(","):
+            composite_term_ids.setdefault(atomic_term_id, [])
+            if atomic_term_id != term_id:
+                composite_term_ids[atomic_term_id].append(term_id)
+    return composite_term_ids
+
+
+###################################### PRIVATE INTERFACE #################################
+class _SnapshotRefresher(threading.Thread):
+    """
+    Daemon thread that periodically checks for a newer snapshot id and, if one is found, loads the
+    new snapshot and swaps it into `cached_snapshot`.
+
+    The new snapshot is fully built before it is published, so requests never observe a partially
+    loaded snapshot and are never blocked by a reload. The snapshot id check and the load run on native
+    threads, because gevent workers run this thread as a greenlet on the thread that serves the requests.
+    """
+
+    def __init__(self, *, snapshot_schema_version: str, snapshot_fs_root_path: Optional[str], ttl_seconds: float):
+        super().__init__(name="census-cube-snapshot-refresher", daemon=True)
+        self.snapshot_schema_version = snapshot_schema_version
+        self.snapshot_fs_root_path = snapshot_fs_root_path
+        self.ttl_seconds = ttl_seconds
+        self._stopped = threading.Event()
+
+    def run(self) -> None:
+        while not self._stopped.wait(self.ttl_seconds):
+            try:
+                self.refresh()
+            except Exception:
+                # Keep serving the cached snapshot; the next tick will retry.
+                logger.exception("Failed to refresh snapshot. Continuing to use the cached snapshot.")
+
+    def refresh(self) -> None:
+        # gevent workers run this thread as a greenlet on the event loop thread, so the latest snapshot id is read,
+        # like the snapshot itself, on a native thread
+        with native_thread_pool(1, thread_name_prefix="census-cube-snapshot-refresh") as executor:
+            snapshot_fs_root_path, (should_reload, snapshot_id) = executor.submit(self._check_latest_snapshot).result()
+        if should_reload:
+            snapshot = _load_snapshot(
+                snapshot_schema_version=self.snapshot_schema_version,
+                snapshot_id=snapshot_id,
+                snapshot_fs_root_path=snapshot_fs_root_path,
+            )
+            # Atomic swap. In-flight requests hold a reference to the previous snapshot, which keeps its cubes
+            # open until those requests complete.
+            _replace_cached_snapshot(snapshot)
+
+    def stop(self) -> None:
+        self._stopped.set()
+
+    def _check_latest_snapshot(self) -> tuple[Optional[str], tuple[bool, str]]:
+        snapshot_fs_root_path = _resolve_snapshot_fs_root_path(
+            snapshot_fs_root_path=self.snapshot_fs_root_path,
+            snapshot_schema_version=self.snapshot_schema_version,
+        )
+        return snapshot_fs_root_path, _should_reload_snapshot(
+            snapshot_schema_version=self.snapshot_schema_version,
+            snapshot_fs_root_path=snapshot_fs_root_path,
+        )
+
+
+def _replace_cached_snapshot(snapshot: CensusCubeSnapshot) -> None:
+    """
+    Publish `snapshot` as the cached snapshot and retire the cubes of the snapshot it replaces, which closes them
+    as soon as they are no longer in use.
+    """
+    global cached_snapshot
+
+    previous_snapshot, cached_snapshot = cached_snapshot, snapshot
+    if previous_snapshot is not None and previous_snapshot.cube_handles is not None:
+        previous_snapshot.cube_handles.retire()
+    report_cube_handle_metrics()
+
+
+def _hold_for_request(snapshot: CensusCubeSnapshot) -> CensusCubeSnapshot:
+    """
+    Take a reference to the cubes of `snapshot` for the duration of the current request, if any.
+
+    If the snapshot was replaced and drained between being read from the cache and being acquired, the
+    snapshot that replaced it is used instead.
+    """
+    if not has_request_context():
+        return snapshot
+
+    while snapshot.cube_handles is not None and not snapshot.cube_handles.acquire():
+        snapshot = cached_snapshot
+
+    if snapshot.cube_handles is not None:
+        g.setdefault("census_cube_snapshots", []).append(snapshot)
+        report_cube_handle_metrics()
+    return snapshot
+
+
+def _start_snapshot_refresher(
+    *, snapshot_schema_version: str, snapshot_fs_root_path: Optional[str], ttl_seconds: float
+) -> None:
+    """
+    Start the background snapshot refresher if it is not already running.
+
+    Must be called while holding `_snapshot_load_lock`.
+    """
+    global _snapshot_refresher
+
+    if _snapshot_refresher is not None and _snapshot_refresher.is_alive():
+        return
+
+    _snapshot_refresher = _SnapshotRefresher(
         snapshot_schema_version=snapshot_schema_version,
-        explicit_snapshot_id_to_load=explicit_snapshot_id_to_load,
         snapshot_fs_root_path=snapshot_fs_root_path,
+        ttl_seconds=ttl_seconds,
     )
+    _snapshot_refresher.start()
+    logger.info(f"Started snapshot refresher with TTL of {ttl_seconds} seconds")
 
-    if should_reload:
-        cached_snapshot = _load_snapshot(
-            snapshot_schema_version=snapshot_schema_version,
-            snapshot_id=snapshot_id,
-            snapshot_fs_root_path=snapshot_fs_root_path,
-        )
 
-    return cached_snapshot
+def _stop_snapshot_refresher() -> None:
+    global _snapshot_refresher
+
+    if _snapshot_refresher is not None:
+        _snapshot_refresher.stop()
+        _snapshot_refresher = None
+
+
+def _is_cached_snapshot_servable(
+    snapshot: Optional[CensusCubeSnapshot],
+    *,
+    snapshot_schema_version: str,
+    explicit_snapshot_id_to_load: Optional[str] = None,
+) -> bool:
+    """
+    Determine, without any disk or S3 access, whether the cached snapshot can be returned as is.
+
+    Args:
+        snapshot (Optional[CensusCubeSnapshot]): The cached snapshot.
+        snapshot_schema_version (str): The version of the snapshot schema.
+        explicit_snapshot_id_to_load (Optional[str]): The explicit snapshot id to load. Defaults to None.
+
+    Returns:
+        bool: True if the cached snapshot can be returned, False if it must be (re)loaded on the request path.
+    """
+    if snapshot is None or snapshot.snapshot_schema_version != snapshot_schema_version:
+        return False
+
+    if explicit_snapshot_id_to_load:
+        return snapshot.snapshot_identifier == explicit_snapshot_id_to_load
+
+    # the latest snapshot id is tracked by the background refresher
+    return _snapshot_refresher is not None and _snapshot_refresher.is_alive()
+
+
+def _resolve_snapshot_fs_root_path(
+    *,
+    snapshot_fs_root_path: Optional[str],
+    snapshot_schema_version: str,
+    explicit_snapshot_id_to_load: Optional[str] = None,
+) -> Optional[str]:
+    """
+    Return `snapshot_fs_root_path` if it contains a valid snapshot, otherwise None so that the snapshot is read from S3.
+    """
+    if snapshot_fs_root_path and _local_disk_snapshot_is_valid(
+        snapshot_fs_root_path=snapshot_fs_root_path,
+        snapshot_schema_version=snapshot_schema_version,
+        explicit_snapshot_id_to_load=explicit_snapshot_id_to_load,
+    ):
+        return snapshot_fs_root_path
+
+    return None
 
 
-###################################### PRIVATE INTERFACE #################################
 def _get_latest_snapshot_identifier_file_rel_path(snapshot_schema_version: str) -> str:
     """
     Get the relative path to the latest snapshot identifier file for a given snapshot schema version.
@@ -310,42 +644,146 @@ def _load_snapshot(
     """
 
     snapshot_rel_path = _get_wmg_snapshot_rel_path(snapshot_schema_version, snapshot_id)
-
-    cell_type_orderings = _load_cell_type_order(snapshot_rel_path, snapshot_fs_root_path)
-    primary_filter_dimensions = _load_primary_filter_data(snapshot_rel_path, snapshot_fs_root_path)
-    filter_relationships = _load_filter_graph_data(snapshot_rel_path, snapshot_fs_root_path)
-    cell_type_ancestors = _load_cell_type_ancestors(snapshot_rel_path, snapshot_fs_root_path)
-    dataset_metadata = _load_dataset_metadata(snapshot_rel_path, snapshot_fs_root_path)
-
     snapshot_uri = _get_wmg_snapshot_fullpath(snapshot_rel_path, snapshot_fs_root_path)
     logger.info(f"Loading WMG snapshot from absolute path: {snapshot_uri}")
 
-    # TODO: Okay to keep TileDB arrays open indefinitely? Is it faster than re-opening each request?
-    #  https://app.zenhub.com/workspaces/single-cell-5e2a191dad828d52cc78b028/issues/chanzuckerberg/single-cell
-    #  -data-portal/2134
-    cell_counts_cube = _open_cube(f"{snapshot_uri}/{CELL_COUNTS_CUBE_NAME}")
-    cell_counts_diffexp_cube = _open_cube(f"{snapshot_uri}/{CELL_COUNTS_DIFFEXP_CUBE_NAME}")
-    return CensusCubeSnapshot(
+    load_start = time.perf_counter()
+    load_timings: Dict[str, float] = {}
+
+    shared_artifacts_dir = _get_shared_artifacts_dir(snapshot_rel_path)
+
+    # Every blocking step of the load (S3 and TileDB reads, and the pandas and sparse matrix builds) runs on native
+    # threads, so that loading a snapshot in a gevent worker does not stall the requests it serves meanwhile.
+    with native_thread_pool(SNAPSHOT_LOAD_MAX_WORKERS, thread_name_prefix="census-cube-snapshot-load") as executor:
+        # The cubes are tracked by the snapshot's cube handles, which close them once the snapshot has been replaced
+        # and is no longer used by any request.
+        cube_handles = executor.submit(lambda: CubeHandles(snapshot_id, _create_cube_ctx())).result()
+
+        def load_cell_counts():
+            cell_counts_cube = cube_handles.open(f"{snapshot_uri}/{CELL_COUNTS_CUBE_NAME}")
+            cell_counts_df = _share_dataframe(
+                shared_artifacts_dir, CELL_COUNTS_CUBE_NAME, lambda: cell_counts_cube.df[:]
+            )
+            return cell_counts_cube, cell_counts_df, CellCountsIndex(cell_counts_df)
+
+        def load_cell_counts_diffexp():
+            cell_counts_diffexp_df = _share_dataframe(
+                shared_artifacts_dir,
+                CELL_COUNTS_DIFFEXP_CUBE_NAME,
+                lambda: cube_handles.open(f"{snapshot_uri}/{CELL_COUNTS_DIFFEXP_CUBE_NAME}").df[:],
+            )
+            return cell_counts_diffexp_df, CellCountsIndex(cell_counts_diffexp_df)
+
+        # Artifacts that are read by every query of the WMG or DE API are read concurrently, and the snapshot is
+        # not published before all of them are read, so that no request pays for reading them after a swap. Only the
+        # rarely used dataset metadata is read when it is first accessed.
+        eager_loads = {
+            "cell_type_orderings": lambda: _load_cell_type_order(snapshot_rel_path, snapshot_fs_root_path),
+            "primary_filter_dimensions": lambda: _load_primary_filter_data(snapshot_rel_path, snapshot_fs_root_path),
+            "primary_filter_dimension_term_ids": lambda: _load_primary_filter_dimension_term_ids(
+                snapshot_rel_path, snapshot_fs_root_path
+            ),
+            "cell_type_ancestors": lambda: _load_cell_type_ancestors(snapshot_rel_path, snapshot_fs_root_path),
+            "cell_counts": load_cell_counts,
+            "cell_counts_diffexp": load_cell_counts_diffexp,
+            "filter_relationships": lambda: _share_filter_relationships(
+                shared_artifacts_dir, lambda: _load_filter_graph_data(snapshot_rel_path, snapshot_fs_root_path)
+            ),
+            **{
+                cube_name: (lambda cube_name=cube_name: cube_handles.open(f"{snapshot_uri}/{cube_name}"))
+                for cube_name in [
+                    EXPRESSION_SUMMARY_CUBE_NAME,
+                    EXPRESSION_SUMMARY_DEFAULT_CUBE_NAME,
+                    MARKER_GENES_CUBE_NAME,
+                    EXPRESSION_SUMMARY_DIFFEXP_CUBE_NAME,
+                    EXPRESSION_SUMMARY_DIFFEXP_SIMPLE_CUBE_NAME,
+                ]
+            },
+        }
+
+        def build_derived_artifacts():
+            cell_counts_cube, cell_counts_df, cell_counts_index = artifacts["cell_counts"]
+            cell_type_ancestors = pd.Series(artifacts["cell_type_ancestors"])
+            cell_type_ancestor_matrix = _timed(
+                "cell_type_ancestor_matrix",
+                lambda: build_cell_type_ancestor_matrix(
+                    cell_type_ancestors, cell_counts_df["cell_type_ontology_term_id"].unique()
+                ),
+                load_timings,
+            )()
+            self_reported_ethnicity_composite_term_ids = _timed(
+                "self_reported_ethnicity_composite_term_ids",
+                lambda: build_self_reported_ethnicity_composite_term_ids(
+                    cell_counts_index.term_ids(SELF_REPORTED_ETHNICITY_DIM)
+                    if SELF_REPORTED_ETHNICITY_DIM in cell_counts_index
+                    else []
+                ),
+                load_timings,
+            )()
+            cell_type_orderings = (
+                artifacts["cell_type_orderings"]
+                .set_index(["tissue_ontology_term_id", "cell_type_ontology_term_id"])["order"]
+                .to_dict()
+            )
+            return (
+                cell_type_ancestors,
+                cell_type_ancestor_matrix,
+                self_reported_ethnicity_composite_term_ids,
+                cell_type_orderings,
+            )
+
+        try:
+            futures = {name: executor.submit(_timed(name, load, load_timings)) for name, load in eager_loads.items()}
+            artifacts = {name: future.result() for name, future in futures.items()}
+
+            cell_counts_cube, cell_counts_df, cell_counts_index = artifacts["cell_counts"]
+            cell_counts_diffexp_df, cell_counts_diffexp_index = artifacts["cell_counts_diffexp"]
+            (
+                cell_type_ancestors,
+                cell_type_ancestor_matrix,
+                self_reported_ethnicity_composite_term_ids,
+                cell_type_orderings,
+            ) = executor.submit(build_derived_artifacts).result()
+        except Exception:
+            cube_handles.close()
+            raise
+
+    snapshot = CensusCubeSnapshot(
         snapshot_identifier=snapshot_id,
         snapshot_schema_version=snapshot_schema_version,
-        expression_summary_cube=_open_cube(f"{snapshot_uri}/{EXPRESSION_SUMMARY_CUBE_NAME}"),
-        expression_summary_default_cube=_open_cube(f"{snapshot_uri}/{EXPRESSION_SUMMARY_DEFAULT_CUBE_NAME}"),
-        marker_genes_cube=_open_cube(f"{snapshot_uri}/{MARKER_GENES_CUBE_NAME}"),
+        expression_summary_cube=artifacts[EXPRESSION_SUMMARY_CUBE_NAME],
+        expression_summary_default_cube=artifacts[EXPRESSION_SUMMARY_DEFAULT_CUBE_NAME],
+        marker_genes_cube=artifacts[MARKER_GENES_CUBE_NAME],
         cell_counts_cube=cell_counts_cube,
-        cell_type_orderings=cell_type_orderings.set_index(["tissue_ontology_term_id", "cell_type_ontology_term_id"])[
-            "order"
-        ].to_dict(),
-        primary_filter_dimensions=primary_filter_dimensions,
-        filter_relationships=filter_relationships,
-        dataset_metadata=dataset_metadata,
-        cell_type_ancestors=pd.Series(cell_type_ancestors),
-        cell_counts_df=cell_counts_cube.df[:],
-        cell_counts_diffexp_df=cell_counts_diffexp_cube.df[:],
-        expression_summary_diffexp_cube=_open_cube(f"{snapshot_uri}/{EXPRESSION_SUMMARY_DIFFEXP_CUBE_NAME}"),
-        expression_summary_diffexp_simple_cube=_open_cube(
-            f"{snapshot_uri}/{EXPRESSION_SUMMARY_DIFFEXP_SIMPLE_CUBE_NAME}"
+        cell_type_orderings=cell_type_orderings,
+        primary_filter_dimensions=artifacts["primary_filter_dimensions"],
+        primary_filter_dimension_term_ids=artifacts["primary_filter_dimension_term_ids"],
+        filter_relationships=artifacts["filter_relationships"],
+        dataset_metadata=LazyArtifact(
+            "dataset_metadata",
+            lambda: _load_dataset_metadata(snapshot_rel_path, snapshot_fs_root_path),
+            load_timings,
         ),
+        cell_type_ancestors=cell_type_ancestors,
+        cell_type_ancestor_matrix=cell_type_ancestor_matrix,
+        cell_counts_df=cell_counts_df,
+        cell_counts_diffexp_df=cell_counts_diffexp_df,
+        cell_counts_diffexp_index=cell_counts_diffexp_index,
+        self_reported_ethnicity_composite_term_ids=self_reported_ethnicity_composite_term_ids,
+        cell_counts_index=cell_counts_index,
+        expression_summary_diffexp_cube=artifacts[EXPRESSION_SUMMARY_DIFFEXP_CUBE_NAME],
+        expression_summary_diffexp_simple_cube=artifacts[EXPRESSION_SUMMARY_DIFFEXP_SIMPLE_CUBE_NAME],
+        cube_handles=cube_handles,
+        load_timings=load_timings,
+    )
+
+    load_timings["total"] = time.perf_counter() - load_start
+    logger.info(
+        f"Loaded snapshot {snapshot_id} in {load_timings['total']:.2f}s: "
+        + ", ".join(f"{name}={seconds:.2f}s" for name, seconds in load_timings.items() if name != "total")
     )
+    report_snapshot_load_timings(snapshot)
+    return snapshot
 
 
 def _local_disk_snapshot_is_valid(
@@ -392,7 +830,56 @@ def _local_disk_snapshot_is_valid(
 
 
 def _open_cube(cube_uri) -> Array:
-    return tiledb.open(cube_uri, ctx=create_ctx(json.loads(CensusCubeConfig().tiledb_config_overrides)))
+    return tiledb.open(cube_uri, ctx=_create_cube_ctx())
+
+
+def _create_cube_ctx() -> tiledb.Ctx:
+    return create_ctx(json.loads(CensusCubeConfig().tiledb_config_overrides))
+
+
+def _get_shared_artifacts_dir(snapshot_rel_path: str) -> Optional[str]:
+    """
+    Return the directory of the memory-mapped artifacts of the snapshot, or None if the artifacts are not shared
+    between the worker processes of the host.
+    """
+    if not SNAPSHOT_SHARED_MEMORY_ENABLED or not SNAPSHOT_FS_ROOT_PATH:
+        return None
+    return os.path.join(SNAPSHOT_FS_ROOT_PATH, SHARED_ARTIFACTS_DIR_NAME, snapshot_rel_path)
+
+
+def _share_dataframe(shared_artifacts_dir: Optional[str], name: str, build: Callable[[], DataFrame]) -> DataFrame:
+    if shared_artifacts_dir is None:
+        return build()
+    return share_dataframe(shared_artifacts_dir, name, build)
+
+
+def _share_filter_relationships(
+    shared_artifacts_dir: Optional[str], build: Callable[[], Optional[FilterRelationships]]
+) -> Optional[FilterRelationships]:
+    if shared_artifacts_dir is None:
+        return build()
+
+    def build_arrays():
+        filter_relationships = build()
+        return None if filter_relationships is None else filter_relationships.to_arrays()
+
+    arrays = share_arrays(shared_artifacts_dir, "filter_relationships", build_arrays)
+    return None if arrays is None else FilterRelationships.from_arrays(arrays)
+
+
+def _timed(name: str, load: Callable[[], Any], load_timings: Optional[Dict[str, float]]) -> Callable[[], Any]:
+    """
+    Wrap `load` so that the seconds it takes are recorded in `load_timings` under `name`.
+    """
+
+    def timed_load():
+        start = time.perf_counter()
+        result = load()
+        if load_timings is not None:
+            load_timings[name] = time.perf_counter() - start
+        return result
+
+    return timed_load
 
 
 def _load_cell_type_order(snapshot_rel_path: str, snapshot_fs_root_path: Optional[str] = None) -> DataFrame:
@@ -405,6 +892,21 @@ def _load_primary_filter_data(snapshot_rel_path: str, snapshot_fs_root_path: Opt
     return json.loads(_read_wmg_data_file(rel_path, snapshot_fs_root_path))
 
 
+def _load_primary_filter_dimension_term_ids(
+    snapshot_rel_path: str, snapshot_fs_root_path: Optional[str] = None
+) -> Optional[Dict]:
+    try:
+        rel_path = f"{snapshot_rel_path}/{PRIMARY_FILTER_DIMENSION_TERM_IDS_FILENAME}"
+        return json.loads(_read_wmg_data_file(rel_path, snapshot_fs_root_path))
+    except Exception:
+        # snapshots created before the artifact was added fall back to scanning the cell counts cube
+        logger.warning(
+            f"{_get_wmg_snapshot_fullpath(snapshot_rel_path, snapshot_fs_root_path)}/"
+            f"{PRIMARY_FILTER_DIMENSION_TERM_IDS_FILENAME} could not be loaded"
+        )
+        return None
+
+
 def _load_dataset_metadata(snapshot_rel_path: str, snapshot_fs_root_path: Optional[str] = None) -> Dict:
     rel_path = f"{snapshot_rel_path}/{DATASET_METADATA_FILENAME}"
     return json.loads(_read_wmg_data_file(rel_path, snapshot_fs_root_path))
@@ -415,10 +917,19 @@ def _load_cell_type_ancestors(snapshot_rel_path: str, snapshot_fs_root_path: Opt
     return json.loads(_read_wmg_data_file(rel_path, snapshot_fs_root_path))
 
 
-def _load_filter_graph_data(snapshot_rel_path: str, snapshot_fs_root_path: Optional[str] = None) -> str:
+def _load_filter_graph_data(
+    snapshot_rel_path: str, snapshot_fs_root_path: Optional[str] = None
+) -> Optional[FilterRelationships]:
+    try:
+        rel_path = f"{snapshot_rel_path}/{FILTER_RELATIONSHIPS_CSR_FILENAME}"
+        return FilterRelationships.load(_read_wmg_binary_data_file(rel_path, snapshot_fs_root_path))
+    except Exception:
+        # snapshots created before the graph was stored in its integer-coded form only have the JSON graph
+        logger.info(f"{FILTER_RELATIONSHIPS_CSR_FILENAME} could not be loaded, loading {FILTER_RELATIONSHIPS_FILENAME}")
+
     try:
         rel_path = f"{snapshot_rel_path}/{FILTER_RELATIONSHIPS_FILENAME}"
-        return json.loads(_read_wmg_data_file(rel_path, snapshot_fs_root_path))
+        return FilterRelationships.from_dict(json.loads(_read_wmg_data_file(rel_path, snapshot_fs_root_path)))
     except Exception:
         logger.warning(
             f"{_get_wmg_snapshot_fullpath(snapshot_rel_path)}/{FILTER_RELATIONSHIPS_FILENAME} could not be loaded"
@@ -450,6 +961,25 @@ def _read_wmg_data_file(rel_path: str, snapshot_fs_root_path: Optional[str] = No
     return _read_value_at_s3_key(key_path=rel_path)
 
 
+def _read_wmg_binary_data_file(rel_path: str, snapshot_fs_root_path: Optional[str] = None) -> bytes:
+    """
+    Read binary file from local disk if snapshot_fs_root_path is provided. Otherwise, read from S3.
+    See `_read_wmg_data_file`.
+
+    Args:
+        rel_path (str): The relative path of the file to read.
+        snapshot_fs_root_path (Optional[str]): The root path of the snapshot in the filesystem. Defaults to None.
+
+    Returns:
+        bytes: The content of the file.
+    """
+    if snapshot_fs_root_path:
+        with open(os.path.join(snapshot_fs_root_path, rel_path), "rb") as f:
+            return f.read()
+
+    return _read_bytes_at_s3_key(key_path=rel_path)
+
+
 def _read_value_at_s3_key(key_path: str) -> str:
     """
     Read value at an s3 key
@@ -460,13 +990,17 @@ def _read_value_at_s3_key(key_path: str) -> str:
     Returns:
         str: The value read from the specified S3 key path.
     """
+    return _read_bytes_at_s3_key(key_path).decode("utf-8").strip()
+
+
+def _read_bytes_at_s3_key(key_path: str) -> bytes:
     s3 = buckets.portal_resource
 
     wmg_config = CensusCubeConfig()
     wmg_config.load()
 
     s3obj = s3.Object(wmg_config.bucket, key_path)
-    return s3obj.get()["Body"].read().decode("utf-8").strip()
+    return s3obj.get()["Body"].read()
 
 
 def _should_reload_snapshot(
@@ -1,14 +1,17 @@
 from functools import lru_cache
-from typing import Dict, Optional
+from typing import Dict, Iterable, List, Optional, Tuple
 
 import numba as nb
 import numpy as np
 import pandas as pd
 import requests
-from cellxgene_ontology_guide.ontology_parser import OntologyParser
+from cellxgene_ontology_guide.ontology_parser import VALID_NON_ONTOLOGY_TERMS, OntologyParser
 from requests.adapters import HTTPAdapter
+from scipy import sparse
 from urllib3.util import Retry
 
+from backend.common.census_cube.data.cell_type_ancestors import CellTypeAncestorMatrix, build_cell_type_ancestor_matrix
+from backend.common.census_cube.data.filter_relationships import FilterRelationships
 from backend.common.census_cube.data.snapshot import CensusCubeSnapshot
 
 # exported and used by all modules related to the census cube
@@ -16,80 +19,71 @@ ontology_parser = OntologyParser()
 
 
 def find_all_dim_option_values(snapshot, organism: str, dimension: str) -> list:
-    organism_key = "organism_ontology_term_id__" + organism
-    all_filter_options = snapshot.filter_relationships[organism_key].get(dimension, [])
-    return [option.split("__")[1] for option in all_filter_options]
+    filter_relationships = snapshot.filter_relationships
+    organism_codes = filter_relationships.codes("organism_ontology_term_id", [organism])
+    options = filter_relationships.linked("organism_ontology_term_id", organism_codes, dimension)
+    return filter_relationships.term_ids[dimension][options].tolist() if options.any() else []
 
 
 def find_dim_option_values(criteria: Dict, snapshot, dimension: str) -> list:
     """Find values for the specified dimension that satisfy the given filtering criteria,
     ignoring any criteria specified for the given dimension."""
+    return find_dims_option_values(criteria, snapshot, [dimension])[depluralize(dimension)]
 
-    filter_options_criteria = dict(criteria)
-    # Remove gene_ontology_term_ids from the criteria as it is not an eligible cross-filter dimension.
-    filter_options_criteria.pop("gene_ontology_term_ids", None)
 
-    # depluralize `dimension` if necessary
-    dimension = depluralize(dimension)
+def find_dims_option_values(criteria: Dict, snapshot, dimensions: List[str]) -> Dict[str, list]:
+    """Find the values of each of the specified dimensions that satisfy the given filtering criteria, ignoring any
+    criteria specified for that dimension.
 
-    # each element  in `linked_filter_sets` corresponds to the set of filters linked to the attributes specified for a corresponding criteria key
-    linked_filter_sets = []
+    The options of a dimension are the terms of that dimension that co-occur with at least one of the values of every
+    other criteria key. For each criteria key and dimension, the terms linked to the values of the key are a single
+    row lookup in the sparse matrix of links between the two dimensions of the filter relationships graph, and the
+    options are the intersection of those masks.
 
-    # `all_criteria_attributes` is the set of all attributes specified across all criteria
-    all_criteria_attributes = set()
+    Since the filter relationships graph is symmetric, every option is linked back to a value specified in the
+    criteria, so the options do not need to be checked for loop back links."""
 
-    for key in filter_options_criteria:
-        attrs = filter_options_criteria[key]
+    filter_relationships = snapshot.filter_relationships
 
-        # depluralize `key` if necessary
-        key = depluralize(key)
+    filter_options_criteria = dict(criteria)
+    # Remove gene_ontology_term_ids from the criteria as it is not an eligible cross-filter dimension.
+    filter_options_criteria.pop("gene_ontology_term_ids", None)
 
-        # ignore the criteria for the specified dimension
-        if key != dimension:
-            if isinstance(attrs, list):
-                if len(attrs) > 0:
-                    # prepend the key to each attribute value
-                    prefixed_attributes = [key + "__" + val for val in attrs]
-                    all_criteria_attributes = all_criteria_attributes.union(prefixed_attributes)
-
-                    # for each attribute (attr) in `prefixed_attributes`,
-                    # get the set of filters for the specified dimension that are linked to `attr`
-                    linked_filter_set = set()
-                    for attr in prefixed_attributes:
-                        if dimension in snapshot.filter_relationships.get(attr, {}):
-                            linked_filter_set = linked_filter_set.union(
-                                set(snapshot.filter_relationships[attr][dimension])
-                            )
-
-                    linked_filter_sets.append(linked_filter_set)
-            else:
-                if attrs != "":
-                    prefixed_attribute = key + "__" + attrs
-                    all_criteria_attributes.add(prefixed_attribute)
-                    if dimension in snapshot.filter_relationships.get(prefixed_attribute, {}):
-                        linked_filter_sets.append(set(snapshot.filter_relationships[prefixed_attribute][dimension]))
-
-    # the candidate options are the intersection of the sets of linked filters for each criteria key
-    if len(linked_filter_sets) > 1:
-        candidate_options = linked_filter_sets[0].intersection(*linked_filter_sets[1:])
-    else:
-        candidate_options = linked_filter_sets[0]
+    dimensions = [depluralize(dimension) for dimension in dimensions]
 
-    # each valid option MUST be linked to at least one attribute specified in the criteria
-    # otherwise, there will be no data to display if that particular option is selected because
-    # the intersection will be null.
-    valid_options = []
-    for v in candidate_options:
-        loop_back_options = snapshot.filter_relationships.get(v, {})
-        all_loop_back_options = []
-        for dim in loop_back_options:
-            all_loop_back_options.extend(loop_back_options[dim])
+    # for each criteria key and dimension, the mask of the terms of the dimension that are linked to at least one
+    # of the values specified for the key
+    linked_masks: Dict[str, Dict[str, np.ndarray]] = {}
+    for key, attrs in filter_options_criteria.items():
+        key = depluralize(key)
+        if isinstance(attrs, list):
+            if len(attrs) > 0:
+                codes = filter_relationships.codes(key, attrs)
+                linked_masks[key] = {
+                    dimension: filter_relationships.linked(key, codes, dimension) for dimension in dimensions
+                }
+        elif attrs != "":
+            # a single value that is not linked to a dimension does not restrict the options of that dimension
+            codes = filter_relationships.codes(key, [attrs])
+            linked_masks[key] = {}
+            for dimension in dimensions:
+                mask = filter_relationships.linked(key, codes, dimension)
+                if mask.any():
+                    linked_masks[key][dimension] = mask
+
+    option_values = {}
+    for dimension in dimensions:
+        dimension_linked_masks = [
+            linked_masks[key][dimension] for key in linked_masks if key != dimension and dimension in linked_masks[key]
+        ]
+        if not dimension_linked_masks:
+            option_values[dimension] = []
+            continue
 
-        if len(set(all_loop_back_options).intersection(all_criteria_attributes)) > 0:
-            valid_options.append(v)
+        options = np.logical_and.reduce(dimension_linked_masks)
+        option_values[dimension] = filter_relationships.term_ids[dimension][options].tolist() if options.any() else []
 
-    # remove the prefix from each valid option and return the result
-    return [option.split("__")[1] for option in valid_options]
+    return option_values
 
 
 def depluralize(x):
@@ -115,43 +109,12 @@ def setup_retry_session(retries=3, backoff_factor=2, status_forcelist=(500, 502,
     return session
 
 
-def build_filter_relationships(cell_counts_df: pd.DataFrame):
-    # get a dataframe of the columns that are not numeric
-    df_filters = cell_counts_df.select_dtypes(exclude="number")
-    # get a numpy array of the column names with shape (1, n_cols)
-    cols = df_filters.columns.values[None, :]
-
-    # tile the column names row-wise to match the shape of the dataframe and concatenate to the values
-    # this ensures that filter values will never collide across columns.
-    mat = np.tile(cols, (cell_counts_df.shape[0], 1)) + "__" + df_filters.values
-
-    # for each cell, get all pairwise combinations of filters compresent in that cell
-    # these are the edges of the filter relationships graph
-    Xs = []
-    Ys = []
-    for i in range(mat.shape[0]):
-        Xs.extend(np.repeat(mat[i], mat[i].size))
-        Ys.extend(np.tile(mat[i], mat[i].size))
-
-    # get all the unique combinations of filters
-    Xs, Ys = np.unique(np.array((Xs, Ys)), axis=1)
-
-    # exclude self-relationships
-    filt = Xs != Ys
-    Xs, Ys = Xs[filt], Ys[filt]
-
-    # convert the edges to a linked list representation
-    filter_relationships_linked_list = to_dict(Xs, Ys)
-
-    # reorganize the linked list representation to a nested linked list representation
-    # where the filter columns are separated into distinct dictionaries
-    # e.g. instead of {"cell_type_ontology_term_id__beta cell": ["dataset_id__Single cell transcriptome analysis of human pancreas", "assay_ontology_term_id__assay_type", ...], ...},
-    # it's now {"cell_type_ontology_term_id__beta cell": {"dataset_id": ["dataset_id__Single cell transcriptome analysis of human pancreas", ...], "assay_ontology_term_id": ["assay_ontology_term_id__assay_type", ...], ...}, ...}.
-    # This structure is easier to parse by the `/query` endpoint.
-    for k, v in filter_relationships_linked_list.items():
-        filter_relationships_linked_list[k] = to_dict([x.split("__")[0] for x in v], v)
-
-    return filter_relationships_linked_list
+def build_filter_relationships(cell_counts_df: pd.DataFrame) -> FilterRelationships:
+    """
+    Build the graph of the filter values (the values of the non-numeric columns) that co-occur in at least one row of
+    the cell counts dataframe. See `FilterRelationships`.
+    """
+    return FilterRelationships.from_cell_counts(cell_counts_df)
 
 
 def to_dict(a, b):
@@ -246,6 +209,142 @@ def ancestors(cell_type):
         return [cell_type]
 
 
+@lru_cache(maxsize=None)
+def _cell_type_ontology_closure(ontology_version: str) -> CellTypeAncestorMatrix:
+    cell_type_ontology = ontology_parser.cxg_schema.ontology("CL")
+    cell_type_ancestors = pd.Series(
+        {cell_type: [*metadata["ancestors"], cell_type] for cell_type, metadata in cell_type_ontology.items()},
+        dtype=object,
+    )
+    # like `ancestors` and `descendants`, the non-ontology terms have no relatives, not even themselves
+    for term in VALID_NON_ONTOLOGY_TERMS:
+        cell_type_ancestors[term] = []
+    return build_cell_type_ancestor_matrix(cell_type_ancestors, cell_type_ancestors.index)
+
+
+def cell_type_ontology_closure(cell_types: Optional[Iterable[str]] = None) -> CellTypeAncestorMatrix:
+    """
+    Return the ancestor-indicator matrix of the transitive closure of the cell type ontology, built once per ontology
+    version. Row i holds the ancestors (including self) of the i-th cell type, so column j holds its descendants.
+
+    Cell types that are not in the ontology are their own only ancestor and descendant, like in `ancestors` and
+    `descendants`. They are added to the returned matrix if they are in `cell_types`.
+    """
+    closure = _cell_type_ontology_closure(ontology_parser.cxg_schema.version)
+    return closure if cell_types is None else closure.with_cell_types(cell_types)
+
+
+def get_cell_type_descendant_matrix(cell_types) -> sparse.csr_matrix:
+    """
+    Batch version of `find_descendants_per_cell_type`: the valid descendants of every cell type in the input list
+    as the rows of a sparse boolean matrix.
+
+    Row i holds the positions in `cell_types` of the valid descendants (including self) of the i-th cell type, in
+    ascending order. Like in `get_valid_descendants`, a suffixed cell type "{term};;{suffix}" only has descendants
+    with the same suffix.
+
+    Parameters
+    ----------
+    cell_types : list
+        List of cell types (cell type ontology term IDs, potentially suffixed)
+
+    Returns
+    -------
+    descendant_matrix : scipy.sparse.csr_matrix
+        Boolean matrix of shape (len(cell_types), len(cell_types)).
+    """
+    cell_types = np.asarray(cell_types, dtype=object)
+    inverse, unique_cell_types = pd.factorize(cell_types)
+    n_unique_cell_types = len(unique_cell_types)
+
+    terms = pd.Series(unique_cell_types, dtype=object).str.partition(";;")
+    closure = cell_type_ontology_closure(terms[0].unique())
+    term_codes = closure.codes(terms[0])
+    suffix_codes, suffixes = pd.factorize(terms[2])
+    n_suffixes = len(suffixes)
+
+    # the (descendant, ancestor) pairs of the unique cell types, joined on the ancestor term and the suffix
+    ancestor_pairs = closure.ancestors[term_codes].tocoo()
+    descendants = ancestor_pairs.row
+    ancestor_keys = ancestor_pairs.col.astype(np.int64) * n_suffixes + suffix_codes[descendants]
+    cell_type_keys = pd.Index(term_codes.astype(np.int64) * n_suffixes + suffix_codes)
+    ancestors = cell_type_keys.get_indexer(ancestor_keys)
+    is_valid = ancestors >= 0
+
+    unique_descendant_matrix = _indicator_matrix(
+        ancestors[is_valid], descendants[is_valid], (n_unique_cell_types, n_unique_cell_types)
+    )
+    if n_unique_cell_types == len(cell_types):
+        # the unique cell types are in the order of the input list
+        return unique_descendant_matrix
+
+    # expand the rows and columns of the unique cell types to the positions of all of their occurrences
+    occurrences = _indicator_matrix(inverse, np.arange(len(cell_types)), (n_unique_cell_types, len(cell_types)))
+    return _as_indicator((unique_descendant_matrix[inverse] @ occurrences).tocsr())
+
+
+def are_cell_types_not_redundant_nodes_array(cell_types, cell_counts) -> np.ndarray:
+    """
+    Batch version of `are_cell_types_not_redundant_nodes`.
+
+    Args:
+    - cell_types (list of str): A list of cell type names.
+    - cell_counts (dict): A dictionary mapping cell type names to the number of cells of that type.
+
+    Returns:
+    - is_not_redundant (np.ndarray of bool): Whether each cell type is not a redundant node.
+    """
+    cell_types = np.asarray(cell_types, dtype=object)
+    inverse, unique_cell_types = pd.factorize(cell_types)
+    descendant_matrix = get_cell_type_descendant_matrix(unique_cell_types).tocoo()
+
+    # cell types without a cell count never have the same number of cells as their descendants
+    counts = np.array([cell_counts.get(cell_type, np.nan) for cell_type in unique_cell_types], dtype=float)
+    ancestors, descendants = descendant_matrix.row, descendant_matrix.col
+    is_same_count = (ancestors != descendants) & (counts[ancestors] == counts[descendants])
+
+    is_not_redundant = np.diff(descendant_matrix.tocsr().indptr) > 0
+    is_not_redundant[ancestors[is_same_count]] = False
+    return is_not_redundant[inverse]
+
+
+def are_cell_types_colinear_array(cell_types1, cell_types2) -> np.ndarray:
+    """
+    Batch version of `are_cell_types_colinear`, elementwise over the (broadcast) input arrays.
+
+    Arguments
+    ---------
+    cell_types1 : array-like of str
+        Cell types 1 (cell type ontology term ids)
+    cell_types2 : array-like of str
+        Cell types 2 (cell type ontology term ids)
+    Returns
+    -------
+    np.ndarray of bool
+    """
+    cell_types1, cell_types2 = np.broadcast_arrays(
+        np.asarray(cell_types1, dtype=object), np.asarray(cell_types2, dtype=object)
+    )
+    closure = cell_type_ontology_closure(np.unique(np.concatenate([cell_types1.ravel(), cell_types2.ravel()])))
+    codes1 = closure.codes(cell_types1.ravel())
+    codes2 = closure.codes(cell_types2.ravel())
+
+    is_colinear = (closure.ancestors[codes1, codes2] != 0) | (closure.ancestors[codes2, codes1] != 0)
+    return np.asarray(is_colinear).reshape(cell_types1.shape)
+
+
+def _indicator_matrix(rows: np.ndarray, cols: np.ndarray, shape: Tuple[int, int]) -> sparse.csr_matrix:
+    return _as_indicator(sparse.csr_matrix((np.ones(len(rows), dtype=np.int32), (rows, cols)), shape=shape))
+
+
+def _as_indicator(matrix: sparse.csr_matrix) -> sparse.csr_matrix:
+    # duplicate entries are summed by the constructor and products; the matrix is an indicator
+    matrix.sum_duplicates()
+    matrix.sort_indices()
+    matrix.data = np.ones(matrix.nnz, dtype=bool)
+    return matrix
+
+
 def get_valid_descendants(
     cell_type: str, valid_cell_types: frozenset[str], cell_counts: Optional[dict[str, int]] = None
 ):
@@ -413,14 +512,15 @@ def rollup_across_cell_type_descendants(
     """
     Aggregate values for each cell type across its descendants in the input dataframe.
 
-    The non-numeric columns in the input dataframe must contain cell type ontology term IDs,
-    and are treated as the dimensions of a multi-dimensional numpy array. The numeric data in
-    the dataframe is slotted into this array and rolled up along the first axis (which will always
-    correspond to the cell type ontology term IDs). The resulting rolled up array is reshaped back
-    into the tidy dataframe and returned.
+    The rows are grouped by the combination of their non-numeric columns other than the cell type column,
+    and the numeric columns are only rolled up across the cell types within each group. This ensures that
+    cell types are only rolled up within each combination of other dimensions (e.g. tissue, gene, organism).
+    We wouldn't want to roll up expressions across genes and tissues.
 
-    This ensures that cell types are only rolled up within each combination of other dimensions
-    (e.g. tissue, gene, organism). We wouldn't want to roll up expressions across genes and tissues.
+    Each numeric column is slotted into a sparse (cell type x group) matrix, which holds only the combinations
+    present in the dataframe, and is rolled up by multiplying it with the sparse descendant matrix of the cell
+    types (see `get_cell_type_descendant_matrix`). The rolled up values are read back for each row of the
+    dataframe.
 
     Parameters
     ----------
@@ -433,8 +533,7 @@ def rollup_across_cell_type_descendants(
         Name of the column in the input dataframe containing the cell type ontology term IDs.
 
     parallel : bool, optional, default=True
-        If True, uses numba's `prange` to parallelize the rollup operation.
-        Set to False if invoking this function in parallel subprocesses.
+        Unused. Kept for compatibility with the callers of the dense, numba-parallelized rollup.
 
     ignore_cols : list, optional, default=None
         List of column names to ignore when rolling up the numeric columns.
@@ -448,39 +547,34 @@ def rollup_across_cell_type_descendants(
     df = df.copy()
     # numeric data
     numeric_df = df.select_dtypes(include="number")
-    # non-numeric data
-    dimensions_df = df.select_dtypes(exclude="number")
-    # move the cell type column to the front of the dataframe
-    cell_type_column = dimensions_df.pop(cell_type_col)
-    dimensions_df.insert(0, cell_type_col, cell_type_column)
-
-    # calculate integer indices for each non-numeric column in the input dataframe
-    # and calculate the shape of the output array
-    dim_indices = []
-    dim_shapes = []
-    for col in dimensions_df.columns:
-        # map each unique value in the column to an integer index
-        dim = dimensions_df[col].to_numpy()
-        unique_dim = dimensions_df[col].unique()
-        indices = pd.Series(data=range(len(unique_dim)), index=unique_dim)[dim].to_numpy()
-        dim_shapes.append(len(unique_dim))
-        dim_indices.append(indices)
-    # the last dimension corresponds to the numeric columns
-    dim_shapes.append(numeric_df.shape[1])
-    dim_shapes = tuple(dim_shapes)
-    array_to_sum = np.zeros(dim_shapes)
-    # slot the numeric data into the multi-dimensional numpy array
-
-    array_to_sum[tuple(dim_indices)] = numeric_df.to_numpy()
-    cell_types = cell_type_column.unique()
-
-    summed = rollup_across_cell_type_descendants_array(array_to_sum, cell_types, parallel=parallel)
-    # extract numeric data and write back into the dataframe
-    summed = summed[tuple(dim_indices)]
+    # non-numeric data, other than the cell types
+    group_df = df.select_dtypes(exclude="number").drop(columns=cell_type_col)
+
+    cell_type_codes, cell_types = pd.factorize(df[cell_type_col])
+    if group_df.shape[1] > 0:
+        group_codes = group_df.groupby(list(group_df.columns), sort=False, dropna=False).ngroup().to_numpy()
+    else:
+        group_codes = np.zeros(len(df), dtype=np.int64)
+    shape = (len(cell_types), int(group_codes.max()) + 1 if len(df) > 0 else 0)
+
+    # like assigning the rows into a dense array, the last of the rows with the same cell type and group wins
+    is_last = ~pd.Series(cell_type_codes.astype(np.int64) * shape[1] + group_codes).duplicated(keep="last").to_numpy()
+    descendant_matrix = get_cell_type_descendant_matrix(cell_types).astype(np.float64)
+
     dtypes = numeric_df.dtypes
-    for col, array in zip(numeric_df.columns, summed.T, strict=False):
-        if ignore_cols and col not in ignore_cols or not ignore_cols:
-            df[col] = array.astype(dtypes[col])
+    for col in numeric_df.columns:
+        if ignore_cols and col in ignore_cols:
+            continue
+        values = sparse.csr_matrix(
+            (
+                numeric_df[col].to_numpy(dtype=np.float64)[is_last],
+                (cell_type_codes[is_last], group_codes[is_last]),
+            ),
+            shape=shape,
+        )
+        summed = descendant_matrix @ values
+        # extract numeric data and write back into the dataframe
+        df[col] = np.asarray(summed[cell_type_codes, group_codes]).ravel().astype(dtypes[col])
 
     return df
 
@@ -508,20 +602,12 @@ def rollup_across_cell_type_descendants_array(array_to_sum, cell_types, parallel
     summed : numpy array
         Multi-dimensional numpy array aggregated across the cell type's descendants.
     """
-    descendants = find_descendants_per_cell_type(cell_types)
-    # a pandas series to map cell types to their index in the input arrays
-    indexer = pd.Series(index=cell_types, data=range(len(cell_types)))
-    descendants_indexes = [indexer[children].to_numpy() for children in descendants]
-    # flatten the descendant indices into a single array and create a linear
-    # index array for slicing out the descendants per cell type. The array
-    # must be flattened to satisfy numba type requirements.
-    z = 0
-    linear_indices = [z]
-    for ix in descendants_indexes:
-        z += len(ix)
-        linear_indices.append(z)
-    linear_indices = np.array(linear_indices)
-    descendants_indexes = np.concatenate(descendants_indexes)
+    # the rows of the descendant matrix hold the indices of the descendants of each cell type. Its flat column
+    # indices and row offsets are the slices of descendants per cell type, flattened to satisfy numba type
+    # requirements.
+    descendant_matrix = get_cell_type_descendant_matrix(cell_types)
+    descendants_indexes = descendant_matrix.indices
+    linear_indices = descendant_matrix.indptr
 
     # roll up the multi-dimensional array across cell types (first axis)
     summed = np.zeros_like(array_to_sum)
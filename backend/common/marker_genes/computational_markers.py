@@ -12,7 +12,7 @@ from tqdm import tqdm
 
 from backend.common.census_cube.data.snapshot import CensusCubeSnapshot
 from backend.common.census_cube.utils import (
-    are_cell_types_colinear,
+    are_cell_types_colinear_array,
     get_all_cell_type_ids_in_corpus,
     get_overlapping_cell_type_descendants,
     rollup_across_cell_type_descendants,
@@ -216,9 +216,10 @@ class MarkerGenesCalculator:
         cell_type_target = cell_types_o[i]
 
         indexer = pd.Series(index=cell_types_o, data=np.arange(cell_types_o.size))
+        is_colinear = are_cell_types_colinear_array(cell_types_o, cell_type_target)
 
         for j, cell_type in enumerate(cell_types_o):
-            if cell_type_target == cell_type or are_cell_types_colinear(cell_type, cell_type_target):
+            if cell_type_target == cell_type or is_colinear[j]:
                 continue
 
             overlapping_descendants = get_overlapping_cell_type_descendants(cell_type, cell_type_target)
@@ -243,7 +244,6 @@ class MarkerGenesCalculator:
         unique_cols = np.where(~filter_genes)[0]
 
         # filter out rows that are colinear with the cell type target and filter out invalid genes
-        is_colinear = np.array([are_cell_types_colinear(cell_type, cell_type_target) for cell_type in cell_types_o])
         effects_sub = effects[~is_colinear][:, unique_cols]
 
         return effects_sub, unique_cols
@@ -422,7 +422,7 @@ class MarkerGenesCalculator:
                     cell_type = cell_types_o[iteration]
 
                     effect_size = effect_sizes[iteration]
-                    not_colinear = np.array([not are_cell_types_colinear(ct, cell_type) for ct in cell_types_o])
+                    not_colinear = ~are_cell_types_colinear_array(cell_types_o, cell_type)
 
                     specificity = calculate_specificity_excluding_nans(effect_size, effect_sizes[not_colinear])
                     ranked_genes_df = pd.DataFrame()
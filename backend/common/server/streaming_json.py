@@ -0,0 +1,182 @@
+"""Streaming JSON responses.
+
+A response payload is serialized one member at a time while it is sent, rather than being built in full as nested
+dictionaries, serialized into a single string and then copied into the response. The members of a payload that are
+`JSONObjectStream`s or `JSONArrayStream`s are produced lazily from their iterables, so only the member being written
+is held in memory.
+
+Responses are compressed with the best encoding accepted by the client: brotli, if the optional `brotli` package is
+installed, or gzip.
+"""
+
+import zlib
+from typing import Any, Callable, Iterable, Iterator, Optional, Tuple
+
+from ddtrace import tracer
+from flask import Response, current_app, request, stream_with_context
+
+from backend.common.utils.json import CustomJSONEncoder
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# the size of the chunks of serialized JSON that are compressed and sent at once
+JSON_CHUNK_SIZE = 64 * 1024
+GZIP_COMPRESS_LEVEL = 6
+BROTLI_QUALITY = 5
+
+# keys are sorted, as for `jsonify` with JSON_SORT_KEYS, and NaNs are written as NaN, as `jsonify` does
+_encoder = CustomJSONEncoder(sort_keys=True, separators=(",", ":"))
+
+
+class JSONObjectStream:
+    """
+    A JSON object whose (key, value) members are produced lazily by `items`, and written in the order they are
+    produced.
+    """
+
+    def __init__(self, items: Iterable[Tuple[str, Any]]):
+        self.items = items
+
+
+class JSONArrayStream:
+    """
+    A JSON array whose elements are produced lazily by `values`.
+    """
+
+    def __init__(self, values: Iterable[Any]):
+        self.values = values
+
+
+def iter_json(obj: Any, chunk_size: int = JSON_CHUNK_SIZE) -> Iterator[bytes]:
+    """
+    Serialize `obj` to UTF-8 encoded JSON, in chunks of about `chunk_size` bytes.
+
+    `JSONObjectStream`s and `JSONArrayStream`s are written one member at a time, and every other value is
+    serialized in one piece, so the largest string held in memory is the serialization of a single member.
+    """
+    pieces = []
+    size = 0
+    for piece in _iter_json_pieces(obj):
+        pieces.append(piece)
+        size += len(piece)
+        if size >= chunk_size:
+            yield "".join(pieces).encode()
+            pieces = []
+            size = 0
+    if pieces:
+        yield "".join(pieces).encode()
+
+
+def streaming_json_response(
+    obj: Any, on_body: Optional[Callable[[bytes], None]] = None, max_body_bytes: Optional[int] = None
+) -> Response:
+    """
+    Return a response that streams the JSON serialization of `obj`, compressed with the best content encoding
+    accepted by the client.
+
+    Args:
+        obj (Any): The payload of the response.
+        on_body (Callable[[bytes], None], optional): Called with the whole uncompressed body once it has been sent,
+            e.g. to cache it.
+        max_body_bytes (int, optional): `on_body` is not called for bodies larger than this, so that they do not
+            have to be kept in memory while they are sent.
+
+    Returns:
+        Response: The streaming response.
+    """
+    chunks = iter_json(obj)
+    if on_body is not None:
+        chunks = _collect_body(chunks, on_body, max_body_bytes)
+    return _stream_response(chunks)
+
+
+def json_bytes_response(body: bytes) -> Response:
+    """
+    Return a response that streams the already serialized JSON `body`, compressed with the best content encoding
+    accepted by the client.
+    """
+    return _stream_response(body[i : i + JSON_CHUNK_SIZE] for i in range(0, len(body), JSON_CHUNK_SIZE))
+
+
+######################### PRIVATE FUNCTIONS IN ALPHABETICAL ORDER ##################################
+
+
+def _collect_body(
+    chunks: Iterator[bytes], on_body: Callable[[bytes], None], max_body_bytes: Optional[int]
+) -> Iterator[bytes]:
+    collected = []
+    size = 0
+    for chunk in chunks:
+        size += len(chunk)
+        if max_body_bytes is None or size <= max_body_bytes:
+            collected.append(chunk)
+        else:
+            collected.clear()
+        yield chunk
+
+    if max_body_bytes is None or size <= max_body_bytes:
+        on_body(b"".join(collected))
+
+
+def _compress(chunks: Iterator[bytes], content_encoding: str) -> Iterator[bytes]:
+    if content_encoding == "br":
+        compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        compress, flush = compressor.process, compressor.finish
+    else:
+        # a gzip container, rather than a raw zlib stream
+        compressor = zlib.compressobj(GZIP_COMPRESS_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        compress, flush = compressor.compress, compressor.flush
+
+    for chunk in chunks:
+        compressed = compress(chunk)
+        if compressed:
+            yield compressed
+    yield flush()
+
+
+def _stream_response(chunks: Iterator[bytes]) -> Response:
+    accepted_encodings = ["br", "gzip"] if brotli is not None else ["gzip"]
+    content_encoding = request.accept_encodings.best_match(accepted_encodings)
+    if content_encoding is not None:
+        chunks = _compress(chunks, content_encoding)
+    chunks = _traced(chunks)
+
+    response = current_app.response_class(stream_with_context(chunks), mimetype="application/json")
+    # the body is streamed as it is written, so it is not read into memory to build the response
+    response.direct_passthrough = True
+    if content_encoding is not None:
+        response.headers["Content-Encoding"] = content_encoding
+    response.vary.add("Accept-Encoding")
+    return response
+
+
+def _traced(chunks: Iterator[bytes]) -> Iterator[bytes]:
+    # the body is written after the headers are sent, so the time it takes can only be traced, and not reported in
+    # the Server-Timing header
+    with tracer.trace("serialize_response", resource="serialize response") as span:
+        n_bytes = 0
+        for chunk in chunks:
+            n_bytes += len(chunk)
+            yield chunk
+        span.set_metric("bytes", n_bytes)
+
+
+def _iter_json_pieces(obj: Any) -> Iterator[str]:
+    if isinstance(obj, JSONObjectStream):
+        yield "{"
+        for i, (key, value) in enumerate(obj.items):
+            yield f'{"," if i > 0 else ""}{_encoder.encode(str(key))}:'
+            yield from _iter_json_pieces(value)
+        yield "}"
+    elif isinstance(obj, JSONArrayStream):
+        yield "["
+        for i, value in enumerate(obj.values):
+            if i > 0:
+                yield ","
+            yield from _iter_json_pieces(value)
+        yield "]"
+    else:
+        yield _encoder.encode(obj)
@@ -1,3 +1,5 @@
+from backend.common.utils.math_utils import MB
+
 # When this config flag is set, the API will load the snapshot
 # from the local disk. When the flag is False, the API
 # will load the snapshot from S3
@@ -22,3 +24,18 @@ CENSUS_CUBE_API_SNAPSHOT_SCHEMA_VERSION = "v5"
 # loaded must belong to the schema version set
 # in CENSUS_CUBE_API_SNAPSHOT_SCHEMA_VERSION
 CENSUS_CUBE_API_FORCE_LOAD_SNAPSHOT_ID = None
+
+# Interval, in seconds, at which a background thread checks whether
+# the latest snapshot id has changed and hot-swaps in the new snapshot.
+# Requests are served from the in-memory snapshot without checking
+# the latest snapshot id on disk or S3.
+#
+# Set to None to check the latest snapshot id on every request instead.
+CENSUS_CUBE_API_SNAPSHOT_REFRESH_TTL_SECONDS = 60
+
+# Maximum total size of the per-gene statistics of query sides kept in the
+# in-memory cache of each API worker, so that a side that is repeated across
+# queries, e.g. the same background, is not read again. Cached statistics are
+# keyed by snapshot id and criteria, so entries for a replaced snapshot are
+# never hit again and age out of the cache.
+CENSUS_CUBE_API_GROUP_STATISTICS_CACHE_MAX_BYTES = 256 * MB
@@ -0,0 +1,203 @@
+"""This module contains the sufficient statistics of the differential expression tests, and their in-memory cache.
+
+The t-test of a differential expression query only depends on the number of cells of each of its two sides, and on
+the sum and the squared sum of the expression of each gene in the diffexp groups of each side. Many queries repeat
+one side of the comparison, e.g. the cells of a whole tissue as the background, so the statistics of a side are
+cached by a key made up of the snapshot id and the canonicalized criteria of the side. The groups a side shares
+with the other side are excluded from it by subtracting their statistics from the statistics of the whole side.
+"""
+
+import json
+import threading
+from collections import OrderedDict
+from typing import List, NamedTuple, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from backend.common.census_cube.data.criteria import BaseQueryCriteria
+from backend.common.census_cube.data.query import CensusCubeQuery
+
+######################### PUBLIC FUNCTIONS IN ALPHABETICAL ORDER ##################################
+
+
+class GroupStatistics(NamedTuple):
+    """
+    The sufficient statistics of the t-test of a set of diffexp groups.
+
+    `sums` and `sqsums` hold the sum and the squared sum of the expression of each gene of `genes` over the cells of
+    the groups, and `gene_rows` the number of expression summary rows of each gene they were reduced from.
+    """
+
+    n_cells: int
+    genes: np.ndarray
+    sums: np.ndarray
+    sqsums: np.ndarray
+    gene_rows: np.ndarray
+
+    @property
+    def n_rows(self) -> int:
+        return int(self.gene_rows.sum())
+
+    @property
+    def nbytes(self) -> int:
+        return (
+            int(pd.Series(self.genes).memory_usage(deep=True, index=False))
+            + self.sums.nbytes
+            + self.sqsums.nbytes
+            + self.gene_rows.nbytes
+        )
+
+
+def align_group_statistics(statistics: List[GroupStatistics]) -> Tuple[np.ndarray, List[GroupStatistics]]:
+    """
+    Return the union of the genes of `statistics`, and each of `statistics` over these genes.
+
+    The genes are coded as integers in a single pass, and the per-gene vectors of each statistics are scattered into
+    dense vectors over these codes, with zeros for the genes it does not have.
+    """
+    gene_codes, genes = pd.factorize(np.concatenate([s.genes for s in statistics]))
+    offsets = np.cumsum([0] + [len(s.genes) for s in statistics])
+    aligned = []
+    for s, start, end in zip(statistics, offsets[:-1], offsets[1:], strict=False):
+        codes = gene_codes[start:end]
+        aligned.append(
+            GroupStatistics(
+                n_cells=s.n_cells,
+                genes=genes,
+                sums=np.bincount(codes, weights=s.sums, minlength=len(genes)),
+                sqsums=np.bincount(codes, weights=s.sqsums, minlength=len(genes)),
+                gene_rows=np.bincount(codes, weights=s.gene_rows, minlength=len(genes)).astype(np.int64),
+            )
+        )
+    return genes, aligned
+
+
+def build_group_statistics_cache_key(
+    snapshot_id: str,
+    criteria: BaseQueryCriteria,
+    use_simple: bool,
+    gene_ontology_term_ids: Optional[List[str]],
+) -> str:
+    """
+    Build a canonical cache key for the statistics of one side of a differential expression query.
+
+    The criteria are expected to be expanded to the descendants of their cell types already. Filter values, and the
+    gene ids, are sorted because their order does not affect the statistics.
+    """
+    canonical_criteria = {
+        key: (sorted(values) if isinstance(values, list) else values) for key, values in criteria.dict().items()
+    }
+    return json.dumps(
+        dict(
+            snapshot_id=snapshot_id,
+            criteria=canonical_criteria,
+            use_simple=use_simple,
+            gene_ontology_term_ids=sorted(gene_ontology_term_ids) if gene_ontology_term_ids is not None else None,
+        ),
+        sort_keys=True,
+        separators=(",", ":"),
+    )
+
+
+def read_group_statistics(
+    q: CensusCubeQuery,
+    group_ids: np.ndarray,
+    n_cells: int,
+    use_simple: bool,
+    gene_ontology_term_ids: Optional[List[str]],
+) -> GroupStatistics:
+    """
+    Read the expression summary rows of the diffexp groups `group_ids` and reduce them into the statistics of the
+    groups.
+    """
+    if len(group_ids) == 0:
+        return GroupStatistics(
+            n_cells=n_cells,
+            genes=np.array([], dtype=object),
+            sums=np.zeros(0),
+            sqsums=np.zeros(0),
+            gene_rows=np.zeros(0, dtype=np.int64),
+        )
+
+    es = q.expression_summary_diffexp(group_ids.tolist(), use_simple, gene_ontology_term_ids)
+    gene_codes, genes = pd.factorize(es["gene_ontology_term_id"].to_numpy())
+    return GroupStatistics(
+        n_cells=n_cells,
+        genes=genes,
+        sums=np.bincount(gene_codes, weights=es["sum"].to_numpy(dtype=np.float64), minlength=len(genes)),
+        sqsums=np.bincount(gene_codes, weights=es["sqsum"].to_numpy(dtype=np.float64), minlength=len(genes)),
+        gene_rows=np.bincount(gene_codes, minlength=len(genes)),
+    )
+
+
+def subtract_group_statistics(statistics: GroupStatistics, subset: GroupStatistics) -> GroupStatistics:
+    """
+    Return the statistics of the groups of `statistics` that are not groups of `subset`, whose groups must be a subset
+    of them. The cells of the groups of `subset` are still counted in `n_cells`.
+
+    The genes that only have rows in the groups of `subset` are dropped, rather than kept with the rounding errors of
+    the subtraction of their sums.
+    """
+    genes, (aligned, aligned_subset) = align_group_statistics([statistics, subset])
+    gene_rows = aligned.gene_rows - aligned_subset.gene_rows
+    has_rows = gene_rows > 0
+    return GroupStatistics(
+        n_cells=statistics.n_cells,
+        genes=genes[has_rows],
+        sums=(aligned.sums - aligned_subset.sums)[has_rows],
+        sqsums=(aligned.sqsums - aligned_subset.sqsums)[has_rows],
+        gene_rows=gene_rows[has_rows],
+    )
+
+
+class GroupStatisticsCache:
+    """
+    Thread-safe LRU cache of group statistics, bounded by the total size in bytes of the cached statistics.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.n_bytes = 0
+        self._entries: OrderedDict[str, GroupStatistics] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str) -> Optional[GroupStatistics]:
+        with self._lock:
+            statistics = self._entries.get(key)
+            if statistics is not None:
+                self._entries.move_to_end(key)
+            return statistics
+
+    def put(self, key: str, statistics: GroupStatistics) -> None:
+        size = _entry_size(key, statistics)
+        # statistics that are larger than the whole cache would evict everything and still not fit
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            previous_statistics = self._entries.pop(key, None)
+            if previous_statistics is not None:
+                self.n_bytes -= _entry_size(key, previous_statistics)
+
+            self._entries[key] = statistics
+            self.n_bytes += size
+
+            while self.n_bytes > self.max_bytes:
+                evicted_key, evicted_statistics = self._entries.popitem(last=False)
+                self.n_bytes -= _entry_size(evicted_key, evicted_statistics)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.n_bytes = 0
+
+
+######################### PRIVATE FUNCTIONS IN ALPHABETICAL ORDER ##################################
+
+
+def _entry_size(key: str, statistics: GroupStatistics) -> int:
+    return len(key) + statistics.nbytes
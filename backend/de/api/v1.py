@@ -1,4 +1,4 @@
-from typing import Any, Dict, Iterable, List, Tuple
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
 
 import connexion
 import numpy as np
@@ -6,19 +6,39 @@ import pandas as pd
 from ddtrace import tracer
 from flask import jsonify
 from scipy import stats
-from server_timing import Timing as ServerTiming
 
 from backend.common.census_cube.data.criteria import BaseQueryCriteria
 from backend.common.census_cube.data.ontology_labels import gene_term_label, ontology_term_label
-from backend.common.census_cube.data.query import CensusCubeQuery, should_use_simple_group_ids
-from backend.common.census_cube.data.schemas.cube_schema_diffexp import cell_counts_logical_dims_exclude_dataset_id
+from backend.common.census_cube.data.query import (
+    CensusCubeQuery,
+    criteria_filters,
+    depluralize,
+    diffexp_group_ids,
+    should_use_simple_group_ids,
+)
 from backend.common.census_cube.data.snapshot import CensusCubeSnapshot, load_snapshot
 from backend.common.census_cube.utils import ancestors, descendants
 from backend.common.marker_genes.marker_gene_files.blacklist import marker_gene_blacklist
+from backend.common.server.stage_timing import timed_stage
+from backend.common.server.streaming_json import JSONArrayStream, JSONObjectStream, streaming_json_response
 from backend.de.api.config import (
     CENSUS_CUBE_API_FORCE_LOAD_SNAPSHOT_ID,
+    CENSUS_CUBE_API_GROUP_STATISTICS_CACHE_MAX_BYTES,
+    CENSUS_CUBE_API_SNAPSHOT_REFRESH_TTL_SECONDS,
     CENSUS_CUBE_API_SNAPSHOT_SCHEMA_VERSION,
 )
+from backend.de.api.group_statistics import (
+    GroupStatistics,
+    GroupStatisticsCache,
+    align_group_statistics,
+    build_group_statistics_cache_key,
+    read_group_statistics,
+    subtract_group_statistics,
+)
+
+DE_API_SERVICE = "de-api"
+
+group_statistics_cache = GroupStatisticsCache(max_bytes=CENSUS_CUBE_API_GROUP_STATISTICS_CACHE_MAX_BYTES)
 
 
 @tracer.wrap(name="filters", service="wmg-api", resource="filters", span_type="wmg-api")
@@ -28,13 +48,14 @@ def filters():
 
     criteria = BaseQueryCriteria(**request["filter"])
 
-    with ServerTiming.time("load snapshot"):
+    with timed_stage("load snapshot", DE_API_SERVICE):
         snapshot: CensusCubeSnapshot = load_snapshot(
             snapshot_schema_version=CENSUS_CUBE_API_SNAPSHOT_SCHEMA_VERSION,
             explicit_snapshot_id_to_load=CENSUS_CUBE_API_FORCE_LOAD_SNAPSHOT_ID,
+            snapshot_refresh_ttl_seconds=CENSUS_CUBE_API_SNAPSHOT_REFRESH_TTL_SECONDS,
         )
 
-    with ServerTiming.time("calculate filters and build response"):
+    with timed_stage("calculate filters and build response", DE_API_SERVICE):
         q = CensusCubeQuery(snapshot, cube_query_params=None)
 
         if criteria.cell_type_ontology_term_ids:
@@ -102,31 +123,21 @@ def is_criteria_empty(criteria: BaseQueryCriteria) -> bool:
 @tracer.wrap(name="build_filter_dims_values", service="wmg-api", resource="filters", span_type="wmg-api")
 def build_filter_dims_values(criteria: BaseQueryCriteria, snapshot: CensusCubeSnapshot, q: CensusCubeQuery) -> Dict:
 
+    # the option values of each dimension are read off the integer-coded cell counts index, so no
+    # intermediate cell counts dataframes are materialized
+    index = q.cell_counts_index()
     if is_criteria_empty(criteria):
-        df = snapshot.cell_counts_df[
-            snapshot.cell_counts_df["organism_ontology_term_id"] == criteria.organism_ontology_term_id
-        ]
-        dims = {col: df[col].unique().tolist() for col in df.columns}
+        mask = index.dim_mask("organism_ontology_term_id", [criteria.organism_ontology_term_id])
+        dims = {dim: index.term_ids(dim, mask) for dim in index.dims}
     else:
-        df_ref = q.cell_counts_df(criteria)
-        dims = {}
-        for key in criteria.dict():
-            col_name = key[:-1] if key[-1] == "s" else key
-            if key == "organism_ontology_term_id" or col_name not in df_ref:
-                continue
-
-            values = getattr(criteria, key)
-            if len(values) == 0:
-                dims[col_name] = df_ref[col_name].unique().tolist()
-            else:
-                setattr(criteria, key, [])
-
-                df = q.cell_counts_df(criteria)
-                dims[col_name] = df[col_name].unique().tolist()
-
-                setattr(criteria, key, values)
-
-        dims["organism_ontology_term_id"] = snapshot.cell_counts_df["organism_ontology_term_id"].unique().tolist()
+        # the options of a filtered dimension are the ones still available when it is not filtered
+        available_term_ids = index.available_term_ids(criteria_filters(criteria))
+        dims = {
+            depluralize(key): available_term_ids[depluralize(key)]
+            for key in criteria.dict()
+            if key != "organism_ontology_term_id" and depluralize(key) in index
+        }
+        dims["organism_ontology_term_id"] = index.term_ids("organism_ontology_term_id")
 
     # For schema-4 we filter out comma-delimited values for `self_reported_ethnicity_ontology_term_id`
     # from the options list per functional requirements:
@@ -183,35 +194,57 @@ def differentialExpression():
     queryGroup1Filters = request["queryGroup1Filters"]
     queryGroup2Filters = request["queryGroup2Filters"]
     exclude_overlapping_cells = request["exclude_overlapping_cells"]
+    gene_ontology_term_ids = request.get("gene_ontology_term_ids")
+    min_mean_expression = request.get("min_mean_expression")
+    top_n = request.get("top_n")
+    min_effect_size = request.get("min_effect_size")
 
     criteria1 = BaseQueryCriteria(**queryGroup1Filters)
     criteria2 = BaseQueryCriteria(**queryGroup2Filters)
 
-    snapshot: CensusCubeSnapshot = load_snapshot(
-        snapshot_schema_version=CENSUS_CUBE_API_SNAPSHOT_SCHEMA_VERSION,
-        explicit_snapshot_id_to_load=CENSUS_CUBE_API_FORCE_LOAD_SNAPSHOT_ID,
-    )
+    with timed_stage("load snapshot", DE_API_SERVICE):
+        snapshot: CensusCubeSnapshot = load_snapshot(
+            snapshot_schema_version=CENSUS_CUBE_API_SNAPSHOT_SCHEMA_VERSION,
+            explicit_snapshot_id_to_load=CENSUS_CUBE_API_FORCE_LOAD_SNAPSHOT_ID,
+            snapshot_refresh_ttl_seconds=CENSUS_CUBE_API_SNAPSHOT_REFRESH_TTL_SECONDS,
+        )
 
     # cube_query_params are not required to instantiate CensusCubeQuery for differential expression
     q = CensusCubeQuery(snapshot, cube_query_params=None)
 
-    with ServerTiming.time("run differential expression"):
-        de_results, n_overlap, successCode = run_differential_expression(
-            q, criteria1, criteria2, exclude_overlapping_cells
-        )
+    de_results, n_overlap, successCode = _run_differential_expression(
+        q,
+        criteria1,
+        criteria2,
+        exclude_overlapping_cells,
+        gene_ontology_term_ids=gene_ontology_term_ids,
+        min_mean_expression=min_mean_expression,
+        top_n=top_n,
+        min_effect_size=min_effect_size,
+    )
 
-    return jsonify(
-        dict(
-            snapshot_id=snapshot.snapshot_identifier,
-            differentialExpressionResults=de_results,
-            n_overlap=n_overlap,
-            successCode=successCode,
+    # the result of each gene is only built when it is written to the streamed response
+    return streaming_json_response(
+        JSONObjectStream(
+            dict(
+                snapshot_id=snapshot.snapshot_identifier,
+                differentialExpressionResults=JSONArrayStream(de_results),
+                n_overlap=n_overlap,
+                successCode=successCode,
+            ).items()
         )
     )
 
 
 def run_differential_expression(
-    q: CensusCubeQuery, criteria1, criteria2, exclude_overlapping_cells
+    q: CensusCubeQuery,
+    criteria1,
+    criteria2,
+    exclude_overlapping_cells,
+    gene_ontology_term_ids: Optional[List[str]] = None,
+    min_mean_expression: Optional[float] = None,
+    top_n: Optional[int] = None,
+    min_effect_size: Optional[float] = None,
 ) -> Tuple[List[Dict], int]:
     """
     Runs differential expression analysis between two sets of criteria.
@@ -227,6 +260,14 @@ def run_differential_expression(
     - criteria1: The first set of criteria for differential expression analysis.
     - criteria2: The second set of criteria for differential expression analysis.
     - exclude_overlapping_cells: A string specifying how overlapping cells should be handled.
+    - gene_ontology_term_ids: If specified, only these genes are read from the cube and tested.
+    - min_mean_expression: If specified, only the genes whose mean expression is at least this value in either
+      group are tested.
+    - top_n: If specified, only the genes with the `top_n` largest effect sizes are returned.
+    - min_effect_size: If specified, only the genes whose effect size is at least this value are returned.
+
+    Since the p-values are adjusted for the number of genes that are tested, restricting the genes also changes the
+    adjusted p-values of the genes that are kept.
 
     Returns:
     A tuple containing two elements:
@@ -236,6 +277,33 @@ def run_differential_expression(
         0: Success
         1: No cells in one or both groups after filtering out overlapping cells
     """
+    statistics, n_overlap, success_code = _run_differential_expression(
+        q,
+        criteria1,
+        criteria2,
+        exclude_overlapping_cells,
+        gene_ontology_term_ids=gene_ontology_term_ids,
+        min_mean_expression=min_mean_expression,
+        top_n=top_n,
+        min_effect_size=min_effect_size,
+    )
+    return list(statistics), n_overlap, success_code
+
+
+def _run_differential_expression(
+    q: CensusCubeQuery,
+    criteria1,
+    criteria2,
+    exclude_overlapping_cells,
+    gene_ontology_term_ids: Optional[List[str]] = None,
+    min_mean_expression: Optional[float] = None,
+    top_n: Optional[int] = None,
+    min_effect_size: Optional[float] = None,
+) -> Tuple[Iterator[Dict], int, int]:
+    """
+    Same as `run_differential_expression`, except that the dictionary of each gene is built lazily, by the
+    returned iterator.
+    """
 
     # augment criteria1 and criteria2 with descendants if cell_type_ontology_term_ids is specified
     # this is effectively rollup
@@ -250,83 +318,142 @@ def run_differential_expression(
 
     if exclude_overlapping_cells == "retainBoth":
         # If we are not excluding overlapping cells (retainBoth), we can use the simple group IDs where applicable.
-        es1, cell_counts1 = q.expression_summary_and_cell_counts_diffexp(
-            criteria1, should_use_simple_group_ids(criteria1)
-        )
-        es2, cell_counts2 = q.expression_summary_and_cell_counts_diffexp(
-            criteria2, should_use_simple_group_ids(criteria2)
-        )
+        use_simple_group_ids1 = should_use_simple_group_ids(criteria1)
+        use_simple_group_ids2 = should_use_simple_group_ids(criteria2)
     else:
         # If we are excluding overlapping cells, we can only use the simple group IDs if both groups are eligible.
-        use_simple_group_ids = should_use_simple_group_ids(criteria1) and should_use_simple_group_ids(criteria2)
-        es1, cell_counts1 = q.expression_summary_and_cell_counts_diffexp(criteria1, use_simple_group_ids)
-        es2, cell_counts2 = q.expression_summary_and_cell_counts_diffexp(criteria2, use_simple_group_ids)
-
-    n_cells1 = cell_counts1["n_total_cells"].sum()
-    n_cells2 = cell_counts2["n_total_cells"].sum()
-
-    # identify number of overlapping populations
-    filter_columns = [
-        col
-        for col in cell_counts_logical_dims_exclude_dataset_id
-        if col in cell_counts1.columns and col in cell_counts2.columns
-    ]
+        use_simple_group_ids1 = should_use_simple_group_ids(criteria1) and should_use_simple_group_ids(criteria2)
+        use_simple_group_ids2 = use_simple_group_ids1
+
+    with timed_stage("read cell counts", DE_API_SERVICE) as stage:
+        cell_counts1 = q.cell_counts_diffexp_df(criteria1)
+        cell_counts2 = q.cell_counts_diffexp_df(criteria2)
+        group_ids1 = diffexp_group_ids(cell_counts1, use_simple_group_ids1)
+        group_ids2 = diffexp_group_ids(cell_counts2, use_simple_group_ids2)
+        stage.set_rows(cell_counts1.shape[0] + cell_counts2.shape[0])
+
+    with timed_stage("find overlapping cells", DE_API_SERVICE) as stage:
+        # identify number of overlapping populations. Each group id codes a distinct combination of the values of
+        # `cell_counts_logical_dims_exclude_dataset_id`, so the populations of both groups are compared by group id.
+        overlap_group_ids = np.intersect1d(
+            diffexp_group_ids(cell_counts1, False), diffexp_group_ids(cell_counts2, False), assume_unique=True
+        )
+        overlap_filter = np.isin(cell_counts1["group_id"].to_numpy(), overlap_group_ids, assume_unique=False)
+        n_overlap = int(cell_counts1["n_total_cells"].to_numpy()[overlap_filter].sum())
+
+        # the groups of one side that are also groups of the other side are excluded from it
+        exclude_group_ids1 = group_ids2 if exclude_overlapping_cells == "excludeOne" else None
+        exclude_group_ids2 = group_ids1 if exclude_overlapping_cells == "excludeTwo" else None
+        stage.set_rows(len(overlap_group_ids))
+
+    with timed_stage("read expression summary", DE_API_SERVICE) as stage:
+        # only the sides that are not cached are read. The cells of the overlapping groups are still counted in the
+        # cells of a side that excludes them
+        statistics1 = _group_statistics(
+            q,
+            criteria1,
+            group_ids1,
+            cell_counts1["n_total_cells"].sum(),
+            use_simple_group_ids1,
+            gene_ontology_term_ids,
+            exclude_group_ids1,
+        )
+        statistics2 = _group_statistics(
+            q,
+            criteria2,
+            group_ids2,
+            cell_counts2["n_total_cells"].sum(),
+            use_simple_group_ids2,
+            gene_ontology_term_ids,
+            exclude_group_ids2,
+        )
+        stage.set_rows(statistics1.n_rows + statistics2.n_rows)
+
+    if statistics1.n_rows == 0 or statistics2.n_rows == 0:
+        return iter([]), n_overlap, 1
+
+    with timed_stage("compute statistics", DE_API_SERVICE) as stage:
+        genes, (statistics1, statistics2) = align_group_statistics([statistics1, statistics2])
+        sums1, sqsums1, n_cells1 = statistics1.sums, statistics1.sqsums, statistics1.n_cells
+        sums2, sqsums2, n_cells2 = statistics2.sums, statistics2.sqsums, statistics2.n_cells
+
+        if min_mean_expression is not None:
+            # genes that are not expressed enough in either group are dropped before they are tested
+            is_expressed = (sums1 / n_cells1 >= min_mean_expression) | (sums2 / n_cells2 >= min_mean_expression)
+            genes = genes[is_expressed]
+            sums1, sqsums1 = sums1[is_expressed], sqsums1[is_expressed]
+            sums2, sqsums2 = sums2[is_expressed], sqsums2[is_expressed]
+
+        lfc, effects, pvals_adj = _calculate_t_test_metrics(sums1, sqsums1, n_cells1, sums2, sqsums2, n_cells2)
+
+        # blacklisted genes are tested, so that they count in the p-value adjustment, but not returned
+        order = _rank_genes(genes, effects, top_n, min_effect_size)
+        stage.set_rows(len(genes))
 
-    index1 = cell_counts1.set_index(filter_columns).index
-    index2 = cell_counts2.set_index(filter_columns).index
-    overlap_filter = index1.isin(index2)
-    n_overlap = int(cell_counts1[overlap_filter]["n_total_cells"].sum())
-
-    es_index1 = es1["group_id"]
-    es_index2 = es2["group_id"]
-    if exclude_overlapping_cells == "excludeOne":
-        es1 = es1[~es_index1.isin(es_index2)]
-    elif exclude_overlapping_cells == "excludeTwo":
-        es2 = es2[~es_index2.isin(es_index1)]
-
-    if es1.shape[0] == 0 or es2.shape[0] == 0:
-        return [], n_overlap, 1
-
-    es_agg1 = es1.groupby("gene_ontology_term_id").sum(numeric_only=True)
-    es_agg2 = es2.groupby("gene_ontology_term_id").sum(numeric_only=True)
-
-    genes = list(set(list(es_agg1.index) + list(es_agg2.index)))
-
-    genes_indexer = pd.Series(index=genes, data=np.arange(len(genes)))
-
-    sums1 = np.zeros(len(genes))
-    sqsums1 = np.zeros(len(genes))
-
-    sums2 = np.zeros(len(genes))
-    sqsums2 = np.zeros(len(genes))
-
-    sums1[genes_indexer[es_agg1.index]] = es_agg1["sum"].values
-    sqsums1[genes_indexer[es_agg1.index]] = es_agg1["sqsum"].values
-
-    sums2[genes_indexer[es_agg2.index]] = es_agg2["sum"].values
-    sqsums2[genes_indexer[es_agg2.index]] = es_agg2["sqsum"].values
-
-    lfc, effects, pvals_adj = _calculate_t_test_metrics(sums1, sqsums1, n_cells1, sums2, sqsums2, n_cells2)
-    de_genes = np.array(genes)[np.argsort(-effects)]
-    lfc = lfc[np.argsort(-effects)]
-    pvals_adj = pvals_adj[np.argsort(-effects)]
-    effects = effects[np.argsort(-effects)]
-
-    statistics = []
-    for i in range(len(lfc)):
-        ei = effects[i]
-        pval = pvals_adj[i]
-        if ei is not np.nan and pval is not np.nan and de_genes[i] not in marker_gene_blacklist:
-            statistics.append(
-                {
-                    "gene_ontology_term_id": de_genes[i],
-                    "gene_symbol": gene_term_label(de_genes[i]),
-                    "effect_size": ei,
-                    "log_fold_change": lfc[i],
-                    "adjusted_p_value": pval,
-                }
+    return _iter_statistics(genes[order], effects[order], lfc[order], pvals_adj[order]), n_overlap, 0
+
+
+def _group_statistics(
+    q: CensusCubeQuery,
+    criteria: BaseQueryCriteria,
+    group_ids: np.ndarray,
+    n_cells: int,
+    use_simple: bool,
+    gene_ontology_term_ids: Optional[List[str]],
+    exclude_group_ids: Optional[np.ndarray],
+) -> GroupStatistics:
+    """
+    Return the statistics of the diffexp groups `group_ids` of one side of a query, without the groups
+    `exclude_group_ids`.
+
+    The statistics of the whole side are cached, and the statistics of the excluded groups, which are only read if
+    there are any, are subtracted from them.
+    """
+    cache_key = build_group_statistics_cache_key(q.snapshot_identifier, criteria, use_simple, gene_ontology_term_ids)
+    statistics = group_statistics_cache.get(cache_key)
+    if statistics is None:
+        statistics = read_group_statistics(q, group_ids, n_cells, use_simple, gene_ontology_term_ids)
+        group_statistics_cache.put(cache_key, statistics)
+
+    if exclude_group_ids is not None:
+        overlap_group_ids = np.intersect1d(group_ids, exclude_group_ids, assume_unique=True)
+        if len(overlap_group_ids) > 0:
+            statistics = subtract_group_statistics(
+                statistics, read_group_statistics(q, overlap_group_ids, 0, use_simple, gene_ontology_term_ids)
             )
-    return statistics, n_overlap, 0
+    return statistics
+
+
+def _rank_genes(
+    genes: np.ndarray, effects: np.ndarray, top_n: Optional[int], min_effect_size: Optional[float]
+) -> np.ndarray:
+    """
+    Return the positions of the genes to return, by decreasing effect size: the `top_n` genes with the largest effect
+    sizes of at least `min_effect_size` that are not blacklisted.
+
+    Only the selected genes are sorted, after they are partitioned from the others with `np.argpartition`, and only
+    they are labelled and serialized into the response.
+    """
+    is_candidate = ~np.isin(genes, marker_gene_blacklist)
+    if min_effect_size is not None:
+        is_candidate &= effects >= min_effect_size
+    candidates = np.flatnonzero(is_candidate)
+    if top_n is not None and top_n < len(candidates):
+        candidates = candidates[np.argpartition(-effects[candidates], top_n - 1)[:top_n]]
+    return candidates[np.argsort(-effects[candidates])]
+
+
+def _iter_statistics(de_genes, effects, lfc, pvals_adj) -> Iterator[Dict]:
+    for gene, effect, log_fold_change, pval in zip(
+        de_genes.tolist(), effects.tolist(), lfc.tolist(), pvals_adj.tolist(), strict=False
+    ):
+        yield {
+            "gene_ontology_term_id": gene,
+            "gene_symbol": gene_term_label(gene),
+            "effect_size": effect,
+            "log_fold_change": log_fold_change,
+            "adjusted_p_value": pval,
+        }
 
 
 def _get_cell_counts_for_query(q: CensusCubeQuery, criteria: BaseQueryCriteria) -> pd.DataFrame:
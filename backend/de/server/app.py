@@ -1,8 +1,10 @@
+from backend.common.census_cube.data.snapshot import release_request_snapshots
 from backend.common.server.config import create_api_app
 
 app = create_api_app(
     api_paths_and_spec_files=[("/de", "de/api/de-api.yml")],
 )
+app.teardown_request(release_request_snapshots)
 
 if __name__ == "__main__":
     app.run(host="0.0.0.0", debug=True)
@@ -4,34 +4,51 @@ The API public methods call the public methods in this module to construct the g
 and cell count data structures process and return to the client.
 """
 
-from typing import List, Tuple
+from typing import List, NamedTuple, Tuple, Union
 
+import pyarrow as pa
 from ddtrace import tracer
 from pandas import DataFrame
 
 DEFAULT_GROUP_BY_TERMS = ["tissue_ontology_term_id", "cell_type_ontology_term_id"]
 
+
+class CellCountsAggregates(NamedTuple):
+    """
+    The cell counts of a query aggregated by the group by terms and by tissue. They do not depend on the genes of
+    the query, so they can be shared by queries that differ only in their genes.
+    """
+
+    cell_type_agg: pa.Table
+    tissue_agg: pa.Table
+
+
 ######################### PUBLIC FUNCTIONS IN ALPHABETICAL ORDER ##################################
 
 
-def agg_cell_type_counts(cell_counts: DataFrame, group_by_terms: List[str] = None) -> DataFrame:
+def agg_cell_counts(cell_counts: Union[DataFrame, pa.Table], group_by_terms: List[str] = None) -> CellCountsAggregates:
+    if group_by_terms is None:
+        group_by_terms = DEFAULT_GROUP_BY_TERMS
+    cell_counts = _as_table(cell_counts)
+    return CellCountsAggregates(
+        cell_type_agg=_agg_cell_type_counts(cell_counts, group_by_terms), tissue_agg=_agg_tissue_counts(cell_counts)
+    )
+
+
+def agg_cell_type_counts(cell_counts: Union[DataFrame, pa.Table], group_by_terms: List[str] = None) -> DataFrame:
     # Aggregate cube data by tissue, cell type
     if group_by_terms is None:
         group_by_terms = DEFAULT_GROUP_BY_TERMS
-    cell_counts_cell_type_agg = cell_counts.groupby(group_by_terms, as_index=True).sum(numeric_only=True)
-    cell_counts_cell_type_agg.rename(columns={"n_total_cells": "n_cells_cell_type"}, inplace=True)
-    return cell_counts_cell_type_agg
+    return _agg_cell_type_counts(_as_table(cell_counts), group_by_terms).to_pandas().set_index(group_by_terms)
 
 
-def agg_tissue_counts(cell_counts: DataFrame) -> DataFrame:
+def agg_tissue_counts(cell_counts: Union[DataFrame, pa.Table]) -> DataFrame:
     # Aggregate cube data by tissue
-    cell_counts_tissue_agg = cell_counts.groupby(["tissue_ontology_term_id"], as_index=True).sum(numeric_only=True)
-    cell_counts_tissue_agg.rename(columns={"n_total_cells": "n_cells_tissue"}, inplace=True)
-    return cell_counts_tissue_agg
+    return _agg_tissue_counts(_as_table(cell_counts)).to_pandas().set_index("tissue_ontology_term_id")
 
 
 def build_dot_plot_matrix(
-    raw_gene_expression: DataFrame,
+    raw_gene_expression: Union[DataFrame, pa.Table],
     cell_counts_cell_type_agg: DataFrame,
     cell_counts_tissue_agg: DataFrame,
     group_by_terms: List[str] = None,
@@ -39,27 +56,107 @@ def build_dot_plot_matrix(
     if group_by_terms is None:
         group_by_terms = DEFAULT_GROUP_BY_TERMS
 
-    # Aggregate cube data by gene, tissue, cell type
-    expr_summary_agg = raw_gene_expression.groupby(["gene_ontology_term_id"] + group_by_terms, as_index=False).sum(
-        numeric_only=True
-    )
-    return expr_summary_agg.join(cell_counts_cell_type_agg, on=group_by_terms, how="left").join(
-        cell_counts_tissue_agg, on=["tissue_ontology_term_id"], how="left"
-    )
+    return _build_dot_plot_matrix(
+        _as_table(raw_gene_expression),
+        pa.Table.from_pandas(cell_counts_cell_type_agg.reset_index(), preserve_index=False),
+        pa.Table.from_pandas(cell_counts_tissue_agg.reset_index(), preserve_index=False),
+        group_by_terms,
+    ).to_pandas()
 
 
 @tracer.wrap(name="get_dot_plot_data", service="wmg-api", resource="query", span_type="wmg-api")
 def get_dot_plot_data(
-    raw_gene_expression: DataFrame,
-    cell_counts: DataFrame,
+    raw_gene_expression: Union[DataFrame, pa.Table],
+    cell_counts: Union[DataFrame, pa.Table],
     group_by_terms: List[str] = None,
 ) -> Tuple[DataFrame, DataFrame]:
     if group_by_terms is None:
         group_by_terms = DEFAULT_GROUP_BY_TERMS
-    # Get the dot plot matrix dataframe and aggregated cell counts per cell type
-    cell_counts_cell_type_agg = agg_cell_type_counts(cell_counts, group_by_terms)
-    cell_counts_tissue_agg = agg_tissue_counts(cell_counts)
-    dot_plot_matrix_df = build_dot_plot_matrix(
-        raw_gene_expression, cell_counts_cell_type_agg, cell_counts_tissue_agg, group_by_terms
+
+    # The cube query results are aggregated as Arrow tables, so that the (much smaller) aggregates are the only
+    # data converted to pandas for building the response.
+    cell_counts_aggregates = agg_cell_counts(cell_counts, group_by_terms)
+    dot_plot_matrix = get_dot_plot_matrix(raw_gene_expression, cell_counts_aggregates, group_by_terms)
+    return dot_plot_matrix, cell_counts_aggregates.cell_type_agg.to_pandas().set_index(group_by_terms)
+
+
+@tracer.wrap(name="get_dot_plot_matrix", service="wmg-api", resource="query", span_type="wmg-api")
+def get_dot_plot_matrix(
+    raw_gene_expression: Union[DataFrame, pa.Table],
+    cell_counts_aggregates: CellCountsAggregates,
+    group_by_terms: List[str] = None,
+) -> DataFrame:
+    if group_by_terms is None:
+        group_by_terms = DEFAULT_GROUP_BY_TERMS
+
+    return _build_dot_plot_matrix(
+        _as_table(raw_gene_expression),
+        cell_counts_aggregates.cell_type_agg,
+        cell_counts_aggregates.tissue_agg,
+        group_by_terms,
+    ).to_pandas()
+
+
+######################### PRIVATE FUNCTIONS IN ALPHABETICAL ORDER ##################################
+
+
+def _agg_cell_type_counts(cell_counts: pa.Table, group_by_terms: List[str]) -> pa.Table:
+    return _rename_column(_sum_by(cell_counts, group_by_terms), "n_total_cells", "n_cells_cell_type")
+
+
+def _agg_tissue_counts(cell_counts: pa.Table) -> pa.Table:
+    return _rename_column(_sum_by(cell_counts, ["tissue_ontology_term_id"]), "n_total_cells", "n_cells_tissue")
+
+
+def _as_table(data: Union[DataFrame, pa.Table]) -> pa.Table:
+    return data if isinstance(data, pa.Table) else pa.Table.from_pandas(data, preserve_index=False)
+
+
+def _build_dot_plot_matrix(
+    raw_gene_expression: pa.Table,
+    cell_counts_cell_type_agg: pa.Table,
+    cell_counts_tissue_agg: pa.Table,
+    group_by_terms: List[str],
+) -> pa.Table:
+    # Aggregate cube data by gene, tissue, cell type
+    keys = ["gene_ontology_term_id"] + group_by_terms
+    expr_summary_agg = _sum_by(raw_gene_expression, keys)
+
+    dot_plot_matrix = _left_join(expr_summary_agg, cell_counts_cell_type_agg, group_by_terms)
+    dot_plot_matrix = _left_join(dot_plot_matrix, cell_counts_tissue_agg, ["tissue_ontology_term_id"])
+    # joins do not preserve the order of the rows, so restore the sorted order of the group keys
+    return dot_plot_matrix.sort_by([(key, "ascending") for key in keys])
+
+
+def _left_join(left: pa.Table, right: pa.Table, keys: List[str]) -> pa.Table:
+    # the join keys must have the same types on both sides
+    right = right.cast(
+        pa.schema(
+            [left.schema.field(field.name) if field.name in keys else field for field in right.schema],
+            metadata=right.schema.metadata,
+        )
+    )
+    return left.join(right, keys=keys, join_type="left outer", use_threads=False)
+
+
+def _numeric_columns(table: pa.Table) -> List[str]:
+    return [field.name for field in table.schema if pa.types.is_integer(field.type) or pa.types.is_floating(field.type)]
+
+
+def _rename_column(table: pa.Table, name: str, new_name: str) -> pa.Table:
+    return table.rename_columns([new_name if column == name else column for column in table.column_names])
+
+
+def _sum_by(table: pa.Table, keys: List[str]) -> pa.Table:
+    """
+    Sum the numeric columns of `table` by `keys`, like `DataFrame.groupby(keys, as_index=False).sum(numeric_only=True)`:
+    the sums keep the types of the summed columns, and the groups are sorted by their keys.
+    """
+    numeric_columns = [column for column in _numeric_columns(table) if column not in keys]
+    sums = table.group_by(keys, use_threads=False).aggregate([(column, "sum") for column in numeric_columns])
+    sums = pa.table(
+        [sums[key] for key in keys]
+        + [sums[f"{column}_sum"].cast(table.schema.field(column).type, safe=False) for column in numeric_columns],
+        names=keys + numeric_columns,
     )
-    return dot_plot_matrix_df, cell_counts_cell_type_agg
+    return sums.sort_by([(key, "ascending") for key in keys])
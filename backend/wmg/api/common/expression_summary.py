@@ -0,0 +1,210 @@
+"""This module contains the functions that build the nested gene expression summary of the WMG API query response.
+
+The expression summary is keyed by gene, tissue, cell type and (optionally) compare dimension option. Rather than
+inserting one dataframe row at a time into nested dictionaries, the statistics are computed column-wise over the
+grouped dataframes, and the nested dictionaries are built from contiguous runs of the sorted group keys.
+
+The summary can also be built one gene at a time, so that a streamed response only holds the nested dictionaries of
+the gene being written.
+"""
+
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from ddtrace import tracer
+from pandas import DataFrame
+
+######################### PUBLIC FUNCTIONS IN ALPHABETICAL ORDER ##################################
+
+
+@tracer.wrap(name="build_expression_summary", service="wmg-api", resource="query", span_type="wmg-api")
+def build_expression_summary(
+    unrolled_gene_expression_df: DataFrame, rolled_gene_expression_df: DataFrame, compare: Optional[str]
+) -> Dict[str, Dict[str, Dict[str, Dict[str, Any]]]]:
+    """
+    Compute and build a data structure that contains gene expression summary statistics.
+
+    Parameters
+    ----------
+    unrolled_gene_expression_df: A dataframe containing unrolled gene expression values for each gene.
+
+    rolled_gene_expression_df: A dataframe containing rolleup gene expression values.
+
+    compare: Optional. The compare dimension to further group the gene expression summary statistics into.
+
+    Returns
+    -------
+    structured_result : A nested dictionary that contains gene expression summary statistics.
+    """
+    return dict(iter_expression_summary(unrolled_gene_expression_df, rolled_gene_expression_df, compare))
+
+
+def iter_expression_summary(
+    unrolled_gene_expression_df: DataFrame, rolled_gene_expression_df: DataFrame, compare: Optional[str]
+) -> Iterator[Tuple[str, Dict[str, Dict[str, Dict[str, Any]]]]]:
+    """
+    Yield the (gene, gene expression summary statistics of the gene) items of `build_expression_summary`, in the
+    same order. The statistics are computed column-wise up front, and the nested dictionaries of each gene are
+    only built when the gene is reached.
+    """
+    # Populate gene expression stats for each (gene, tissue, cell_type) combination, and the stats for each
+    # (gene, tissue, cell_type, <compare_dimension>) combination underneath them.
+    #
+    # For aggregations that contain `cell_type_ontology_term_id` as a component in the compound key used
+    # to group rows, we can use the gene expression dataframe that contains rolled up values.
+    # That is, we can use `rolled_gene_expression_df` for such aggregations.
+    #
+    # `groupby` sorts by the group keys, so the rows of each gene, and of each (gene, tissue) combination, are
+    # contiguous.
+    cell_type_expr_df = rolled_gene_expression_df.groupby(
+        ["gene_ontology_term_id", "tissue_ontology_term_id", "cell_type_ontology_term_id"], as_index=False
+    ).agg({"nnz": "sum", "sum": "sum", "n_cells_cell_type": "sum", "n_cells_tissue": "first"})
+
+    genes = cell_type_expr_df["gene_ontology_term_id"].to_numpy()
+    tissues = cell_type_expr_df["tissue_ontology_term_id"].to_numpy()
+    cell_types = cell_type_expr_df["cell_type_ontology_term_id"].to_numpy()
+    cell_type_stats = _cell_type_expression_columns(cell_type_expr_df)
+
+    compare_stats = None
+    if compare and rolled_gene_expression_df.shape[0] > 0:
+        compare_stats = _compare_expression_columns(
+            rolled_gene_expression_df, compare, pd.MultiIndex.from_arrays([genes, tissues, cell_types])
+        )
+
+    # Populate gene expressions stats for each (gene, tissue) combination
+    #
+    # For aggregations that do not contain `cell_type_ontology_term_id` as a component in the compound key
+    # used to group rows, we SHOULD NOT USE the gene expression dataframe that contains rolled up values.
+    # That is, we should not use `rolled_gene_expression_df` for such aggregations.
+    # This is because the roll up is computed over the cell_type ontology inheritance graph,
+    # and such aggregations will count the rolled up values many times.
+    #
+    # For group-by compound keys that do not contain the `cell_type_ontology_term_id`,
+    # the unrolled gene expression dataframe containing unaggregated gene expression values should be used.
+    # That is, we use `unrolled_gene_expression_df` for aggregation over the group by compound key:
+    # (`gene_ontology_term_id`, `tissue_ontology_term_id`)
+    tissue_expr_df = unrolled_gene_expression_df.groupby(
+        ["gene_ontology_term_id", "tissue_ontology_term_id"], as_index=False
+    ).agg({"nnz": "sum", "sum": "sum", "n_cells_tissue": "first"})
+
+    tissue_genes = tissue_expr_df["gene_ontology_term_id"].to_numpy()
+    tissue_tissues = tissue_expr_df["tissue_ontology_term_id"].to_numpy()
+    tissue_stats = _tissue_expression_columns(tissue_expr_df)
+
+    cell_type_gene_runs = {genes[start]: (start, end) for start, end in _contiguous_runs(genes)}
+    tissue_gene_runs = {tissue_genes[start]: (start, end) for start, end in _contiguous_runs(tissue_genes)}
+
+    for gene in list(cell_type_gene_runs) + [gene for gene in tissue_gene_runs if gene not in cell_type_gene_runs]:
+        gene_summary: Dict[str, Dict[str, Dict[str, Any]]] = {}
+
+        gene_start, gene_end = cell_type_gene_runs.get(gene, (0, 0))
+        stats = [{"aggregated": row_stats} for row_stats in _stats_rows(cell_type_stats, gene_start, gene_end)]
+        if compare_stats is not None:
+            _add_compare_expression_stats(compare_stats, gene_start, gene_end, stats)
+        for start, end in _contiguous_runs(tissues[gene_start:gene_end]):
+            gene_summary[tissues[gene_start + start]] = dict(
+                zip(cell_types[gene_start + start : gene_start + end].tolist(), stats[start:end], strict=False)
+            )
+
+        gene_start, gene_end = tissue_gene_runs.get(gene, (0, 0))
+        for tissue, row_stats in zip(
+            tissue_tissues[gene_start:gene_end].tolist(),
+            _stats_rows(tissue_stats, gene_start, gene_end),
+            strict=False,
+        ):
+            gene_summary.setdefault(tissue, {})["tissue_stats"] = {"aggregated": row_stats}
+
+        yield gene, gene_summary
+
+
+######################### PRIVATE FUNCTIONS IN ALPHABETICAL ORDER ##################################
+
+
+def _add_compare_expression_stats(
+    compare_stats: Tuple[np.ndarray, np.ndarray, Dict[str, np.ndarray]],
+    start: int,
+    end: int,
+    cell_type_stats: List[Dict[str, Dict[str, Any]]],
+) -> None:
+    """
+    Add the stats of the (gene, tissue, cell_type, <compare_dimension>) rows whose (gene, tissue, cell_type)
+    combination is in rows `start` to `end` to the stats of those rows, in `cell_type_stats`.
+    """
+    positions, compare_options, columns = compare_stats
+    compare_start, compare_end = np.searchsorted(positions, [start, end])
+    for position, compare_option, stats in zip(
+        positions[compare_start:compare_end].tolist(),
+        compare_options[compare_start:compare_end].tolist(),
+        _stats_rows(columns, compare_start, compare_end),
+        strict=False,
+    ):
+        cell_type_stats[position - start][compare_option] = stats
+
+
+def _cell_type_expression_columns(df: DataFrame) -> Dict[str, np.ndarray]:
+    return {
+        "n": df["nnz"].astype("int").to_numpy(),
+        "me": (df["sum"] / df["nnz"]).to_numpy(),
+        "pc": (df["nnz"] / df["n_cells_cell_type"]).to_numpy(),
+        "tpc": (df["nnz"] / df["n_cells_tissue"]).to_numpy(),
+    }
+
+
+def _compare_expression_columns(
+    rolled_gene_expression_df: DataFrame, compare: str, cell_type_index: pd.MultiIndex
+) -> Tuple[np.ndarray, np.ndarray, Dict[str, np.ndarray]]:
+    """
+    Return the stats of each (gene, tissue, cell_type, <compare_dimension>) row of `rolled_gene_expression_df`, with
+    the position of its (gene, tissue, cell_type) combination in `cell_type_index` and its compare option, sorted by
+    position.
+    """
+    positions = cell_type_index.get_indexer(
+        pd.MultiIndex.from_arrays(
+            [
+                rolled_gene_expression_df["gene_ontology_term_id"].to_numpy(),
+                rolled_gene_expression_df["tissue_ontology_term_id"].to_numpy(),
+                rolled_gene_expression_df["cell_type_ontology_term_id"].to_numpy(),
+            ]
+        )
+    )
+    order = np.argsort(positions, kind="stable")
+    order = order[positions[order] >= 0]
+    columns = {name: column[order] for name, column in _cell_type_expression_columns(rolled_gene_expression_df).items()}
+    return positions[order], rolled_gene_expression_df[compare].to_numpy()[order], columns
+
+
+def _contiguous_runs(*keys: np.ndarray) -> List[tuple]:
+    """
+    Return the (start, end) slice bounds of each run of consecutive rows that share the same values for all `keys`.
+    """
+    n_rows = len(keys[0]) if keys else 0
+    if n_rows == 0:
+        return []
+
+    is_run_start = np.zeros(n_rows, dtype=bool)
+    is_run_start[0] = True
+    for key in keys:
+        is_run_start[1:] |= key[1:] != key[:-1]
+
+    run_starts = np.flatnonzero(is_run_start)
+    run_ends = np.append(run_starts[1:], n_rows)
+    return list(zip(run_starts.tolist(), run_ends.tolist(), strict=False))
+
+
+def _stats_rows(columns: Dict[str, np.ndarray], start: int, end: int) -> List[Dict[str, Any]]:
+    """
+    Return the stats of rows `start` to `end` of the stat `columns`, as one dictionary per row.
+    """
+    names = list(columns)
+    values = [columns[name][start:end].tolist() for name in names]
+    return [dict(zip(names, row, strict=False)) for row in zip(*values, strict=False)]
+
+
+def _tissue_expression_columns(df: DataFrame) -> Dict[str, np.ndarray]:
+    nnz = df["nnz"].to_numpy()
+    n_cells_tissue = df["n_cells_tissue"].to_numpy()
+    with np.errstate(divide="ignore", invalid="ignore"):
+        me = np.where(nnz != 0, df["sum"].to_numpy() / nnz, 0.0)
+        tpc = np.where(n_cells_tissue != 0, nnz / n_cells_tissue, 0.0)
+    return {"n": nnz.astype("int"), "me": me, "tpc": tpc}
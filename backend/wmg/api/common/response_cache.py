@@ -0,0 +1,111 @@
+"""This module contains the in-memory cache for serialized WMG API query responses.
+
+The data backing a query response only changes when the snapshot changes. Therefore, responses are cached
+by a key made up of the snapshot id and the canonicalized query parameters, and the same key is used to derive
+the strong ETag that lets clients revalidate a response without the query being recomputed.
+"""
+
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+from backend.common.census_cube.data.criteria import CensusCubeQueryCriteria
+
+######################### PUBLIC FUNCTIONS IN ALPHABETICAL ORDER ##################################
+
+
+def build_query_cache_key(
+    snapshot_id: str, criteria: CensusCubeQueryCriteria, compare: Optional[str], is_rollup: bool
+) -> str:
+    """
+    Build a canonical cache key for a query.
+
+    Filter values are sorted because their order does not affect the response. The gene ids are kept in request
+    order because the order of the genes in the response follows the order of the genes in the request.
+
+    Parameters
+    ----------
+    snapshot_id : str
+        The id of the snapshot the response is computed from.
+    criteria : CensusCubeQueryCriteria
+        The query criteria.
+    compare : Optional[str]
+        The compare dimension, if any.
+    is_rollup : bool
+        Whether the expressions and cell counts are rolled up.
+
+    Returns
+    -------
+    str
+        The canonical cache key.
+    """
+    canonical_criteria = {
+        key: (sorted(values) if isinstance(values, list) and key != "gene_ontology_term_ids" else values)
+        for key, values in criteria.dict().items()
+    }
+    return json.dumps(
+        dict(snapshot_id=snapshot_id, criteria=canonical_criteria, compare=compare, is_rollup=is_rollup),
+        sort_keys=True,
+        separators=(",", ":"),
+    )
+
+
+def etag_for_cache_key(cache_key: str) -> str:
+    """
+    Derive a strong (unquoted) ETag from a cache key.
+    """
+    return hashlib.sha256(cache_key.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    Thread-safe LRU cache of serialized responses, bounded by the total size in bytes of the cached responses.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.n_bytes = 0
+        self._entries: OrderedDict[str, bytes] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            body = self._entries.get(key)
+            if body is not None:
+                self._entries.move_to_end(key)
+            return body
+
+    def put(self, key: str, body: bytes) -> None:
+        size = _entry_size(key, body)
+        # a response that is larger than the whole cache would evict everything and still not fit
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            previous_body = self._entries.pop(key, None)
+            if previous_body is not None:
+                self.n_bytes -= _entry_size(key, previous_body)
+
+            self._entries[key] = body
+            self.n_bytes += size
+
+            while self.n_bytes > self.max_bytes:
+                evicted_key, evicted_body = self._entries.popitem(last=False)
+                self.n_bytes -= _entry_size(evicted_key, evicted_body)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.n_bytes = 0
+
+
+######################### PRIVATE FUNCTIONS IN ALPHABETICAL ORDER ##################################
+
+
+def _entry_size(key: str, body: bytes) -> int:
+    return len(key) + len(body)
@@ -3,20 +3,34 @@
 The API public methods call the public methods in this module to perform the rollup operations.
 """
 
-from typing import Union
+from typing import Tuple, Union
 
 import numpy as np
 import pandas as pd
 from ddtrace import tracer
 from pandas import DataFrame
+from scipy import sparse
 
-from backend.common.census_cube.utils import are_cell_types_not_redundant_nodes
+from backend.common.census_cube.data.cell_type_ancestors import (
+    CellTypeAncestorMatrix,
+    build_cell_type_ancestor_matrix,
+)
+from backend.common.server.stage_timing import timed_stage
+
+# ancestor matrix for rollups without cell type ancestors, under which each cell type is its own only ancestor
+_NO_ANCESTORS = CellTypeAncestorMatrix(
+    cell_type_ontology_term_ids=pd.Index([], dtype=object), ancestors=sparse.csr_matrix((0, 0), dtype=np.int8)
+)
 
 ######################### PUBLIC FUNCTIONS IN ALPHABETIC ORDER ##################################
 
 
 @tracer.wrap(name="rollup", service="wmg-api", resource="query", span_type="wmg-api")
-def rollup(df: pd.DataFrame, cell_type_ancestors: Union[pd.Series, None], filter_redundant_nodes=True) -> DataFrame:
+def rollup(
+    df: pd.DataFrame,
+    cell_type_ancestors: Union[CellTypeAncestorMatrix, pd.Series, None],
+    filter_redundant_nodes=True,
+) -> DataFrame:
     """
     This function performs rollup operations on a given DataFrame. It aggregates the data based on cell type ontology
     term ids and their ancestors. It also provides an option to filter out redundant nodes.
@@ -29,9 +43,10 @@ def rollup(df: pd.DataFrame, cell_type_ancestors: Union[pd.Series, None], filter
     -----------
     df : pd.DataFrame
         The input DataFrame on which rollup operation is to be performed.
-    cell_type_ancestors : Union[pd.Series, None]
-        A pandas Series containing cell type ancestors or None. None is expected for unit tests that are not testing for
-        correctness of rollup and do not have the cell type ancestors artifact available.
+    cell_type_ancestors : Union[CellTypeAncestorMatrix, pd.Series, None]
+        The snapshot's precomputed cell type ancestor matrix, a pandas Series containing cell type ancestors, or None.
+        None is expected for unit tests that are not testing for correctness of rollup and do not have the cell type
+        ancestors artifact available.
     filter_redundant_nodes : bool, optional
         A flag to indicate whether to filter out redundant nodes, by default True.
 
@@ -44,36 +59,64 @@ def rollup(df: pd.DataFrame, cell_type_ancestors: Union[pd.Series, None], filter
     if df.shape[0] == 0:
         return df
 
-    df = df.copy()
-    # cell type ontology term ids can be in the index or in a column
-    cell_types = (
-        df.index.get_level_values("cell_type_ontology_term_id")
-        if "cell_type_ontology_term_id" not in df.columns
-        else df["cell_type_ontology_term_id"].values
-    )
-    df["cell_type_ontology_term_id_ancestors"] = (
-        cell_type_ancestors[cell_types].values if cell_type_ancestors is not None else cell_types
-    )
-
     is_multi_index = isinstance(df.index, pd.MultiIndex)
+    # cell type ontology term ids can be in the index or in a column
     if is_multi_index:
-        list(df.index.names)
         df = df.reset_index()
 
-    del df["cell_type_ontology_term_id"]
+    cell_types = df["cell_type_ontology_term_id"].to_numpy()
+    ancestor_matrix, cell_type_codes = _code_cell_types(cell_types, cell_type_ancestors)
+    n_cell_types = len(ancestor_matrix.cell_type_ontology_term_ids)
+
+    dim_cols = [col for col in df.columns if not pd.api.types.is_numeric_dtype(df[col].dtype)]
+    dim_cols.remove("cell_type_ontology_term_id")
+    value_cols = [col for col in df.columns if col not in dim_cols and col != "cell_type_ontology_term_id"]
+
+    # integer-code the groups of the other dimensions; the codes follow the sort order of the group keys
+    if dim_cols:
+        group_codes = df.groupby(dim_cols, sort=True).ngroup().to_numpy()
+        valid_rows = group_codes >= 0  # rows with missing group keys are dropped, like in a groupby
+        df, group_codes, cell_type_codes = df[valid_rows], group_codes[valid_rows], cell_type_codes[valid_rows]
+    else:
+        group_codes = np.zeros(df.shape[0], dtype=np.int64)
+
+    # Selecting the rows of the ancestor matrix by cell type code yields, for each row of `df`, the ancestors of its
+    # cell type. This is the sparse equivalent of exploding each row across the ancestors of its cell type.
+    row_ancestors = ancestor_matrix.ancestors[cell_type_codes]
+    exploded_rows = np.repeat(np.arange(df.shape[0]), np.diff(row_ancestors.indptr))
+    exploded_keys = group_codes[exploded_rows].astype(np.int64) * n_cell_types + row_ancestors.indices
+
+    # aggregate the exploded rows by (group, ancestor cell type) key
+    keys, first_exploded_rows, inverse = np.unique(exploded_keys, return_index=True, return_inverse=True)
+    first_rows = exploded_rows[first_exploded_rows]
+    rolled_up_cols = {col: df[col].to_numpy()[first_rows] for col in dim_cols}
+    rolled_up_cols["cell_type_ontology_term_id"] = ancestor_matrix.cell_type_ontology_term_ids.to_numpy()[
+        keys % n_cell_types
+    ]
+    for col in value_cols:
+        values = df[col].to_numpy()
+        if col == "n_cells_tissue":
+            rolled_up_cols[col] = values[first_rows]
+        else:
+            rolled_up_cols[col] = np.bincount(inverse, weights=values[exploded_rows], minlength=len(keys)).astype(
+                values.dtype
+            )
+    rolled_up_df = pd.DataFrame(rolled_up_cols)
 
-    df = df.explode("cell_type_ontology_term_id_ancestors")
-
-    df.rename(columns={"cell_type_ontology_term_id_ancestors": "cell_type_ontology_term_id"}, inplace=True)
-
-    dim_cols = [col for col in df.columns if not np.issubdtype(df[col].dtype, np.number)]
-    agg_dict = {col: "sum" if col != "n_cells_tissue" else "first" for col in df.columns if col not in dim_cols}
-    rolled_up_df = df.groupby(dim_cols).agg(agg_dict)
     if filter_redundant_nodes:
-        rolled_up_df = _filter_out_redundant_nodes(rolled_up_df)
+        with timed_stage("filter redundant nodes", "wmg-api") as stage:
+            rolled_up_df = rolled_up_df[
+                _filter_out_redundant_nodes(
+                    keys // n_cell_types,
+                    keys % n_cell_types,
+                    rolled_up_df["n_cells_cell_type"].to_numpy(),
+                    ancestor_matrix,
+                )
+            ].reset_index(drop=True)
+            stage.set_rows(rolled_up_df.shape[0])
 
-    if not is_multi_index:
-        rolled_up_df = rolled_up_df.reset_index()
+    if is_multi_index:
+        rolled_up_df = rolled_up_df.set_index(dim_cols + ["cell_type_ontology_term_id"])
 
     return rolled_up_df
 
@@ -81,29 +124,63 @@ def rollup(df: pd.DataFrame, cell_type_ancestors: Union[pd.Series, None], filter
 ######################### PRIVATE FUNCTIONS IN ALPHABETIC ORDER ##################################
 
 
-def _filter_out_redundant_nodes(df):
+def _code_cell_types(
+    cell_types: np.ndarray, cell_type_ancestors: Union[CellTypeAncestorMatrix, pd.Series, None]
+) -> Tuple[CellTypeAncestorMatrix, np.ndarray]:
     """
-    Filters out redundant nodes from the DataFrame.
+    Return an ancestor matrix that covers the given cell types, and the integer codes of the cell types in it.
+    """
+    if isinstance(cell_type_ancestors, pd.Series):
+        ancestor_matrix = build_cell_type_ancestor_matrix(cell_type_ancestors, cell_types)
+    elif cell_type_ancestors is None:
+        ancestor_matrix = _NO_ANCESTORS
+    else:
+        ancestor_matrix = cell_type_ancestors
+
+    codes = ancestor_matrix.codes(cell_types)
+    if (codes < 0).any():
+        ancestor_matrix = ancestor_matrix.with_cell_types(cell_types[codes < 0])
+        codes = ancestor_matrix.codes(cell_types)
+    return ancestor_matrix, codes
+
+
+def _filter_out_redundant_nodes(
+    group_codes: np.ndarray, cell_type_codes: np.ndarray, n_cells: np.ndarray, ancestor_matrix: CellTypeAncestorMatrix
+) -> np.ndarray:
+    """
+    Filters out redundant nodes from the rolled up rows.
 
     Parameters
     -----------
-    df : DataFrame
-        The DataFrame to filter.
+    group_codes : np.ndarray
+        The integer codes of the groups (the other dimensions) of the rows.
+    cell_type_codes : np.ndarray
+        The integer codes of the cell types of the rows, in `ancestor_matrix`. Together with `group_codes`,
+        these must uniquely identify the rows and be sorted by (group, cell type).
+    n_cells : np.ndarray
+        The rolled up cell counts of the rows.
+    ancestor_matrix : CellTypeAncestorMatrix
+        The ancestor matrix the cell types are coded in.
 
     Returns
     --------
-    DataFrame
-        The filtered DataFrame.
+    np.ndarray
+        A boolean mask of the rows that are not redundant.
     """
-
-    index_names = list(df.index.names)
-    index_names.remove("cell_type_ontology_term_id")
-    index_names = ["cell_type_ontology_term_id"] + index_names
-
-    cell_type_keys = df.index.get_level_values(index_names[0]) + ";;"
-    for i in index_names[1:]:
-        cell_type_keys += df.index.get_level_values(i)
-
-    cell_counts_dict = dict(zip(cell_type_keys, df["n_cells_cell_type"], strict=False))
-    df = df[are_cell_types_not_redundant_nodes(cell_type_keys, cell_counts_dict)]
-    return df
+    if len(group_codes) == 0:
+        return np.ones(0, dtype=bool)
+
+    n_cell_types = len(ancestor_matrix.cell_type_ontology_term_ids)
+    keys = group_codes.astype(np.int64) * n_cell_types + cell_type_codes
+
+    # pair each row with the rows of the ancestors of its cell type within the same group
+    row_ancestors = ancestor_matrix.ancestors[cell_type_codes]
+    descendant_rows = np.repeat(np.arange(len(keys)), np.diff(row_ancestors.indptr))
+    ancestor_keys = keys[descendant_rows] - cell_type_codes[descendant_rows] + row_ancestors.indices
+    ancestor_rows = np.minimum(np.searchsorted(keys, ancestor_keys), len(keys) - 1)
+    is_pair = (keys[ancestor_rows] == ancestor_keys) & (ancestor_rows != descendant_rows)
+
+    # an ancestor is redundant if it has the same number of cells as one of its descendants
+    is_redundant = np.zeros(len(keys), dtype=bool)
+    is_redundant[ancestor_rows[is_pair & (n_cells[ancestor_rows] == n_cells[descendant_rows])]] = True
+    return ~is_redundant
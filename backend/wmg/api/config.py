@@ -1,3 +1,5 @@
+from backend.common.utils.math_utils import MB
+
 # When this config flag is set, the API will load the snapshot
 # from the local disk. When the flag is False, the API
 # will load the snapshot from S3
@@ -23,6 +25,14 @@ CENSUS_CUBE_API_SNAPSHOT_SCHEMA_VERSION = "v5"
 # in CENSUS_CUBE_API_SNAPSHOT_SCHEMA_VERSION
 CENSUS_CUBE_API_FORCE_LOAD_SNAPSHOT_ID = None
 
+# Interval, in seconds, at which a background thread checks whether
+# the latest snapshot id has changed and hot-swaps in the new snapshot.
+# Requests are served from the in-memory snapshot without checking
+# the latest snapshot id on disk or S3.
+#
+# Set to None to check the latest snapshot id on every request instead.
+CENSUS_CUBE_API_SNAPSHOT_REFRESH_TTL_SECONDS = 60
+
 
 # These are the valid attributes and dimensions consulted by the
 # wmg api (reader) to determine the list of attributes and dimensions
@@ -35,3 +45,20 @@ READER_CENSUS_CUBE_CUBE_QUERY_VALID_DIMENSIONS = [
     "gene_ontology_term_id",
     "tissue_ontology_term_id",
 ]
+
+# Queries for more than CENSUS_CUBE_API_QUERY_READ_PARTITION_SIZE genes
+# read the expression summary cube in gene id range partitions of at most
+# that many genes. The partitions are read concurrently on a thread pool
+# of CENSUS_CUBE_API_QUERY_READ_POOL_SIZE threads, shared by all requests
+# of an API worker.
+#
+# Set CENSUS_CUBE_API_QUERY_READ_PARTITION_SIZE to None to read every
+# query in a single read.
+CENSUS_CUBE_API_QUERY_READ_PARTITION_SIZE = 100
+CENSUS_CUBE_API_QUERY_READ_POOL_SIZE = 4
+
+# Maximum total size of the serialized /query responses kept in the
+# in-memory response cache of each API worker. Cached responses are keyed
+# by snapshot id and query parameters, so entries for a replaced snapshot
+# are never hit again and age out of the cache.
+CENSUS_CUBE_API_QUERY_RESPONSE_CACHE_MAX_BYTES = 256 * MB
@@ -1,11 +1,14 @@
+import json
 from collections import defaultdict
-from typing import Any, Dict, Iterable, List
+from functools import cached_property
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple, Union
 
 import connexion
+import pyarrow as pa
+import pyarrow.compute as pc
 from ddtrace import tracer
-from flask import jsonify
+from flask import Response, current_app, jsonify, stream_with_context
 from pandas import DataFrame
-from server_timing import Timing as ServerTiming
 
 from backend.common.census_cube.data.criteria import (
     BaseQueryCriteria,
@@ -23,30 +26,50 @@ from backend.common.census_cube.data.snapshot import CensusCubeSnapshot, load_sn
 from backend.common.census_cube.utils import (
     depluralize,
     find_all_dim_option_values,
-    find_dim_option_values,
+    find_dims_option_values,
 )
-from backend.wmg.api.common.expression_dotplot import get_dot_plot_data
+from backend.common.server.stage_timing import timed_stage
+from backend.common.server.streaming_json import (
+    JSONObjectStream,
+    iter_json,
+    json_bytes_response,
+    streaming_json_response,
+)
+from backend.wmg.api.common.expression_dotplot import (
+    DEFAULT_GROUP_BY_TERMS,
+    CellCountsAggregates,
+    agg_cell_counts,
+    get_dot_plot_matrix,
+)
+from backend.wmg.api.common.expression_summary import iter_expression_summary
+from backend.wmg.api.common.response_cache import ResponseCache, build_query_cache_key, etag_for_cache_key
 from backend.wmg.api.common.rollup import rollup
 from backend.wmg.api.config import (
     CENSUS_CUBE_API_FORCE_LOAD_SNAPSHOT_ID,
+    CENSUS_CUBE_API_QUERY_READ_PARTITION_SIZE,
+    CENSUS_CUBE_API_QUERY_READ_POOL_SIZE,
+    CENSUS_CUBE_API_QUERY_RESPONSE_CACHE_MAX_BYTES,
+    CENSUS_CUBE_API_SNAPSHOT_REFRESH_TTL_SECONDS,
     CENSUS_CUBE_API_SNAPSHOT_SCHEMA_VERSION,
     READER_CENSUS_CUBE_CUBE_QUERY_VALID_ATTRIBUTES,
     READER_CENSUS_CUBE_CUBE_QUERY_VALID_DIMENSIONS,
 )
 
-# TODO: add cache directives: no-cache (i.e. revalidate); impl etag
-#  https://app.zenhub.com/workspaces/single-cell-5e2a191dad828d52cc78b028/issues/chanzuckerberg/single-cell-data
-#  -portal/2132
+WMG_API_SERVICE = "wmg-api"
+
+# Serialized /query responses, keyed by snapshot id and query parameters
+query_response_cache = ResponseCache(max_bytes=CENSUS_CUBE_API_QUERY_RESPONSE_CACHE_MAX_BYTES)
 
 
 @tracer.wrap(
     name="primary_filter_dimensions", service="wmg-api", resource="primary_filter_dimensions", span_type="wmg-api"
 )
 def primary_filter_dimensions():
-    with ServerTiming.time("load snapshot"):
+    with timed_stage("load snapshot", WMG_API_SERVICE):
         snapshot: CensusCubeSnapshot = load_snapshot(
             snapshot_schema_version=CENSUS_CUBE_API_SNAPSHOT_SCHEMA_VERSION,
             explicit_snapshot_id_to_load=CENSUS_CUBE_API_FORCE_LOAD_SNAPSHOT_ID,
+            snapshot_refresh_ttl_seconds=CENSUS_CUBE_API_SNAPSHOT_REFRESH_TTL_SECONDS,
         )
 
     return jsonify(snapshot.primary_filter_dimensions)
@@ -54,81 +77,263 @@ def primary_filter_dimensions():
 
 @tracer.wrap(name="query", service="wmg-api", resource="query", span_type="wmg-api")
 def query():
-    request = connexion.request.json
-    sanitize_api_query_dict(request["filter"])
+    criteria, compare, is_rollup = parse_query_request(connexion.request.json)
 
-    is_rollup = request.get("is_rollup", True)
-    compare = request.get("compare", None)
+    with timed_stage("load snapshot", WMG_API_SERVICE):
+        snapshot: CensusCubeSnapshot = load_snapshot(
+            snapshot_schema_version=CENSUS_CUBE_API_SNAPSHOT_SCHEMA_VERSION,
+            explicit_snapshot_id_to_load=CENSUS_CUBE_API_FORCE_LOAD_SNAPSHOT_ID,
+            snapshot_refresh_ttl_seconds=CENSUS_CUBE_API_SNAPSHOT_REFRESH_TTL_SECONDS,
+        )
+
+    # The response is fully determined by the snapshot and the query parameters, so a client holding a response
+    # for the same key can revalidate it without the query being recomputed. The precondition of a POST request
+    # that matches the ETag fails with 412 rather than 304, which RFC 9110 reserves for GET and HEAD requests.
+    cache_key = build_query_cache_key(snapshot.snapshot_identifier, criteria, compare, is_rollup)
+    etag = etag_for_cache_key(cache_key)
+    if connexion.request.if_none_match.contains(etag):
+        response = Response(status=412)
+    else:
+        body = query_response_cache.get(cache_key)
+        if body is None:
+            # the body is cached once it has been streamed
+            response = build_query_response(
+                criteria, snapshot, compare, is_rollup, on_body=lambda body: query_response_cache.put(cache_key, body)
+            )
+        else:
+            response = json_bytes_response(body)
+
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "no-cache"
+    return response
 
-    if compare:
-        compare = find_dimension_id_from_compare(compare)
 
-    criteria = CensusCubeQueryCriteria(**request["filter"])
+@tracer.wrap(name="query_batch", service="wmg-api", resource="query_batch", span_type="wmg-api")
+def query_batch():
+    queries = [parse_query_request(query_request) for query_request in connexion.request.json["queries"]]
 
-    with ServerTiming.time("load snapshot"):
+    with timed_stage("load snapshot", WMG_API_SERVICE):
         snapshot: CensusCubeSnapshot = load_snapshot(
             snapshot_schema_version=CENSUS_CUBE_API_SNAPSHOT_SCHEMA_VERSION,
             explicit_snapshot_id_to_load=CENSUS_CUBE_API_FORCE_LOAD_SNAPSHOT_ID,
+            snapshot_refresh_ttl_seconds=CENSUS_CUBE_API_SNAPSHOT_REFRESH_TTL_SECONDS,
         )
 
-    with ServerTiming.time("query tiledb"):
-        cube_query_params = CensusCubeQueryParams(
-            cube_query_valid_attrs=READER_CENSUS_CUBE_CUBE_QUERY_VALID_ATTRIBUTES,
-            cube_query_valid_dims=READER_CENSUS_CUBE_CUBE_QUERY_VALID_DIMENSIONS,
-        )
-        q = CensusCubeQuery(snapshot, cube_query_params)
+    def generate_results():
+        # the cell counts of the queries that have the same filters and compare dimension, which do not depend on
+        # the genes of the queries, are read, aggregated and rolled up once for the whole batch
+        shared_cell_counts: Dict[str, QueryCellCounts] = {}
+
+        yield f'{{"snapshot_id": {json.dumps(snapshot.snapshot_identifier)}, "results": ['.encode()
+        for i, (criteria, compare, is_rollup) in enumerate(queries):
+            cache_key = build_query_cache_key(snapshot.snapshot_identifier, criteria, compare, is_rollup)
+            body = query_response_cache.get(cache_key)
+            if body is None:
+                cell_counts_key = build_query_cache_key(
+                    snapshot.snapshot_identifier, criteria.copy(update={"gene_ontology_term_ids": []}), compare, False
+                )
+                if cell_counts_key not in shared_cell_counts:
+                    shared_cell_counts[cell_counts_key] = QueryCellCounts.query(criteria, snapshot, compare)
+                body = b"".join(
+                    iter_json(
+                        build_query_payload(
+                            criteria, snapshot, compare, is_rollup, cell_counts=shared_cell_counts[cell_counts_key]
+                        )
+                    )
+                )
+                query_response_cache.put(cache_key, body)
+            yield (b"," if i > 0 else b"") + body.strip()
+        yield b"]}"
+
+    # each result is sent as soon as it is built, rather than after the whole batch is. `direct_passthrough` keeps
+    # connexion from reading the whole body to convert the response.
+    response = current_app.response_class(stream_with_context(generate_results()), mimetype="application/json")
+    response.direct_passthrough = True
+    return response
+
+
+def parse_query_request(query_request: Dict) -> Tuple[CensusCubeQueryCriteria, Optional[str], bool]:
+    """
+    Return the criteria, compare dimension and rollup flag of the body of a /query request.
+    """
+    sanitize_api_query_dict(query_request["filter"])
+
+    is_rollup = query_request.get("is_rollup", True)
+    compare = query_request.get("compare")
+
+    if compare:
+        compare = find_dimension_id_from_compare(compare)
+
+    criteria = CensusCubeQueryCriteria(**query_request["filter"])
+    return criteria, compare, is_rollup
+
+
+def build_cube_query(snapshot: CensusCubeSnapshot) -> CensusCubeQuery:
+    cube_query_params = CensusCubeQueryParams(
+        cube_query_valid_attrs=READER_CENSUS_CUBE_CUBE_QUERY_VALID_ATTRIBUTES,
+        cube_query_valid_dims=READER_CENSUS_CUBE_CUBE_QUERY_VALID_DIMENSIONS,
+        read_partition_size=CENSUS_CUBE_API_QUERY_READ_PARTITION_SIZE,
+        read_pool_size=CENSUS_CUBE_API_QUERY_READ_POOL_SIZE,
+    )
+    return CensusCubeQuery(snapshot, cube_query_params)
+
+
+def get_cell_type_ancestors(snapshot: CensusCubeSnapshot):
+    return (
+        snapshot.cell_type_ancestor_matrix
+        if snapshot.cell_type_ancestor_matrix is not None
+        else snapshot.cell_type_ancestors
+    )
+
+
+class QueryCellCounts:
+    """
+    The cell counts of the filters of a query, with their aggregates, rollup and cell type labels. They do not
+    depend on the genes of the query, so they are shared by the queries of a batch that have the same filters and
+    compare dimension. Each of them is computed on first use.
+    """
+
+    def __init__(self, table: pa.Table, snapshot: CensusCubeSnapshot, compare: Optional[str]):
+        self.table = table
+        self.snapshot = snapshot
+        self.compare = compare
+        self.group_by_terms = ["tissue_ontology_term_id", "cell_type_ontology_term_id", compare] if compare else None
+
+    @classmethod
+    def query(
+        cls, criteria: CensusCubeQueryCriteria, snapshot: CensusCubeSnapshot, compare: Optional[str]
+    ) -> "QueryCellCounts":
+        with timed_stage("read cell counts", WMG_API_SERVICE) as stage:
+            cell_counts = build_cube_query(snapshot).cell_counts_table(criteria, compare_dimension=compare)
+
+            # For schema-4 we filter out comma-delimited values for `self_reported_ethnicity_ontology_term_id`
+            # from being included in the grouping and rollup logic per functional requirements:
+            # See: https://github.com/chanzuckerberg/single-cell/issues/596
+            if (compare is not None) and compare == "self_reported_ethnicity_ontology_term_id":
+                cell_counts = table_not_containing_comma_delimited_ethnicity_values(
+                    cell_counts, composite_ethnicity_term_ids(snapshot)
+                )
+            stage.set_rows(cell_counts.num_rows)
+        return cls(cell_counts, snapshot, compare)
+
+    @cached_property
+    def aggregates(self) -> CellCountsAggregates:
+        with timed_stage("aggregate cell counts", WMG_API_SERVICE) as stage:
+            aggregates = agg_cell_counts(self.table, self.group_by_terms)
+            stage.set_rows(aggregates.cell_type_agg.num_rows)
+        return aggregates
+
+    @cached_property
+    def grouped_df(self) -> DataFrame:
+        return self.aggregates.cell_type_agg.to_pandas().set_index(self.group_by_terms or DEFAULT_GROUP_BY_TERMS)
+
+    @cached_property
+    def rolled_grouped_df(self) -> DataFrame:
+        with timed_stage("rollup cell counts", WMG_API_SERVICE) as stage:
+            rolled_grouped_df = rollup(self.grouped_df, get_cell_type_ancestors(self.snapshot))
+            stage.set_rows(rolled_grouped_df.shape[0])
+        return rolled_grouped_df
+
+    @cached_property
+    def cell_types_by_tissue(self) -> Dict[str, Dict[str, Dict[str, Any]]]:
+        rolled_grouped_df = self.rolled_grouped_df
+        with timed_stage("build cell type labels", WMG_API_SERVICE) as stage:
+            stage.set_rows(rolled_grouped_df.shape[0])
+            return build_ordered_cell_types_by_tissue(
+                rolled_grouped_df, self.grouped_df, self.snapshot.cell_type_orderings, self.compare
+            )
+
+
+def build_query_response(
+    criteria: CensusCubeQueryCriteria,
+    snapshot: CensusCubeSnapshot,
+    compare: str,
+    is_rollup: bool,
+    on_body: Optional[Callable[[bytes], None]] = None,
+) -> Response:
+    """
+    Return the streamed /query response. `on_body` is called with the whole body once it has been sent, if it fits
+    in the query response cache.
+    """
+    return streaming_json_response(
+        build_query_payload(criteria, snapshot, compare, is_rollup),
+        on_body=on_body,
+        max_body_bytes=query_response_cache.max_bytes,
+    )
+
+
+def build_query_payload(
+    criteria: CensusCubeQueryCriteria,
+    snapshot: CensusCubeSnapshot,
+    compare: str,
+    is_rollup: bool,
+    cell_counts: Optional[QueryCellCounts] = None,
+) -> Union[JSONObjectStream, Dict]:
+    """
+    Return the payload of the /query response. The expression summary of each gene is only built when the payload
+    is serialized, see `iter_json`.
+    """
+    with timed_stage("read expression summary", WMG_API_SERVICE) as stage:
+        q = build_cube_query(snapshot)
         default = snapshot.expression_summary_default_cube is not None and compare is None
         for dim in criteria.dict():
             if len(criteria.dict()[dim]) > 0 and depluralize(dim) in expression_summary_non_indexed_dims:
                 default = False
                 break
 
+        # the query results stay in Arrow until they are aggregated by `get_dot_plot_matrix`
         expression_summary = (
-            q.expression_summary_default(criteria)
+            q.expression_summary_default_table(criteria)
             if default
-            else q.expression_summary(criteria, compare_dimension=compare)
+            else q.expression_summary_table(criteria, compare_dimension=compare)
         )
 
-        cell_counts = q.cell_counts(criteria, compare_dimension=compare)
-
         # For schema-4 we filter out comma-delimited values for `self_reported_ethnicity_ontology_term_id`
         # from being included in the grouping and rollup logic per functional requirements:
         # See: https://github.com/chanzuckerberg/single-cell/issues/596
         if (compare is not None) and compare == "self_reported_ethnicity_ontology_term_id":
-            expression_summary = df_not_containing_comma_delimited_ethnicity_values(expression_summary)
-            cell_counts = df_not_containing_comma_delimited_ethnicity_values(cell_counts)
+            expression_summary = table_not_containing_comma_delimited_ethnicity_values(
+                expression_summary, composite_ethnicity_term_ids(snapshot)
+            )
+        stage.set_rows(expression_summary.num_rows)
 
-    with ServerTiming.time("build response"):
-        if expression_summary.shape[0] > 0 or cell_counts.shape[0] > 0:
-            group_by_terms = ["tissue_ontology_term_id", "cell_type_ontology_term_id", compare] if compare else None
+    # the cell counts are only queried if they are not shared with other queries
+    if cell_counts is None:
+        cell_counts = QueryCellCounts.query(criteria, snapshot, compare)
 
-            gene_expression_df, cell_counts_grouped_df = get_dot_plot_data(
-                expression_summary, cell_counts, group_by_terms
+    if expression_summary.num_rows > 0 or cell_counts.table.num_rows > 0:
+        with timed_stage("aggregate expression summary", WMG_API_SERVICE) as stage:
+            gene_expression_df = get_dot_plot_matrix(
+                expression_summary, cell_counts.aggregates, cell_counts.group_by_terms
             )
-            if is_rollup:
+            stage.set_rows(gene_expression_df.shape[0])
+        if is_rollup:
+            with timed_stage("rollup expression summary", WMG_API_SERVICE) as stage:
                 # do not filter out redundant nodes for gene expressions. certain cell types may only
                 # appear redundant because they do not express a particular gene and are thus missing
                 # from the gene expression dataframe.
                 rolled_gene_expression_df = rollup(
-                    gene_expression_df, snapshot.cell_type_ancestors, filter_redundant_nodes=False
-                )
-                rolled_cell_counts_grouped_df = rollup(cell_counts_grouped_df, snapshot.cell_type_ancestors)
-
-            response = jsonify(
-                dict(
-                    snapshot_id=snapshot.snapshot_identifier,
-                    expression_summary=build_expression_summary(gene_expression_df, rolled_gene_expression_df, compare),
-                    term_id_labels=dict(
-                        genes=build_gene_id_label_mapping(criteria.gene_ontology_term_ids),
-                        cell_types=build_ordered_cell_types_by_tissue(
-                            rolled_cell_counts_grouped_df, cell_counts_grouped_df, snapshot.cell_type_orderings, compare
-                        ),
-                    ),
+                    gene_expression_df, get_cell_type_ancestors(snapshot), filter_redundant_nodes=False
                 )
-            )
-        else:  # no data, return empty json
-            response = jsonify(dict(snapshot_id=snapshot.snapshot_identifier, expression_summary={}, term_id_labels={}))
-    return response
+                stage.set_rows(rolled_gene_expression_df.shape[0])
+            cell_types_by_tissue = cell_counts.cell_types_by_tissue
+
+        # the expression summary is built while the response is serialized, see `streaming_json_response`
+        payload = JSONObjectStream(
+            dict(
+                snapshot_id=snapshot.snapshot_identifier,
+                expression_summary=JSONObjectStream(
+                    iter_expression_summary(gene_expression_df, rolled_gene_expression_df, compare)
+                ),
+                term_id_labels=dict(
+                    genes=build_gene_id_label_mapping(criteria.gene_ontology_term_ids),
+                    cell_types=cell_types_by_tissue,
+                ),
+            ).items()
+        )
+    else:  # no data, return empty json
+        payload = dict(snapshot_id=snapshot.snapshot_identifier, expression_summary={}, term_id_labels={})
+    return payload
 
 
 @tracer.wrap(name="filters", service="wmg-api", resource="filters", span_type="wmg-api")
@@ -138,13 +343,14 @@ def filters():
 
     criteria = BaseQueryCriteria(**request["filter"])
 
-    with ServerTiming.time("load snapshot"):
+    with timed_stage("load snapshot", WMG_API_SERVICE):
         snapshot: CensusCubeSnapshot = load_snapshot(
             snapshot_schema_version=CENSUS_CUBE_API_SNAPSHOT_SCHEMA_VERSION,
             explicit_snapshot_id_to_load=CENSUS_CUBE_API_FORCE_LOAD_SNAPSHOT_ID,
+            snapshot_refresh_ttl_seconds=CENSUS_CUBE_API_SNAPSHOT_REFRESH_TTL_SECONDS,
         )
 
-    with ServerTiming.time("calculate filters and build response"):
+    with timed_stage("calculate filters and build response", WMG_API_SERVICE):
         response_filter_dims_values = build_filter_dims_values(criteria, snapshot)
         response = jsonify(
             dict(
@@ -163,10 +369,12 @@ def markers():
     organism = request["organism"]
     n_markers = request["n_markers"]
     test = request["test"]
-    snapshot: CensusCubeSnapshot = load_snapshot(
-        snapshot_schema_version=CENSUS_CUBE_API_SNAPSHOT_SCHEMA_VERSION,
-        explicit_snapshot_id_to_load=CENSUS_CUBE_API_FORCE_LOAD_SNAPSHOT_ID,
-    )
+    with timed_stage("load snapshot", WMG_API_SERVICE):
+        snapshot: CensusCubeSnapshot = load_snapshot(
+            snapshot_schema_version=CENSUS_CUBE_API_SNAPSHOT_SCHEMA_VERSION,
+            explicit_snapshot_id_to_load=CENSUS_CUBE_API_FORCE_LOAD_SNAPSHOT_ID,
+            snapshot_refresh_ttl_seconds=CENSUS_CUBE_API_SNAPSHOT_REFRESH_TTL_SECONDS,
+        )
 
     criteria = MarkerGeneQueryCriteria(
         tissue_ontology_term_id=tissue,
@@ -180,7 +388,9 @@ def markers():
     )
 
     q = CensusCubeQuery(snapshot, cube_query_params)
-    df = q.marker_genes(criteria)
+    with timed_stage("read marker genes", WMG_API_SERVICE) as stage:
+        df = q.marker_genes(criteria)
+        stage.set_rows(df.shape[0])
     marker_genes = retrieve_top_n_markers(df, test, n_markers)
     return jsonify(
         dict(
@@ -190,22 +400,47 @@ def markers():
     )
 
 
-def df_not_containing_comma_delimited_ethnicity_values(input_df: DataFrame) -> DataFrame:
+def composite_ethnicity_term_ids(snapshot: CensusCubeSnapshot) -> Optional[List[str]]:
     """
-    Return a new dataframe with only the rows that DO NOT contain comma-delimited
+    Return the comma-delimited `self_reported_ethnicity_ontology_term_id` values of the snapshot, from its
+    precomputed mapping of atomic to composite ethnicity term ids, or None if the snapshot does not have one.
+    """
+    if snapshot.self_reported_ethnicity_composite_term_ids is None:
+        return None
+    return sorted(set().union(*snapshot.self_reported_ethnicity_composite_term_ids.values()))
+
+
+def table_not_containing_comma_delimited_ethnicity_values(
+    input_table: pa.Table, composite_term_ids: Optional[Iterable[str]] = None
+) -> pa.Table:
+    """
+    Return a new table with only the rows that DO NOT contain comma-delimited
     values in the `self_reported_ethnicity_ontology_term_id` column.
 
+    The rows are matched exactly against the set of comma-delimited values, rather than
+    by scanning every value for a comma.
+
     Parameters
     ----------
-    input_df: Dataframe
-        A dataframe that contains `self_reported_ethnicity_ontology_term_id` column
+    input_table: pa.Table
+        A table that contains `self_reported_ethnicity_ontology_term_id` column
+
+    composite_term_ids: Iterable[str], optional
+        The comma-delimited ethnicity term ids to exclude. If None, they are found among
+        the distinct values of the column.
 
     Returns
     -------
-    A dataframe containing only the rows that do not have a comma-delimited value
+    A table containing only the rows that do not have a comma-delimited value
     for the `self_reported_ethnicity_ontology_term_id` column
     """
-    return input_df[~input_df.self_reported_ethnicity_ontology_term_id.str.contains(",")]
+    column = input_table["self_reported_ethnicity_ontology_term_id"]
+    if composite_term_ids is None:
+        composite_term_ids = [term_id for term_id in pc.unique(column).to_pylist() if term_id and "," in term_id]
+
+    value_type = column.type.value_type if pa.types.is_dictionary(column.type) else column.type
+    value_set = pa.array(list(composite_term_ids), type=pa.string()).cast(value_type)
+    return input_table.filter(pc.invert(pc.is_in(column, value_set=value_set)))
 
 
 def sanitize_api_query_dict(query_dict: Any):
@@ -280,12 +515,12 @@ def build_filter_dims_values(criteria: BaseQueryCriteria, snapshot: CensusCubeSn
         "cell_type_ontology_term_id": "",
         "publication_citation": "",
     }
-    for dim in dims:
-        dims[dim] = (
-            find_all_dim_option_values(snapshot, criteria.organism_ontology_term_id, dim)
-            if is_criteria_empty(criteria)
-            else find_dim_option_values(criteria, snapshot, dim)
-        )
+    if is_criteria_empty(criteria):
+        for dim in dims:
+            dims[dim] = find_all_dim_option_values(snapshot, criteria.organism_ontology_term_id, dim)
+    else:
+        # the option sets of all dimensions are computed in a single pass over the criteria
+        dims = find_dims_option_values(criteria, snapshot, list(dims))
 
     # For schema-4 we filter out comma-delimited values for `self_reported_ethnicity_ontology_term_id`
     # from the options list per functional requirements:
@@ -309,109 +544,6 @@ def build_filter_dims_values(criteria: BaseQueryCriteria, snapshot: CensusCubeSn
     return response_filter_dims_values
 
 
-@tracer.wrap(name="build_expression_summary", service="wmg-api", resource="query", span_type="wmg-api")
-def build_expression_summary(
-    unrolled_gene_expression_df: DataFrame, rolled_gene_expression_df: DataFrame, compare: str
-) -> dict:
-    """
-    Compute and build a data structure that contains gene expression summary statistics.
-
-    Parameters
-    ----------
-    unrolled_gene_expression_df: A dataframe containing unrolled gene expression values for each gene.
-
-    rolled_gene_expression_df: A dataframe containing rolleup gene expression values.
-
-    compare: Optional. The compare dimension to further group the gene expression summary statistics into.
-
-    Returns
-    -------
-    structured_result : A nested dictionary that contains gene expression summary statistics.
-    """
-    # Create nested dicts with gene_ontology_term_id, tissue_ontology_term_id keys, cell_type_ontology_term_id respectively
-    structured_result: Dict[str, Dict[str, Dict[str, Dict[str, Any]]]] = defaultdict(
-        lambda: defaultdict(lambda: defaultdict(dict))
-    )
-
-    # Populate gene expressions stats for each (gene, tissue) combination
-    #
-    # For aggregations that do not contain `cell_type_ontology_term_id` as a component in the compound key
-    # used to group rows, we SHOULD NOT USE the gene expression dataframe that contains rolled up values.
-    # That is, we should not use `rolled_gene_expression_df` for such aggregations.
-    # This is because the roll up is computed over the cell_type ontology inheritance graph,
-    # and such aggregations will count the rolled up values many times.
-    #
-    # For group-by compound keys that do not contain the `cell_type_ontology_term_id`,
-    # the unrolled gene expression dataframe containing unaggregated gene expression values should be used.
-    # That is, we use `unrolled_gene_expression_df` for aggregation over the group by compound key:
-    # (`gene_ontology_term_id`, `tissue_ontology_term_id`)
-    gene_expr_grouped_df = unrolled_gene_expression_df.groupby(
-        ["gene_ontology_term_id", "tissue_ontology_term_id"], as_index=False
-    ).agg({"nnz": "sum", "sum": "sum", "n_cells_tissue": "first"})
-
-    for i in range(gene_expr_grouped_df.shape[0]):
-        row = gene_expr_grouped_df.iloc[i]
-        structured_result[row.gene_ontology_term_id][row.tissue_ontology_term_id]["tissue_stats"]["aggregated"] = dict(
-            n=int(row["nnz"]),
-            me=(float(row["sum"] / row["nnz"]) if row["nnz"] else 0.0),
-            tpc=(float(row["nnz"] / row["n_cells_tissue"]) if row["n_cells_tissue"] else 0.0),
-        )
-
-    # Populate gene expressions stats for each (gene, tissue, cell_type) combination
-    #
-    # For aggregations that contain `cell_type_ontology_term_id` as a component in the compound key used
-    # to group rows, we can use the gene expression dataframe that contains rolled up values.
-    # That is, we can use `rolled_gene_expression_df` for such aggregations.
-    gene_expr_grouped_df = rolled_gene_expression_df.groupby(
-        ["gene_ontology_term_id", "tissue_ontology_term_id", "cell_type_ontology_term_id"], as_index=False
-    ).agg({"nnz": "sum", "sum": "sum", "n_cells_cell_type": "sum", "n_cells_tissue": "first"})
-
-    fill_out_structured_dict_aggregated(gene_expr_grouped_df, structured_result)
-
-    # Populate gene expression stats for each (gene, tissue, cell_type, <compare_dimension>) combination
-    if compare:
-        fill_out_structured_dict_compare(rolled_gene_expression_df, structured_result, compare)
-
-    return structured_result
-
-
-def fill_out_structured_dict_aggregated(gene_expr_grouped_df, structured_result):
-    n = gene_expr_grouped_df["nnz"].astype("int").values
-    me = (gene_expr_grouped_df["sum"] / gene_expr_grouped_df["nnz"]).values
-    pc = (gene_expr_grouped_df["nnz"] / gene_expr_grouped_df["n_cells_cell_type"]).values
-    tpc = (gene_expr_grouped_df["nnz"] / gene_expr_grouped_df["n_cells_tissue"]).values
-    genes = gene_expr_grouped_df["gene_ontology_term_id"].values
-    tissues = gene_expr_grouped_df["tissue_ontology_term_id"].values
-    cell_types = gene_expr_grouped_df["cell_type_ontology_term_id"].values
-
-    for i in range(len(n)):
-        structured_result[genes[i]][tissues[i]][cell_types[i]]["aggregated"] = dict(
-            n=int(n[i]),
-            me=float(me[i]),
-            pc=float(pc[i]),
-            tpc=float(tpc[i]),
-        )
-
-
-def fill_out_structured_dict_compare(rolled_gene_expression_df, structured_result, compare):
-    n = rolled_gene_expression_df["nnz"].astype("int").values
-    me = (rolled_gene_expression_df["sum"] / rolled_gene_expression_df["nnz"]).values
-    pc = (rolled_gene_expression_df["nnz"] / rolled_gene_expression_df["n_cells_cell_type"]).values
-    tpc = (rolled_gene_expression_df["nnz"] / rolled_gene_expression_df["n_cells_tissue"]).values
-    genes = rolled_gene_expression_df["gene_ontology_term_id"].values
-    tissues = rolled_gene_expression_df["tissue_ontology_term_id"].values
-    cell_types = rolled_gene_expression_df["cell_type_ontology_term_id"].values
-    compare = rolled_gene_expression_df[compare].values
-
-    for i in range(len(n)):
-        structured_result[genes[i]][tissues[i]][cell_types[i]][compare[i]] = dict(
-            n=int(n[i]),
-            me=float(me[i]),
-            pc=float(pc[i]),
-            tpc=float(tpc[i]),
-        )
-
-
 @tracer.wrap(name="build_gene_id_label_mapping", service="wmg-api", resource="query", span_type="wmg-api")
 def build_gene_id_label_mapping(gene_ontology_term_ids: List[str]) -> List[dict]:
     return [
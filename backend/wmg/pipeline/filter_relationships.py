@@ -6,6 +6,7 @@ import tiledb
 
 from backend.common.census_cube.data.snapshot import (
     CELL_COUNTS_CUBE_NAME,
+    FILTER_RELATIONSHIPS_CSR_FILENAME,
     FILTER_RELATIONSHIPS_FILENAME,
 )
 from backend.common.census_cube.utils import build_filter_relationships
@@ -20,17 +21,14 @@ logger = logging.getLogger(__name__)
 
 
 @log_func_runtime
-def create_filter_relationships_graph(corpus_path: str) -> dict:
+def create_filter_relationships_graph(corpus_path: str) -> None:
     """
     Create a graph of filter relationships
 
-    Returns
-    -------
-    filter_relationships_hash_table: dict
-        A dictionary containing the filter relationships for each unique filter value.
-        Filter values are their column name + __ + their value (e.g. "dataset_id__Single cell transcriptome analysis of human pancreas").
-        The dictionary values are lists of filter values that are related to the key filter value. Relatedness indicates that these filters
-        are co-occuring in at least one cell.
+    The graph links the filter values (e.g. the dataset "Single cell transcriptome analysis of human pancreas" of
+    the dataset_id filter) that are co-occuring in at least one cell. It is written as an integer-coded `.npz`
+    archive, see `FilterRelationships`, and as the legacy JSON graph, which is read by API deployments that predate
+    the `.npz` archive.
     """
     pipeline_state = load_pipeline_state(corpus_path)
     if not pipeline_state.get(EXPRESSION_SUMMARY_AND_CELL_COUNTS_CUBE_CREATED_FLAG):
@@ -40,9 +38,12 @@ def create_filter_relationships_graph(corpus_path: str) -> dict:
     with tiledb.open(os.path.join(corpus_path, CELL_COUNTS_CUBE_NAME)) as cc_cube:
         cell_counts_df = cc_cube.df[:]
 
-    filter_relationships_linked_list = build_filter_relationships(cell_counts_df)
+    filter_relationships = build_filter_relationships(cell_counts_df)
+    filter_relationships.save(f"{corpus_path}/{FILTER_RELATIONSHIPS_CSR_FILENAME}")
 
+    # TODO: stop writing the JSON graph once no deployed API reads it
     with open(f"{corpus_path}/{FILTER_RELATIONSHIPS_FILENAME}", "w") as f:
-        json.dump(filter_relationships_linked_list, f)
+        json.dump(filter_relationships.to_dict(), f)
+
     pipeline_state[FILTER_RELATIONSHIPS_CREATED_FLAG] = True
     write_pipeline_state(pipeline_state, corpus_path)
@@ -6,9 +6,11 @@ import tiledb
 from cellxgene_ontology_guide.curated_ontology_term_lists import CuratedOntologyTermList, get_curated_ontology_term_list
 
 from backend.common.census_cube.data.ontology_labels import gene_term_label, ontology_term_label
+from backend.common.census_cube.data.schemas.cube_schema import cell_counts_indexed_dims
 from backend.common.census_cube.data.snapshot import (
     CELL_COUNTS_CUBE_NAME,
     EXPRESSION_SUMMARY_DEFAULT_CUBE_NAME,
+    PRIMARY_FILTER_DIMENSION_TERM_IDS_FILENAME,
     PRIMARY_FILTER_DIMENSIONS_FILENAME,
 )
 from backend.wmg.pipeline.constants import (
@@ -81,6 +83,10 @@ def create_primary_filter_dimensions(corpus_path: str):
         with open(f"{corpus_path}/{PRIMARY_FILTER_DIMENSIONS_FILENAME}", "w") as f:
             json.dump(result, f)
 
+        logger.info("Writing primary filter dimension term ids")
+        with open(f"{corpus_path}/{PRIMARY_FILTER_DIMENSION_TERM_IDS_FILENAME}", "w") as f:
+            json.dump(list_organism_primary_filter_dimension_term_ids(cell_counts_df), f)
+
         pipeline_state[PRIMARY_FILTER_DIMENSIONS_CREATED_FLAG] = True
         write_pipeline_state(pipeline_state, corpus_path)
 
@@ -107,6 +113,25 @@ def list_grouped_primary_filter_dimensions_term_ids(
     )
 
 
+def list_organism_primary_filter_dimension_term_ids(cell_counts_df) -> dict[str, dict[str, list[str]]]:
+    """
+    List the sorted, distinct term ids of each indexed dimension of the cell counts cube, per organism. These are
+    served by the API instead of scanning the dimensions of the cell counts cube.
+
+    :param cell_counts_df: The cell counts dataframe.
+    :return: A dictionary, keyed by dimension name, of dictionaries of the term ids of that dimension per organism.
+    """
+    return {
+        dim_name: {
+            organism_term_id: sorted(term_ids)
+            for organism_term_id, term_ids in cell_counts_df.groupby("organism_ontology_term_id")[dim_name]
+            .unique()
+            .items()
+        }
+        for dim_name in cell_counts_indexed_dims
+    }
+
+
 def order_tissues(ontology_term_ids: list[str]) -> list[str]:
     """
     Order tissues based on appearance in HIGH_LEVEL_TISSUES. This will maintain the priority set in
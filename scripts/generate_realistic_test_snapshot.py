@@ -1,4 +1,5 @@
 import argparse
+import json
 import os
 import shutil
 import sys
@@ -13,6 +14,7 @@ from unittest.mock import Mock, patch
 import tiledbsoma  # noqa: F401, isort:skip
 import tiledb
 
+from backend.common.census_cube.data.filter_relationships import FilterRelationships
 from backend.common.census_cube.data.snapshot import (
     CELL_COUNTS_CUBE_NAME,
     CELL_COUNTS_DIFFEXP_CUBE_NAME,
@@ -23,6 +25,7 @@ from backend.common.census_cube.data.snapshot import (
     EXPRESSION_SUMMARY_DEFAULT_CUBE_NAME,
     EXPRESSION_SUMMARY_DIFFEXP_CUBE_NAME,
     EXPRESSION_SUMMARY_DIFFEXP_SIMPLE_CUBE_NAME,
+    FILTER_RELATIONSHIPS_CSR_FILENAME,
     FILTER_RELATIONSHIPS_FILENAME,
     MARKER_GENES_CUBE_NAME,
     PRIMARY_FILTER_DIMENSIONS_FILENAME,
@@ -143,6 +146,13 @@ if __name__ == "__main__":
             if filename.split(".json")[0] == fixture_type or fixture_type == FixtureType.all.value:
                 path = os.path.join(new_snapshot, filename)
                 print(f"Writing {path}")
-                shutil.copy(os.path.join(corpus_path, filename), path)
+                if filename == FILTER_RELATIONSHIPS_FILENAME:
+                    # the pipeline writes the graph as an integer-coded archive, the fixture keeps it as JSON
+                    with open(os.path.join(corpus_path, FILTER_RELATIONSHIPS_CSR_FILENAME), "rb") as f:
+                        filter_relationships = FilterRelationships.load(f.read())
+                    with open(path, "w") as f:
+                        json.dump(filter_relationships.to_dict(), f)
+                else:
+                    shutil.copy(os.path.join(corpus_path, filename), path)
                 os.system(f"rm -rf {path}.gz")
                 os.system(f"gzip {path}")
@@ -0,0 +1,176 @@
+"""
+Benchmark of the WMG query `expression_summary` builder.
+
+Compares the columnar builder in `backend.wmg.api.common.expression_summary` against the previous row-at-a-time
+builder (kept below as the reference implementation) on a synthetic snapshot, and checks that both builders
+produce the same response.
+
+Usage:
+    python scripts/wmg_expression_summary_benchmark.py --n-genes 500 [--compare]
+"""
+
+import argparse
+import json
+import os
+import sys
+import timeit
+from collections import defaultdict
+from typing import Any, Dict
+
+import numpy as np
+import pandas as pd
+
+# Add the root directory to the Python module search path so you can reference backend
+# without needing to move this script to the root directory to run it.
+scripts_dir = os.path.dirname(os.path.abspath(__file__))
+root_dir = os.path.dirname(scripts_dir)
+sys.path.append(root_dir)
+
+# the benchmark runs outside of the API servers, so there is no trace agent to send the spans to
+os.environ.setdefault("DD_TRACE_ENABLED", "false")
+
+from backend.wmg.api.common.expression_dotplot import get_dot_plot_data  # noqa: E402
+from backend.wmg.api.common.expression_summary import build_expression_summary  # noqa: E402
+from backend.wmg.api.common.rollup import rollup  # noqa: E402
+
+
+def generate_synthetic_snapshot_data(
+    n_genes: int, n_tissues: int, n_cell_types: int, n_compare_options: int, expressed_fraction: float, seed: int
+):
+    """
+    Generate the expression summary and cell counts dataframes returned by the cube queries, and the cell type
+    ancestors artifact of the snapshot. The cell types form a binary tree.
+    """
+    rng = np.random.default_rng(seed)
+
+    cell_types = [f"CL:{i:07d}" for i in range(n_cell_types)]
+    cell_type_ancestors = pd.Series(
+        {cell_type: _binary_tree_ancestors(i, cell_types) for i, cell_type in enumerate(cell_types)}
+    )
+
+    tissues = [f"UBERON:{i:07d}" for i in range(n_tissues)]
+    compare_options = [f"option_{i}" for i in range(n_compare_options)]
+    cell_counts = pd.DataFrame(
+        [(t, c, o) for t in tissues for c in cell_types for o in compare_options],
+        columns=["tissue_ontology_term_id", "cell_type_ontology_term_id", "compare_dim"],
+    )
+    cell_counts["n_total_cells"] = rng.integers(1, 10_000, cell_counts.shape[0])
+
+    genes = np.array([f"ENSG{i:011d}" for i in range(n_genes)])
+    keys = cell_counts[["tissue_ontology_term_id", "cell_type_ontology_term_id", "compare_dim"]]
+    gene_index = np.repeat(np.arange(n_genes), keys.shape[0])
+    key_index = np.tile(np.arange(keys.shape[0]), n_genes)
+    expressed = rng.random(gene_index.size) < expressed_fraction
+
+    expression_summary = keys.iloc[key_index[expressed]].reset_index(drop=True)
+    expression_summary.insert(0, "gene_ontology_term_id", genes[gene_index[expressed]])
+    expression_summary["nnz"] = rng.integers(1, 1_000, expression_summary.shape[0]).astype(np.uint64)
+    expression_summary["sum"] = (rng.random(expression_summary.shape[0]) * 1_000).astype(np.float32)
+
+    return expression_summary, cell_counts, cell_type_ancestors
+
+
+def reference_build_expression_summary(
+    unrolled_gene_expression_df: pd.DataFrame, rolled_gene_expression_df: pd.DataFrame, compare: str
+) -> dict:
+    """
+    The row-at-a-time builder that the columnar builder replaced.
+    """
+    structured_result: Dict[str, Dict[str, Dict[str, Dict[str, Any]]]] = defaultdict(
+        lambda: defaultdict(lambda: defaultdict(dict))
+    )
+
+    gene_expr_grouped_df = unrolled_gene_expression_df.groupby(
+        ["gene_ontology_term_id", "tissue_ontology_term_id"], as_index=False
+    ).agg({"nnz": "sum", "sum": "sum", "n_cells_tissue": "first"})
+
+    for i in range(gene_expr_grouped_df.shape[0]):
+        row = gene_expr_grouped_df.iloc[i]
+        structured_result[row.gene_ontology_term_id][row.tissue_ontology_term_id]["tissue_stats"]["aggregated"] = dict(
+            n=int(row["nnz"]),
+            me=(float(row["sum"] / row["nnz"]) if row["nnz"] else 0.0),
+            tpc=(float(row["nnz"] / row["n_cells_tissue"]) if row["n_cells_tissue"] else 0.0),
+        )
+
+    gene_expr_grouped_df = rolled_gene_expression_df.groupby(
+        ["gene_ontology_term_id", "tissue_ontology_term_id", "cell_type_ontology_term_id"], as_index=False
+    ).agg({"nnz": "sum", "sum": "sum", "n_cells_cell_type": "sum", "n_cells_tissue": "first"})
+
+    _reference_fill_out_structured_dict(gene_expr_grouped_df, structured_result, "aggregated")
+    if compare:
+        _reference_fill_out_structured_dict(rolled_gene_expression_df, structured_result, compare)
+
+    return structured_result
+
+
+def _reference_fill_out_structured_dict(df, structured_result, compare):
+    n = df["nnz"].astype("int").values
+    me = (df["sum"] / df["nnz"]).values
+    pc = (df["nnz"] / df["n_cells_cell_type"]).values
+    tpc = (df["nnz"] / df["n_cells_tissue"]).values
+    genes = df["gene_ontology_term_id"].values
+    tissues = df["tissue_ontology_term_id"].values
+    cell_types = df["cell_type_ontology_term_id"].values
+    keys = df[compare].values if compare != "aggregated" else ["aggregated"] * len(n)
+
+    for i in range(len(n)):
+        structured_result[genes[i]][tissues[i]][cell_types[i]][keys[i]] = dict(
+            n=int(n[i]),
+            me=float(me[i]),
+            pc=float(pc[i]),
+            tpc=float(tpc[i]),
+        )
+
+
+def _binary_tree_ancestors(i: int, cell_types):
+    ancestors = [cell_types[i]]
+    while i > 0:
+        i = (i - 1) // 2
+        ancestors.append(cell_types[i])
+    return ancestors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--n-genes", type=int, default=500)
+    parser.add_argument("--n-tissues", type=int, default=4)
+    parser.add_argument("--n-cell-types", type=int, default=50)
+    parser.add_argument("--n-compare-options", type=int, default=3)
+    parser.add_argument("--expressed-fraction", type=float, default=0.5)
+    parser.add_argument("--compare", action="store_true", help="group the expression summary by a compare dimension")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    expression_summary, cell_counts, cell_type_ancestors = generate_synthetic_snapshot_data(
+        args.n_genes, args.n_tissues, args.n_cell_types, args.n_compare_options, args.expressed_fraction, args.seed
+    )
+    compare = "compare_dim" if args.compare else None
+    group_by_terms = ["tissue_ontology_term_id", "cell_type_ontology_term_id", compare] if compare else None
+    gene_expression_df, _ = get_dot_plot_data(expression_summary, cell_counts, group_by_terms)
+    rolled_gene_expression_df = rollup(gene_expression_df, cell_type_ancestors, filter_redundant_nodes=False)
+    print(
+        f"{args.n_genes} genes, {gene_expression_df.shape[0]} unrolled rows, "
+        f"{rolled_gene_expression_df.shape[0]} rolled up rows, compare={compare}"
+    )
+
+    reference = reference_build_expression_summary(gene_expression_df, rolled_gene_expression_df, compare)
+    columnar = build_expression_summary(gene_expression_df, rolled_gene_expression_df, compare)
+    assert json.dumps(reference, sort_keys=True) == json.dumps(columnar, sort_keys=True), "builders disagree"
+
+    for name, builder in [
+        ("reference", reference_build_expression_summary),
+        ("columnar", build_expression_summary),
+    ]:
+        seconds = min(
+            timeit.repeat(
+                lambda builder=builder: builder(gene_expression_df, rolled_gene_expression_df, compare),
+                number=1,
+                repeat=args.repeat,
+            )
+        )
+        print(f"{name:>10}: {seconds:.3f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+"""
+Benchmark of the reads of the WMG `expression_summary` cube.
+
+Compares the planned read of `backend.common.census_cube.data.query.CensusCubeQuery._query`, which applies criteria on
+cube dimensions as subarray ranges only and the remaining criteria as a query condition, against the previous read
+(kept below as the reference implementation), which also repeated the criteria on the gene, tissue and organism
+dimensions in the query condition. Both reads run against a synthetic cube with the production schema. The benchmark
+checks that both reads return the same cells, and reports the latency and the bytes read of each.
+
+Usage:
+    python scripts/wmg_query_pushdown_benchmark.py --n-genes 1000 --n-query-genes 50
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import timeit
+
+import numpy as np
+import pandas as pd
+import tiledb
+
+# Add the root directory to the Python module search path so you can reference backend
+# without needing to move this script to the root directory to run it.
+scripts_dir = os.path.dirname(os.path.abspath(__file__))
+root_dir = os.path.dirname(scripts_dir)
+sys.path.append(root_dir)
+
+# the benchmark runs outside of the API servers, so there is no trace agent to send the spans to
+os.environ.setdefault("DD_TRACE_ENABLED", "false")
+
+from backend.common.census_cube.data.criteria import CensusCubeQueryCriteria  # noqa: E402
+from backend.common.census_cube.data.query import (  # noqa: E402
+    CensusCubeQuery,
+    CensusCubeQueryParams,
+    depluralize,
+    pluralize,
+)
+from backend.common.census_cube.data.schemas.cube_schema import (  # noqa: E402
+    expression_summary_indexed_dims,
+    expression_summary_non_indexed_dims,
+    expression_summary_schema,
+)
+from backend.common.census_cube.data.snapshot import CensusCubeSnapshot  # noqa: E402
+from backend.wmg.api.config import (  # noqa: E402
+    READER_CENSUS_CUBE_CUBE_QUERY_VALID_ATTRIBUTES,
+    READER_CENSUS_CUBE_CUBE_QUERY_VALID_DIMENSIONS,
+)
+
+BYTES_READ_COUNTERS = ["Context.VFS.read_byte_num", "Context.read_unfiltered_byte_num"]
+
+
+def create_synthetic_expression_summary_cube(
+    uri: str, n_genes: int, n_tissues: int, n_cell_types: int, n_datasets: int, expressed_fraction: float, seed: int
+) -> None:
+    """
+    Create an expression summary cube with the production schema, in which each gene is expressed in a random
+    `expressed_fraction` of the (tissue, organism, cell type, dataset) combinations.
+    """
+    rng = np.random.default_rng(seed)
+
+    keys = pd.MultiIndex.from_product(
+        [
+            [f"UBERON:{i:07d}" for i in range(n_tissues)],
+            ["NCBITaxon:9606", "NCBITaxon:10090"],
+            [f"CL:{i:07d}" for i in range(n_cell_types)],
+            [f"dataset_{i}" for i in range(n_datasets)],
+        ],
+        names=["tissue_ontology_term_id", "organism_ontology_term_id", "cell_type_ontology_term_id", "dataset_id"],
+    ).to_frame(index=False)
+    genes = np.array([f"ENSG{i:011d}" for i in range(n_genes)])
+
+    gene_index = np.repeat(np.arange(n_genes), keys.shape[0])
+    key_index = np.tile(np.arange(keys.shape[0]), n_genes)
+    expressed = rng.random(gene_index.size) < expressed_fraction
+
+    df = keys.iloc[key_index[expressed]].reset_index(drop=True)
+    df["gene_ontology_term_id"] = genes[gene_index[expressed]]
+    for dim in expression_summary_non_indexed_dims:
+        if dim not in df:
+            df[dim] = rng.choice([f"{dim}_{i}" for i in range(3)], df.shape[0])
+    df["nnz"] = rng.integers(1, 1_000, df.shape[0]).astype(np.uint64)
+    df["sum"] = (rng.random(df.shape[0]) * 1_000).astype(np.float32)
+    df["sqsum"] = (rng.random(df.shape[0]) * 1_000).astype(np.float32)
+
+    tiledb.Array.create(uri, expression_summary_schema)
+    with tiledb.open(uri, "w") as cube:
+        cube[tuple(df[dim].to_numpy() for dim in expression_summary_indexed_dims)] = {
+            attr.name: df[attr.name].to_numpy() for attr in expression_summary_schema
+        }
+    tiledb.consolidate(uri)
+    tiledb.vacuum(uri)
+
+
+def reference_query(cube, criteria, cube_query_params: CensusCubeQueryParams) -> pd.DataFrame:
+    """
+    The read of `CensusCubeQuery._query` that the planned read replaced.
+    """
+    indexed_dims = [dim.name for dim in cube.schema.domain]
+
+    query_cond = ""
+    for attr_name, vals in criteria.dict(exclude=set(indexed_dims)).items():
+        attr = depluralize(attr_name)
+        if query_cond and len(vals) > 0:
+            query_cond += " and "
+        if len(vals) == 1 and vals[0] != "":
+            query_cond += f"{attr} == val('{vals[0]}')"
+        elif len(vals) > 1:
+            query_cond += f"{attr} in {vals}"
+
+    tiledb_dims_query = []
+    criteria_dict = criteria.dict()
+    for dim_name in indexed_dims:
+        if dim_name not in criteria_dict:
+            dim_name = pluralize(dim_name)
+        tiledb_dims_query.append(criteria_dict.get(dim_name) or [])
+
+    numeric_attrs = [attr.name for attr in cube.schema if np.issubdtype(attr.dtype, np.number)]
+    attrs = cube_query_params.get_attrs_for_cube_query(cube) + numeric_attrs
+    dims = cube_query_params.get_dims_for_cube_query(cube)
+
+    return pd.concat(
+        cube.query(cond=query_cond or None, return_incomplete=True, use_arrow=True, attrs=attrs, dims=dims).df[
+            tuple(tiledb_dims_query)
+        ]
+    )
+
+
+def measure(read, n_repeats: int):
+    """
+    Return the result of `read`, its best latency in seconds over `n_repeats` runs, and the bytes read by one run.
+    """
+    tiledb.stats_enable()
+    tiledb.stats_reset()
+    result = read()
+    counters = json.loads(tiledb.stats_dump(print_out=False, json=True))["counters"]
+    tiledb.stats_disable()
+
+    latency = min(timeit.repeat(read, number=1, repeat=n_repeats))
+    return result, latency, {counter: counters.get(counter, 0) for counter in BYTES_READ_COUNTERS}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--n-genes", type=int, default=1000)
+    parser.add_argument("--n-tissues", type=int, default=10)
+    parser.add_argument("--n-cell-types", type=int, default=50)
+    parser.add_argument("--n-datasets", type=int, default=4)
+    parser.add_argument("--expressed-fraction", type=float, default=0.3)
+    parser.add_argument("--n-query-genes", type=int, default=50)
+    parser.add_argument("--n-query-tissues", type=int, default=3)
+    parser.add_argument("--n-repeats", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as cube_dir:
+        uri = f"{cube_dir}/expression_summary"
+        create_synthetic_expression_summary_cube(
+            uri,
+            n_genes=args.n_genes,
+            n_tissues=args.n_tissues,
+            n_cell_types=args.n_cell_types,
+            n_datasets=args.n_datasets,
+            expressed_fraction=args.expressed_fraction,
+            seed=args.seed,
+        )
+
+        rng = np.random.default_rng(args.seed)
+        criteria = CensusCubeQueryCriteria(
+            gene_ontology_term_ids=[
+                f"ENSG{i:011d}" for i in rng.choice(args.n_genes, args.n_query_genes, replace=False)
+            ],
+            organism_ontology_term_id="NCBITaxon:9606",
+            tissue_ontology_term_ids=[
+                f"UBERON:{i:07d}" for i in rng.choice(args.n_tissues, args.n_query_tissues, replace=False)
+            ],
+            dataset_ids=["dataset_0", "dataset_1"],
+        )
+        cube_query_params = CensusCubeQueryParams(
+            cube_query_valid_attrs=READER_CENSUS_CUBE_CUBE_QUERY_VALID_ATTRIBUTES,
+            cube_query_valid_dims=READER_CENSUS_CUBE_CUBE_QUERY_VALID_DIMENSIONS,
+        )
+
+        with tiledb.open(uri) as cube:
+            q = CensusCubeQuery(CensusCubeSnapshot(expression_summary_cube=cube), cube_query_params)
+            reference_result, reference_latency, reference_bytes = measure(
+                lambda: reference_query(cube, criteria, cube_query_params), args.n_repeats
+            )
+            result, latency, bytes_read = measure(lambda: q.expression_summary(criteria), args.n_repeats)
+
+    sort_columns = list(reference_result.columns)
+    pd.testing.assert_frame_equal(
+        reference_result.sort_values(sort_columns).reset_index(drop=True),
+        result[sort_columns].sort_values(sort_columns).reset_index(drop=True),
+    )
+
+    print(f"cells read: {result.shape[0]}")
+    print(f"reference read: {reference_latency * 1000:.1f} ms, {reference_bytes}")
+    print(f"planned read:   {latency * 1000:.1f} ms, {bytes_read}")
+    print(f"speedup: {reference_latency / latency:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+import unittest
+
+from flask import Flask
+from server_timing import Timing as ServerTiming
+
+from backend.common.server.stage_timing import ROWS_METRIC, timed_stage
+
+
+class StageTimingTest(unittest.TestCase):
+    def setUp(self):
+        self.app = Flask(__name__)
+        ServerTiming(self.app, force_debug=True)
+        self.stages = []
+
+        @self.app.route("/stages")
+        def stages():
+            with timed_stage("load snapshot", "test-api"):
+                pass
+            for n_rows in [2, 3]:
+                with timed_stage("read cubes", "test-api") as stage:
+                    stage.set_rows(n_rows)
+                    self.stages.append(stage)
+            return "ok"
+
+        self.client = self.app.test_client()
+
+    def test__timed_stage__adds_server_timing_entries(self):
+        response = self.client.get("/stages")
+
+        entries = [entry.strip().split(";")[0] for entry in response.headers["Server-Timing"].split(",")]
+        # the durations of the stages with the same name add up to a single entry
+        self.assertEqual(["load-snapshot", "read-cubes"], entries)
+
+    def test__timed_stage__traces_rows(self):
+        self.client.get("/stages")
+
+        self.assertEqual([2, 3], [stage.span.get_metric(ROWS_METRIC) for stage in self.stages])
+        self.assertEqual("read_cubes", self.stages[0].span.name)
+        self.assertEqual("test-api", self.stages[0].span.service)
+
+    def test__timed_stage__outside_of_a_request__is_only_traced(self):
+        with timed_stage("rollup", "test-api") as stage:
+            stage.set_rows(1)
+
+        self.assertEqual(1, stage.span.get_metric(ROWS_METRIC))
+        self.assertIsNotNone(stage.span.duration)
@@ -0,0 +1,102 @@
+import gzip
+import json
+import math
+import unittest
+
+from flask import Flask
+
+from backend.common.server.streaming_json import (
+    JSONArrayStream,
+    JSONObjectStream,
+    iter_json,
+    json_bytes_response,
+    streaming_json_response,
+)
+
+
+def _payload():
+    return JSONObjectStream(
+        dict(
+            snapshot_id="snapshot",
+            genes=JSONObjectStream((f"gene_{i}", {"b": i, "a": [i, float("nan")]}) for i in range(1000)),
+            results=JSONArrayStream({"gene": f"gene_{i}", "effect_size": i / 2} for i in range(1000)),
+        ).items()
+    )
+
+
+def _expected_payload():
+    return dict(
+        snapshot_id="snapshot",
+        genes={f"gene_{i}": {"b": i, "a": [i, float("nan")]} for i in range(1000)},
+        results=[{"gene": f"gene_{i}", "effect_size": i / 2} for i in range(1000)],
+    )
+
+
+class StreamingJSONTest(unittest.TestCase):
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.bodies = []
+
+        @self.app.route("/stream")
+        def stream():
+            return streaming_json_response(_payload(), on_body=self.bodies.append)
+
+        @self.app.route("/stream_max_body_bytes")
+        def stream_max_body_bytes():
+            return streaming_json_response(_payload(), on_body=self.bodies.append, max_body_bytes=1024)
+
+        @self.app.route("/bytes")
+        def bytes_():
+            return json_bytes_response(json.dumps(_expected_payload()).encode())
+
+        self.client = self.app.test_client()
+
+    def assertPayloadEqual(self, expected, result):
+        # NaN != NaN, so the payloads are compared by their (sorted) serializations
+        self.assertEqual(json.dumps(expected, sort_keys=True), json.dumps(result, sort_keys=True))
+
+    def test__iter_json__serializes_streams(self):
+        chunks = list(iter_json(_payload(), chunk_size=1024))
+
+        self.assertGreater(len(chunks), 1)
+        self.assertTrue(all(len(chunk) < 2048 for chunk in chunks))
+        result = json.loads(b"".join(chunks))
+        self.assertPayloadEqual(_expected_payload(), result)
+        self.assertTrue(math.isnan(result["genes"]["gene_0"]["a"][1]))
+        # the members of a stream are written in order, the keys of other values are sorted
+        self.assertEqual(["snapshot_id", "genes", "results"], list(result))
+        self.assertEqual(["a", "b"], list(result["genes"]["gene_0"]))
+
+    def test__iter_json__empty_streams(self):
+        self.assertEqual(
+            b'{"a":[],"b":{}}',
+            b"".join(iter_json(JSONObjectStream([("a", JSONArrayStream([])), ("b", JSONObjectStream([]))]))),
+        )
+
+    def test__streaming_json_response__without_accepted_encoding__is_not_compressed(self):
+        response = self.client.get("/stream")
+
+        self.assertNotIn("Content-Encoding", response.headers)
+        self.assertEqual("Accept-Encoding", response.headers["Vary"])
+        self.assertPayloadEqual(_expected_payload(), json.loads(response.data))
+        self.assertEqual([response.data], self.bodies)
+
+    def test__streaming_json_response__with_gzip__is_compressed(self):
+        response = self.client.get("/stream", headers={"Accept-Encoding": "gzip, deflate"})
+
+        self.assertEqual("gzip", response.headers["Content-Encoding"])
+        self.assertPayloadEqual(_expected_payload(), json.loads(gzip.decompress(response.data)))
+        # the uncompressed body is collected
+        self.assertEqual([gzip.decompress(response.data)], self.bodies)
+
+    def test__streaming_json_response__larger_than_max_body_bytes__is_not_collected(self):
+        response = self.client.get("/stream_max_body_bytes")
+
+        self.assertPayloadEqual(_expected_payload(), json.loads(response.data))
+        self.assertEqual([], self.bodies)
+
+    def test__json_bytes_response__with_gzip__is_compressed(self):
+        response = self.client.get("/bytes", headers={"Accept-Encoding": "gzip"})
+
+        self.assertEqual("gzip", response.headers["Content-Encoding"])
+        self.assertPayloadEqual(_expected_payload(), json.loads(gzip.decompress(response.data)))
@@ -0,0 +1,126 @@
+"""This module tests the group statistics cache used by `backend.de.api.v1.py`."""
+
+import numpy as np
+
+from backend.common.census_cube.data.criteria import BaseQueryCriteria
+from backend.de.api.group_statistics import (
+    GroupStatistics,
+    GroupStatisticsCache,
+    align_group_statistics,
+    build_group_statistics_cache_key,
+    subtract_group_statistics,
+)
+
+
+def _criteria(**kwargs) -> BaseQueryCriteria:
+    return BaseQueryCriteria(organism_ontology_term_id="NCBITaxon:9606", **kwargs)
+
+
+def _statistics(n_genes: int) -> GroupStatistics:
+    return GroupStatistics(
+        n_cells=10,
+        genes=np.array([f"g{i}" for i in range(n_genes)], dtype=object),
+        sums=np.ones(n_genes),
+        sqsums=np.ones(n_genes),
+        gene_rows=np.ones(n_genes, dtype=np.int64),
+    )
+
+
+def test_build_group_statistics_cache_key_ignores_filter_and_gene_order():
+    key1 = build_group_statistics_cache_key(
+        "snapshot", _criteria(cell_type_ontology_term_ids=["c1", "c2"]), True, ["g1", "g2"]
+    )
+    key2 = build_group_statistics_cache_key(
+        "snapshot", _criteria(cell_type_ontology_term_ids=["c2", "c1"]), True, ["g2", "g1"]
+    )
+    assert key1 == key2
+
+
+def test_build_group_statistics_cache_key_distinguishes_snapshot_group_ids_and_genes():
+    criteria = _criteria(cell_type_ontology_term_ids=["c1"])
+    key = build_group_statistics_cache_key("snapshot", criteria, True, None)
+
+    assert key != build_group_statistics_cache_key("other_snapshot", criteria, True, None)
+    assert key != build_group_statistics_cache_key("snapshot", criteria, False, None)
+    assert key != build_group_statistics_cache_key("snapshot", criteria, True, [])
+    assert key != build_group_statistics_cache_key("snapshot", _criteria(), True, None)
+
+
+def test_group_statistics_cache_evicts_least_recently_used_entries_to_stay_within_max_bytes():
+    size = len("a") + _statistics(100).nbytes
+    cache = GroupStatisticsCache(max_bytes=3 * size)
+    cache.put("a", _statistics(100))
+    cache.put("b", _statistics(100))
+    cache.put("c", _statistics(100))
+    assert cache.n_bytes == 3 * size
+
+    # touch "a" so that "b" becomes the least recently used entry
+    assert cache.get("a") is not None
+    cache.put("d", _statistics(100))
+
+    assert cache.get("b") is None
+    assert cache.get("a") is not None
+    assert cache.get("c") is not None
+    assert cache.get("d") is not None
+    assert cache.n_bytes == 3 * size
+
+
+def test_group_statistics_cache_does_not_cache_entries_larger_than_max_bytes():
+    cache = GroupStatisticsCache(max_bytes=len("a") + _statistics(10).nbytes)
+    cache.put("a", _statistics(10))
+    cache.put("b", _statistics(1000))
+
+    assert cache.get("a") is not None
+    assert cache.get("b") is None
+    assert len(cache) == 1
+
+
+def test_align_group_statistics_scatters_statistics_onto_the_union_of_genes():
+    statistics1 = GroupStatistics(
+        n_cells=10,
+        genes=np.array(["g1", "g2"], dtype=object),
+        sums=np.array([1.0, 2.0]),
+        sqsums=np.array([3.0, 4.0]),
+        gene_rows=np.array([1, 2]),
+    )
+    statistics2 = GroupStatistics(
+        n_cells=20,
+        genes=np.array(["g3", "g1"], dtype=object),
+        sums=np.array([5.0, 6.0]),
+        sqsums=np.array([7.0, 8.0]),
+        gene_rows=np.array([3, 4]),
+    )
+
+    genes, (aligned1, aligned2) = align_group_statistics([statistics1, statistics2])
+
+    assert genes.tolist() == ["g1", "g2", "g3"]
+    assert (aligned1.n_cells, aligned2.n_cells) == (10, 20)
+    assert aligned1.sums.tolist() == [1, 2, 0]
+    assert aligned2.sums.tolist() == [6, 0, 5]
+    assert aligned2.sqsums.tolist() == [8, 0, 7]
+    assert aligned2.gene_rows.tolist() == [4, 0, 3]
+
+
+def test_subtract_group_statistics_drops_genes_without_rows_left():
+    statistics = GroupStatistics(
+        n_cells=10,
+        genes=np.array(["g1", "g2", "g3"], dtype=object),
+        sums=np.array([0.1, 2.0, 3.0]),
+        sqsums=np.array([0.3, 4.0, 9.0]),
+        gene_rows=np.array([1, 2, 3]),
+    )
+    subset = GroupStatistics(
+        n_cells=0,
+        genes=np.array(["g3", "g1"], dtype=object),
+        sums=np.array([1.0, 0.1]),
+        sqsums=np.array([1.0, 0.3]),
+        gene_rows=np.array([1, 1]),
+    )
+
+    difference = subtract_group_statistics(statistics, subset)
+
+    assert difference.n_cells == 10
+    assert difference.genes.tolist() == ["g2", "g3"]
+    assert difference.sums.tolist() == [2, 2]
+    assert difference.sqsums.tolist() == [4, 8]
+    assert difference.n_rows == 4
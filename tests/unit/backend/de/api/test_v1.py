@@ -1,8 +1,25 @@
+import contextlib
 import json
+import tempfile
 import unittest
 from math import log
 from unittest.mock import patch
 
+import numpy as np
+import pandas as pd
+import scipy.stats
+import tiledb
+
+from backend.common.census_cube.data.criteria import BaseQueryCriteria
+from backend.common.census_cube.data.query import CensusCubeQuery
+from backend.common.census_cube.data.schemas.cube_schema_diffexp import (
+    cell_counts_logical_dims,
+    cell_counts_logical_dims_exclude_dataset_id,
+    expression_summary_schema,
+)
+from backend.common.census_cube.data.snapshot import CensusCubeSnapshot
+from backend.common.census_cube.data.tiledb import create_ctx
+from backend.de.api.v1 import group_statistics_cache, run_differential_expression
 from backend.de.server.app import app
 from tests.unit.backend.fixtures.environment_setup import EnvironmentSetup
 from tests.unit.backend.wmg.fixtures.test_snapshot import (
@@ -11,6 +28,61 @@ from tests.unit.backend.wmg.fixtures.test_snapshot import (
 
 TEST_SNAPSHOT = "realistic-test-snapshot"
 
+expression_summary_diffexp = CensusCubeQuery.expression_summary_diffexp
+
+
+@contextlib.contextmanager
+def create_temp_diffexp_snapshot(n_genes: int = 200, seed: int = 0) -> CensusCubeSnapshot:
+    """
+    A snapshot with diffexp cubes only, of one group per (tissue, sex) of two human cell types, with random
+    expression. The groups are the same in the simple cubes, which are only read for criteria on indexed dims.
+    """
+    rng = np.random.default_rng(seed)
+    cell_counts = pd.DataFrame(
+        [
+            dict(
+                cell_type_ontology_term_id=cell_type,
+                tissue_ontology_term_id=tissue,
+                organism_ontology_term_id="NCBITaxon:9606",
+                publication_citation="No Publication",
+                disease_ontology_term_id="PATO:0000461",
+                self_reported_ethnicity_ontology_term_id="HANCESTRO:0005",
+                sex_ontology_term_id=sex,
+                dataset_id="dataset_0",
+            )
+            for cell_type in ["CL:0000066", "CL:0000540"]
+            for tissue in ["UBERON:0002048", "UBERON:0002097"]
+            for sex in ["PATO:0000383", "PATO:0000384"]
+        ]
+    )[cell_counts_logical_dims]
+    cell_counts["n_cells"] = rng.integers(50, 500, len(cell_counts)).astype(np.uint32)
+    cell_counts["group_id"] = np.arange(len(cell_counts), dtype=np.uint32)
+    cell_counts["group_id_simple"] = cell_counts["group_id"]
+
+    genes = [f"ENSG{i:011d}" for i in range(n_genes)]
+    expression_summary = pd.DataFrame(
+        dict(
+            group_id=np.repeat(cell_counts["group_id"].to_numpy(), n_genes),
+            gene_ontology_term_id=np.tile(genes, len(cell_counts)),
+        )
+    )
+    n_cells = np.repeat(cell_counts["n_cells"].to_numpy(), n_genes)
+    # the mean expression of each gene is about its index, scaled to [0, 3]
+    means = np.tile(np.linspace(0, 3, n_genes), len(cell_counts)) * rng.uniform(0.5, 1.5, len(expression_summary))
+    expression_summary["sum"] = (means * n_cells).astype(np.float32)
+    expression_summary["sqsum"] = ((means**2 + rng.uniform(0, 1, len(expression_summary))) * n_cells).astype(np.float32)
+
+    with tempfile.TemporaryDirectory() as cube_dir, contextlib.ExitStack() as stack:
+        tiledb.Array.create(f"{cube_dir}/expression_summary_diffexp", expression_summary_schema)
+        tiledb.from_pandas(f"{cube_dir}/expression_summary_diffexp", expression_summary, mode="append")
+        cube = stack.enter_context(tiledb.open(f"{cube_dir}/expression_summary_diffexp", ctx=create_ctx()))
+        yield CensusCubeSnapshot(
+            snapshot_identifier="diffexp-test-snapshot",
+            expression_summary_diffexp_cube=cube,
+            expression_summary_diffexp_simple_cube=cube,
+            cell_counts_diffexp_df=cell_counts,
+        )
+
 
 class DeAPIV1Tests(unittest.TestCase):
     def setUp(self):
@@ -217,3 +289,255 @@ class DeAPIV1Tests(unittest.TestCase):
                         self.assertEqual(log_p_value_sum, expected_log_p_value_sums[test_index][i])
                         self.assertEqual(log_fold_change_sum, expected_log_fold_change_sums[test_index][i])
                         self.assertEqual(result["n_overlap"], expected_n_overlap[test_index][i])
+
+
+def reference_differential_expression(
+    snapshot: CensusCubeSnapshot, criteria1: dict, criteria2: dict, exclude_overlapping_cells: str
+) -> pd.DataFrame:
+    """
+    Reference statistics of each gene, from the expression summary rows of both sides grouped by gene, and scipy's
+    Welch t-test and Benjamini-Hochberg correction.
+    """
+    q = CensusCubeQuery(snapshot)
+    use_simple = exclude_overlapping_cells == "retainBoth" or not any(
+        criteria.get("sex_ontology_term_ids") for criteria in [criteria1, criteria2]
+    )
+    es1, cell_counts1 = q.expression_summary_and_cell_counts_diffexp(BaseQueryCriteria(**criteria1), use_simple)
+    es2, cell_counts2 = q.expression_summary_and_cell_counts_diffexp(BaseQueryCriteria(**criteria2), use_simple)
+    if exclude_overlapping_cells == "excludeOne":
+        es1 = es1[~es1["group_id"].isin(es2["group_id"])]
+    elif exclude_overlapping_cells == "excludeTwo":
+        es2 = es2[~es2["group_id"].isin(es1["group_id"])]
+
+    stats = []
+    for es, cell_counts in [(es1, cell_counts1), (es2, cell_counts2)]:
+        n_cells = cell_counts["n_total_cells"].sum()
+        es = es.astype(dict(sum=np.float64, sqsum=np.float64))
+        es_agg = es.groupby("gene_ontology_term_id")[["sum", "sqsum"]].sum()
+        mean = es_agg["sum"] / n_cells
+        stats.append((mean, np.sqrt(es_agg["sqsum"] / n_cells - mean**2), n_cells))
+
+    (mean1, std1, n1), (mean2, std2, n2) = stats
+    mean2, std2 = mean2.reindex(mean1.index, fill_value=0), std2.reindex(mean1.index, fill_value=0)
+    t_test = scipy.stats.ttest_ind_from_stats(mean1, std1, n1, mean2, std2, n2, equal_var=False)
+    return pd.DataFrame(
+        dict(
+            effect_size=(mean1 - mean2) / np.sqrt(((n1 - 1) * std1**2 + (n2 - 1) * std2**2) / (n1 + n2 - 1)),
+            log_fold_change=mean1 - mean2,
+            adjusted_p_value=scipy.stats.false_discovery_control(t_test.pvalue),
+        )
+    )
+
+
+class DifferentialExpressionStatisticsTests(unittest.TestCase):
+    def setUp(self):
+        group_statistics_cache.clear()
+
+    def assert_statistics_equal(self, expected: pd.DataFrame, results: list):
+        self.assertEqual(len(expected), len(results))
+        effects = [result["effect_size"] for result in results]
+        self.assertEqual(sorted(effects, reverse=True), effects)
+        for result in results:
+            expected_result = expected.loc[result["gene_ontology_term_id"]]
+            for key in ["effect_size", "log_fold_change", "adjusted_p_value"]:
+                self.assertAlmostEqual(expected_result[key], result[key], places=6)
+
+    def test__statistics__equal_welch_t_test_of_the_groups(self):
+        criteria1 = dict(organism_ontology_term_id="NCBITaxon:9606", tissue_ontology_term_ids=["UBERON:0002048"])
+        # the second side overlaps with the first one, in the groups of the lung of sex PATO:0000383
+        criteria2 = dict(organism_ontology_term_id="NCBITaxon:9606", sex_ontology_term_ids=["PATO:0000383"])
+        with create_temp_diffexp_snapshot() as snapshot:
+            q = CensusCubeQuery(snapshot)
+            cell_counts1 = q.cell_counts_diffexp_df(BaseQueryCriteria(**criteria1))
+            cell_counts2 = q.cell_counts_diffexp_df(BaseQueryCriteria(**criteria2))
+            index1 = cell_counts1.set_index(cell_counts_logical_dims_exclude_dataset_id).index
+            index2 = cell_counts2.set_index(cell_counts_logical_dims_exclude_dataset_id).index
+            expected_n_overlap = cell_counts1[index1.isin(index2)]["n_total_cells"].sum()
+            self.assertGreater(expected_n_overlap, 0)
+
+            for exclude_overlapping_cells in ["retainBoth", "excludeOne", "excludeTwo"]:
+                with self.subTest(exclude_overlapping_cells=exclude_overlapping_cells):
+                    results, n_overlap, success_code = run_differential_expression(
+                        CensusCubeQuery(snapshot),
+                        BaseQueryCriteria(**criteria1),
+                        BaseQueryCriteria(**criteria2),
+                        exclude_overlapping_cells,
+                    )
+
+                    self.assertEqual(0, success_code)
+                    self.assertEqual(expected_n_overlap, n_overlap)
+                    self.assert_statistics_equal(
+                        reference_differential_expression(snapshot, criteria1, criteria2, exclude_overlapping_cells),
+                        results,
+                    )
+
+    def test__statistics__of_a_repeated_side_are_not_read_again(self):
+        background = dict(organism_ontology_term_id="NCBITaxon:9606", tissue_ontology_term_ids=["UBERON:0002097"])
+        all_criteria = [
+            dict(background, tissue_ontology_term_ids=["UBERON:0002048"], cell_type_ontology_term_ids=[cell_type])
+            for cell_type in ["CL:0000066", "CL:0000540"]
+        ]
+        with create_temp_diffexp_snapshot() as snapshot:
+            all_results = []
+            with patch.object(
+                CensusCubeQuery, "expression_summary_diffexp", autospec=True, side_effect=expression_summary_diffexp
+            ) as read:
+                for criteria in all_criteria:
+                    for exclude_overlapping_cells in ["retainBoth", "excludeTwo"]:
+                        results, _, _ = run_differential_expression(
+                            CensusCubeQuery(snapshot),
+                            BaseQueryCriteria(**criteria),
+                            BaseQueryCriteria(**background),
+                            exclude_overlapping_cells,
+                        )
+                        all_results.append((criteria, exclude_overlapping_cells, results))
+
+            # the background is read once, and each other side once, since the sides do not overlap
+            self.assertEqual(1 + len(all_criteria), read.call_count)
+            for criteria, exclude_overlapping_cells, results in all_results:
+                self.assert_statistics_equal(
+                    reference_differential_expression(snapshot, criteria, background, exclude_overlapping_cells),
+                    results,
+                )
+
+
+class DifferentialExpressionGenePrefilterTests(unittest.TestCase):
+    def setUp(self):
+        group_statistics_cache.clear()
+        self.criteria1 = dict(organism_ontology_term_id="NCBITaxon:9606", tissue_ontology_term_ids=["UBERON:0002048"])
+        self.criteria2 = dict(organism_ontology_term_id="NCBITaxon:9606", tissue_ontology_term_ids=["UBERON:0002097"])
+
+    def run_differential_expression(self, snapshot, exclude_overlapping_cells="excludeTwo", **kwargs):
+        results, _, _ = run_differential_expression(
+            CensusCubeQuery(snapshot),
+            BaseQueryCriteria(**self.criteria1),
+            BaseQueryCriteria(**self.criteria2),
+            exclude_overlapping_cells,
+            **kwargs,
+        )
+        return {result["gene_ontology_term_id"]: result for result in results}
+
+    def test__gene_subset__is_read_from_the_cube(self):
+        with create_temp_diffexp_snapshot() as snapshot:
+            genes = ["ENSG00000000003", "ENSG00000000150", "ENSG00000000042", "ENSG99999999999"]
+
+            es, _ = CensusCubeQuery(snapshot).expression_summary_and_cell_counts_diffexp(
+                BaseQueryCriteria(**self.criteria1), True, genes
+            )
+
+            self.assertCountEqual(genes[:3], es["gene_ontology_term_id"].unique())
+            self.assertEqual(4 * 3, len(es))
+
+    def test__gene_subset__has_the_effect_sizes_of_all_genes(self):
+        with create_temp_diffexp_snapshot() as snapshot:
+            all_results = self.run_differential_expression(snapshot)
+            genes = ["ENSG00000000003", "ENSG00000000150", "ENSG00000000042"]
+
+            results = self.run_differential_expression(snapshot, gene_ontology_term_ids=genes)
+
+            self.assertCountEqual(genes, results)
+            for gene in genes:
+                self.assertAlmostEqual(all_results[gene]["effect_size"], results[gene]["effect_size"], places=5)
+                self.assertAlmostEqual(all_results[gene]["log_fold_change"], results[gene]["log_fold_change"], places=5)
+
+    def test__min_mean_expression__drops_genes_not_expressed_in_either_group(self):
+        with create_temp_diffexp_snapshot() as snapshot:
+            all_results = self.run_differential_expression(snapshot)
+
+            results = self.run_differential_expression(snapshot, min_mean_expression=1.5)
+
+            self.assertLess(len(results), len(all_results))
+            self.assertGreater(len(results), 0)
+            for gene, result in results.items():
+                self.assertAlmostEqual(all_results[gene]["effect_size"], result["effect_size"], places=5)
+            # the mean expression of the gene with index i is between 0.5 and 1.5 times 3 * i / 199 in either group
+            self.assertTrue(all(int(gene[4:]) >= 199 / 3 for gene in results))
+            self.assertIn("ENSG00000000199", results)
+
+    @patch("backend.de.api.v1.load_snapshot")
+    def test__differentialExpression__restricts_genes(self, load_snapshot):
+        with EnvironmentSetup(dict(APP_NAME="corpora-api-de")):
+            client = app.test_client(use_cookies=False)
+        with create_temp_diffexp_snapshot() as snapshot:
+            load_snapshot.return_value = snapshot
+            genes = ["ENSG00000000003", "ENSG00000000150", "ENSG00000000199"]
+
+            response = client.post(
+                "/de/v1/differentialExpression",
+                headers={"Content-Type": "application/json"},
+                data=json.dumps(
+                    dict(
+                        queryGroup1Filters=self.criteria1,
+                        queryGroup2Filters=self.criteria2,
+                        exclude_overlapping_cells="excludeTwo",
+                        gene_ontology_term_ids=genes,
+                        min_mean_expression=1,
+                    )
+                ),
+            )
+
+            self.assertEqual(200, response.status_code)
+            result = json.loads(response.data)
+            self.assertCountEqual(
+                genes[1:], [gene["gene_ontology_term_id"] for gene in result["differentialExpressionResults"]]
+            )
+
+
+class DifferentialExpressionTopGenesTests(unittest.TestCase):
+    def setUp(self):
+        group_statistics_cache.clear()
+        self.criteria1 = dict(organism_ontology_term_id="NCBITaxon:9606", tissue_ontology_term_ids=["UBERON:0002048"])
+        self.criteria2 = dict(organism_ontology_term_id="NCBITaxon:9606", tissue_ontology_term_ids=["UBERON:0002097"])
+
+    def run_differential_expression(self, snapshot, **kwargs):
+        results, _, _ = run_differential_expression(
+            CensusCubeQuery(snapshot),
+            BaseQueryCriteria(**self.criteria1),
+            BaseQueryCriteria(**self.criteria2),
+            "excludeTwo",
+            **kwargs,
+        )
+        return results
+
+    def test__top_genes__are_the_head_of_all_genes(self):
+        with create_temp_diffexp_snapshot() as snapshot:
+            all_results = self.run_differential_expression(snapshot)
+            effect_size = all_results[30]["effect_size"]
+
+            for top_n, min_effect_size, expected in [
+                (10, None, all_results[:10]),
+                (None, effect_size, all_results[:31]),
+                (10, effect_size, all_results[:10]),
+                (50, effect_size, all_results[:31]),
+                (len(all_results) + 1, None, all_results),
+            ]:
+                with self.subTest(top_n=top_n, min_effect_size=min_effect_size):
+                    results = self.run_differential_expression(snapshot, top_n=top_n, min_effect_size=min_effect_size)
+
+                    self.assertEqual(expected, results)
+
+    @patch("backend.de.api.v1.gene_term_label", side_effect=lambda gene: gene)
+    @patch("backend.de.api.v1.load_snapshot")
+    def test__differentialExpression__only_labels_top_genes(self, load_snapshot, gene_term_label):
+        with EnvironmentSetup(dict(APP_NAME="corpora-api-de")):
+            client = app.test_client(use_cookies=False)
+        with create_temp_diffexp_snapshot() as snapshot:
+            load_snapshot.return_value = snapshot
+
+            response = client.post(
+                "/de/v1/differentialExpression",
+                headers={"Content-Type": "application/json"},
+                data=json.dumps(
+                    dict(
+                        queryGroup1Filters=self.criteria1,
+                        queryGroup2Filters=self.criteria2,
+                        exclude_overlapping_cells="excludeTwo",
+                        top_n=5,
+                    )
+                ),
+            )
+
+            self.assertEqual(200, response.status_code)
+            result = json.loads(response.data)
+            self.assertEqual(5, len(result["differentialExpressionResults"]))
+            self.assertEqual(5, gene_term_label.call_count)
@@ -6,6 +6,8 @@ In detail, this module tests the public and private functions defined in
 
 import unittest
 
+import pandas as pd
+
 from backend.common.census_cube.data.query import CensusCubeQuery, CensusCubeQueryCriteria, CensusCubeQueryParams
 from backend.wmg.api.common.expression_dotplot import agg_cell_type_counts, agg_tissue_counts, get_dot_plot_data
 from backend.wmg.api.config import (
@@ -18,6 +20,8 @@ from tests.unit.backend.wmg.fixtures.test_snapshot import (
     all_tens_cell_counts_values,
     all_X_cell_counts_values,
     create_temp_wmg_snapshot,
+    random_cell_counts_values,
+    random_expression_summary_values,
 )
 
 ALL_INDEXED_DIMS_FOR_QUERY = [
@@ -30,6 +34,24 @@ ALL_INDEXED_DIMS_FOR_QUERY = [
 #  query methods
 
 
+def get_dot_plot_data_with_pandas(raw_gene_expression, cell_counts, group_by_terms):
+    """
+    Reference dot plot data, built with the pandas groupby and joins that `get_dot_plot_data` replaces.
+    """
+    cell_counts_cell_type_agg = cell_counts.groupby(group_by_terms, as_index=True).sum(numeric_only=True)
+    cell_counts_cell_type_agg.rename(columns={"n_total_cells": "n_cells_cell_type"}, inplace=True)
+    cell_counts_tissue_agg = cell_counts.groupby(["tissue_ontology_term_id"], as_index=True).sum(numeric_only=True)
+    cell_counts_tissue_agg.rename(columns={"n_total_cells": "n_cells_tissue"}, inplace=True)
+
+    expr_summary_agg = raw_gene_expression.groupby(["gene_ontology_term_id"] + group_by_terms, as_index=False).sum(
+        numeric_only=True
+    )
+    dot_plot_matrix = expr_summary_agg.join(cell_counts_cell_type_agg, on=group_by_terms, how="left").join(
+        cell_counts_tissue_agg, on=["tissue_ontology_term_id"], how="left"
+    )
+    return dot_plot_matrix, cell_counts_cell_type_agg
+
+
 def _filter_dataframe(dataframe, criteria):
     for key in criteria:
         attrs = [criteria[key]] if not isinstance(criteria[key], list) else criteria[key]
@@ -232,6 +254,35 @@ class ExpressionDotPlotTest(unittest.TestCase):
                 ),
             )
 
+    def test__query_arrow_tables__returns_same_result_as_pandas_reference(self):
+        criteria = CensusCubeQueryCriteria(
+            gene_ontology_term_ids=["gene_ontology_term_id_0", "gene_ontology_term_id_2"],
+            organism_ontology_term_id="organism_ontology_term_id_0",
+        )
+        compare = "self_reported_ethnicity_ontology_term_id"
+        group_by_terms = ["tissue_ontology_term_id", "cell_type_ontology_term_id", compare]
+
+        with create_temp_wmg_snapshot(
+            dim_size=3,
+            expression_summary_vals_fn=random_expression_summary_values,
+            cell_counts_generator_fn=random_cell_counts_values,
+        ) as snapshot:
+            q = CensusCubeQuery(snapshot, self.cube_query_params)
+            expected, expected_cell_counts = get_dot_plot_data_with_pandas(
+                q.expression_summary(criteria, compare_dimension=compare),
+                q.cell_counts(criteria, compare_dimension=compare),
+                group_by_terms,
+            )
+            result, result_cell_counts = get_dot_plot_data(
+                q.expression_summary_table(criteria, compare_dimension=compare),
+                q.cell_counts_table(criteria, compare_dimension=compare),
+                group_by_terms,
+            )
+
+        self.assertGreater(len(expected), 0)
+        pd.testing.assert_frame_equal(expected, result)
+        pd.testing.assert_frame_equal(expected_cell_counts, result_cell_counts)
+
     def test__query_agg_cell_type_counts__returns_correct_result(self):
         criteria = CensusCubeQueryCriteria(
             gene_ontology_term_ids=["gene_ontology_term_id_0"],
@@ -0,0 +1,137 @@
+"""This module tests the functions that build the gene expression summary of the WMG API query response.
+
+In detail, this module tests the public and private functions defined in
+`backend.wmg.api.common.expression_summary` module.
+"""
+
+import json
+import tracemalloc
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from backend.common.server.streaming_json import JSONObjectStream, iter_json
+from backend.wmg.api.common.expression_summary import (
+    _contiguous_runs,
+    build_expression_summary,
+    iter_expression_summary,
+)
+
+
+def _gene_expression_df(rows):
+    return pd.DataFrame(
+        rows,
+        columns=[
+            "gene_ontology_term_id",
+            "tissue_ontology_term_id",
+            "cell_type_ontology_term_id",
+            "sex_ontology_term_id",
+            "nnz",
+            "sum",
+            "n_cells_cell_type",
+            "n_cells_tissue",
+        ],
+    )
+
+
+class ExpressionSummaryTest(unittest.TestCase):
+    def setUp(self):
+        self.unrolled_df = _gene_expression_df(
+            [
+                ["gene_1", "tissue_1", "cell_type_1", "female", 2, 4.0, 10, 100],
+                ["gene_1", "tissue_1", "cell_type_1", "male", 6, 6.0, 20, 100],
+                ["gene_1", "tissue_2", "cell_type_2", "male", 0, 0.0, 5, 50],
+                ["gene_2", "tissue_1", "cell_type_2", "female", 4, 2.0, 40, 100],
+            ]
+        )
+        # cell_type_1 rolls up into its ancestor cell_type_2
+        self.rolled_df = pd.concat(
+            [
+                self.unrolled_df,
+                _gene_expression_df(
+                    [
+                        ["gene_1", "tissue_1", "cell_type_2", "female", 2, 4.0, 10, 100],
+                        ["gene_1", "tissue_1", "cell_type_2", "male", 6, 6.0, 20, 100],
+                    ]
+                ),
+            ],
+            ignore_index=True,
+        )
+
+    def test__build_expression_summary__aggregates_by_tissue_and_cell_type(self):
+        result = build_expression_summary(self.unrolled_df, self.rolled_df, None)
+
+        self.assertEqual({"gene_1", "gene_2"}, result.keys())
+        self.assertEqual({"tissue_1", "tissue_2"}, result["gene_1"].keys())
+        self.assertEqual(
+            {"tissue_stats", "cell_type_1", "cell_type_2"},
+            result["gene_1"]["tissue_1"].keys(),
+        )
+        # tissue stats are computed from the unrolled expressions
+        self.assertEqual(
+            {"aggregated": {"n": 8, "me": 1.25, "tpc": 0.08}}, result["gene_1"]["tissue_1"]["tissue_stats"]
+        )
+        self.assertEqual(
+            {"aggregated": {"n": 8, "me": 1.25, "pc": 8 / 30, "tpc": 0.08}}, result["gene_1"]["tissue_1"]["cell_type_2"]
+        )
+        # a tissue without any expressing cells has zero mean expression
+        self.assertEqual({"aggregated": {"n": 0, "me": 0.0, "tpc": 0.0}}, result["gene_1"]["tissue_2"]["tissue_stats"])
+
+    def test__build_expression_summary_with_compare__adds_compare_options_to_cell_types(self):
+        result = build_expression_summary(self.unrolled_df, self.rolled_df, "sex_ontology_term_id")
+
+        cell_type_stats = result["gene_1"]["tissue_1"]["cell_type_2"]
+        self.assertEqual({"aggregated", "female", "male"}, cell_type_stats.keys())
+        self.assertEqual({"n": 2, "me": 2.0, "pc": 0.2, "tpc": 0.02}, cell_type_stats["female"])
+        self.assertEqual({"n": 6, "me": 1.0, "pc": 0.3, "tpc": 0.06}, cell_type_stats["male"])
+        self.assertEqual({"aggregated", "female"}, result["gene_2"]["tissue_1"]["cell_type_2"].keys())
+
+    def test__build_expression_summary__empty_input_returns_empty_dict(self):
+        empty_df = self.unrolled_df.iloc[:0]
+        self.assertEqual({}, build_expression_summary(empty_df, empty_df, "sex_ontology_term_id"))
+
+    def test__iter_expression_summary__streams_the_expression_summary(self):
+        for compare in [None, "sex_ontology_term_id"]:
+            with self.subTest(compare=compare):
+                expected = build_expression_summary(self.unrolled_df, self.rolled_df, compare)
+
+                result = b"".join(
+                    iter_json(JSONObjectStream(iter_expression_summary(self.unrolled_df, self.rolled_df, compare)))
+                )
+
+                # NaN != NaN, so the summaries are compared by their (sorted) serializations
+                self.assertEqual(json.dumps(expected, sort_keys=True), json.dumps(json.loads(result), sort_keys=True))
+
+    def test__iter_expression_summary__1000_genes_streams_with_bounded_memory(self):
+        rng = np.random.default_rng(0)
+        df = pd.MultiIndex.from_product(
+            [
+                [f"ENSG{i:011d}" for i in range(1000)],
+                [f"UBERON:{i:07d}" for i in range(5)],
+                [f"CL:{i:07d}" for i in range(20)],
+            ],
+            names=["gene_ontology_term_id", "tissue_ontology_term_id", "cell_type_ontology_term_id"],
+        ).to_frame(index=False)
+        df["nnz"] = rng.integers(1, 100, len(df))
+        df["sum"] = rng.random(len(df)) * 100
+        df["n_cells_cell_type"] = rng.integers(100, 200, len(df))
+        df["n_cells_tissue"] = rng.integers(1000, 2000, len(df))
+
+        tracemalloc.start()
+        try:
+            size = sum(len(chunk) for chunk in iter_json(JSONObjectStream(iter_expression_summary(df, df, None))))
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        # the whole expression summary as nested dictionaries, serialized into a string, would take several times
+        # the size of the response
+        self.assertGreater(size, 10 * 2**20)
+        self.assertLess(peak, 2 * size)
+
+    def test__contiguous_runs(self):
+        genes = pd.Series(["a", "a", "a", "b", "b"]).to_numpy()
+        tissues = pd.Series(["x", "x", "y", "y", "y"]).to_numpy()
+        self.assertEqual([(0, 2), (2, 3), (3, 5)], _contiguous_runs(genes, tissues))
+        self.assertEqual([], _contiguous_runs(genes[:0]))
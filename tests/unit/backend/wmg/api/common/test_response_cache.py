@@ -0,0 +1,68 @@
+"""This module tests the query response cache used by `backend.wmg.api.v2.py`."""
+
+from backend.common.census_cube.data.criteria import CensusCubeQueryCriteria
+from backend.wmg.api.common.response_cache import ResponseCache, build_query_cache_key, etag_for_cache_key
+
+
+def _criteria(**kwargs) -> CensusCubeQueryCriteria:
+    return CensusCubeQueryCriteria(organism_ontology_term_id="NCBITaxon:9606", **kwargs)
+
+
+def test_build_query_cache_key_ignores_filter_value_order():
+    key1 = build_query_cache_key(
+        "snapshot", _criteria(gene_ontology_term_ids=["g1"], sex_ontology_term_ids=["s1", "s2"]), None, True
+    )
+    key2 = build_query_cache_key(
+        "snapshot", _criteria(gene_ontology_term_ids=["g1"], sex_ontology_term_ids=["s2", "s1"]), None, True
+    )
+    assert key1 == key2
+    assert etag_for_cache_key(key1) == etag_for_cache_key(key2)
+
+
+def test_build_query_cache_key_distinguishes_snapshot_gene_order_compare_and_rollup():
+    criteria = _criteria(gene_ontology_term_ids=["g1", "g2"])
+    key = build_query_cache_key("snapshot", criteria, None, True)
+
+    assert key != build_query_cache_key("other_snapshot", criteria, None, True)
+    assert key != build_query_cache_key("snapshot", _criteria(gene_ontology_term_ids=["g2", "g1"]), None, True)
+    assert key != build_query_cache_key("snapshot", criteria, "sex_ontology_term_id", True)
+    assert key != build_query_cache_key("snapshot", criteria, None, False)
+
+
+def test_response_cache_evicts_least_recently_used_entries_to_stay_within_max_bytes():
+    cache = ResponseCache(max_bytes=30)
+    cache.put("a", b"x" * 9)
+    cache.put("b", b"x" * 9)
+    cache.put("c", b"x" * 9)
+    assert len(cache) == 3
+    assert cache.n_bytes == 30
+
+    # touch "a" so that "b" becomes the least recently used entry
+    assert cache.get("a") == b"x" * 9
+    cache.put("d", b"x" * 9)
+
+    assert cache.get("b") is None
+    assert cache.get("a") is not None
+    assert cache.get("c") is not None
+    assert cache.get("d") is not None
+    assert cache.n_bytes == 30
+
+
+def test_response_cache_does_not_cache_entries_larger_than_max_bytes():
+    cache = ResponseCache(max_bytes=10)
+    cache.put("a", b"x" * 5)
+    cache.put("b", b"x" * 100)
+
+    assert cache.get("a") == b"x" * 5
+    assert cache.get("b") is None
+    assert cache.n_bytes == 6
+
+
+def test_response_cache_put_replaces_existing_entry():
+    cache = ResponseCache(max_bytes=100)
+    cache.put("a", b"x" * 5)
+    cache.put("a", b"x" * 10)
+
+    assert len(cache) == 1
+    assert cache.get("a") == b"x" * 10
+    assert cache.n_bytes == 11
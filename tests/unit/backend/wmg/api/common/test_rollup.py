@@ -12,6 +12,7 @@ import pytest
 from pandas import DataFrame
 from pandas.testing import assert_frame_equal
 
+from backend.common.census_cube.data.cell_type_ancestors import build_cell_type_ancestor_matrix
 from backend.common.census_cube.data.snapshot import CELL_TYPE_ANCESTORS_FILENAME
 from backend.wmg.api.common.rollup import rollup
 from tests.unit.backend.wmg.fixtures import FIXTURES_ROOT
@@ -459,3 +460,66 @@ def test__rollup(name, input_cell_counts_df, expected_cell_counts_df, input_gene
         expected_gene_expr_df.reset_index(drop=True),
         check_dtype=False,
     )
+
+
+@pytest.mark.parametrize(
+    "name,input_cell_counts_df,expected_cell_counts_df,input_gene_expr_df," "expected_gene_expr_df", _rollup_testcases()
+)
+def test__rollup_with_ancestor_matrix__matches_rollup_with_ancestors_series(
+    name, input_cell_counts_df, expected_cell_counts_df, input_gene_expr_df, expected_gene_expr_df
+):
+    cell_type_ancestors = pd.Series(
+        {
+            "CL:0000127": ["CL:0000127"],
+            "CL:0000644": ["CL:0000127", "CL:0000644"],
+            "CL:0002605": ["CL:0000127", "CL:0002605"],
+            "CL:0002627": ["CL:0000127", "CL:0002627"],
+        }
+    )
+    cell_types = input_cell_counts_df.index.get_level_values("cell_type_ontology_term_id").unique()
+    cell_type_ancestors = cell_type_ancestors[cell_types].apply(
+        lambda ancestors: sorted(set(ancestors) & set(cell_types))
+    )
+    ancestor_matrix = build_cell_type_ancestor_matrix(cell_type_ancestors, cell_types)
+
+    for input_df, filter_redundant_nodes in [(input_cell_counts_df, True), (input_gene_expr_df, False)]:
+        assert_frame_equal(
+            rollup(input_df, ancestor_matrix, filter_redundant_nodes=filter_redundant_nodes),
+            rollup(input_df, cell_type_ancestors, filter_redundant_nodes=filter_redundant_nodes),
+        )
+
+
+def test__rollup__filters_out_redundant_nodes_within_each_group():
+    """
+    CL:0000127 has the same number of cells as its only descendant with cells, CL:0000644, in UBERON:0000955,
+    so it is redundant there. In UBERON:0002113, CL:0002605 also has cells, so CL:0000127 is not redundant.
+    """
+    cell_type_ancestors = pd.Series(
+        {
+            "CL:0000127": ["CL:0000127"],
+            "CL:0000644": ["CL:0000127", "CL:0000644"],
+            "CL:0002605": ["CL:0000127", "CL:0002605"],
+        }
+    )
+    input_cell_counts_df = _cell_counts_df_without_compare_dim(
+        [
+            ["UBERON:0000955", "CL:0000644", 70],
+            ["UBERON:0002113", "CL:0000644", 70],
+            ["UBERON:0002113", "CL:0002605", 80],
+        ]
+    )
+    ancestor_matrix = build_cell_type_ancestor_matrix(cell_type_ancestors, cell_type_ancestors.index)
+
+    rolled_up_cell_counts_df = rollup(input_cell_counts_df, ancestor_matrix, filter_redundant_nodes=True)
+
+    assert_frame_equal(
+        rolled_up_cell_counts_df,
+        _cell_counts_df_without_compare_dim(
+            [
+                ["UBERON:0000955", "CL:0000644", 70],
+                ["UBERON:0002113", "CL:0000127", 150],
+                ["UBERON:0002113", "CL:0000644", 70],
+                ["UBERON:0002113", "CL:0002605", 80],
+            ]
+        ),
+    )
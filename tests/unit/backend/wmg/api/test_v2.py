@@ -3,10 +3,17 @@ import unittest
 from typing import Dict, List
 from unittest.mock import patch
 
+import pyarrow as pa
 from pytest import approx
 
 from backend.common.census_cube.data.query import MarkerGeneQueryCriteria
-from backend.wmg.api.v2 import find_dimension_id_from_compare
+from backend.wmg.api.v2 import (
+    QueryCellCounts,
+    build_query_response,
+    find_dimension_id_from_compare,
+    query_response_cache,
+    table_not_containing_comma_delimited_ethnicity_values,
+)
 from backend.wmg.server.app import app
 from tests.test_utils import compare_dicts
 from tests.unit.backend.fixtures.environment_setup import EnvironmentSetup
@@ -468,6 +475,8 @@ class WmgApiV2Tests(unittest.TestCase):
         super().setUp()
         with EnvironmentSetup(dict(APP_NAME="corpora-api-wmg")):
             self.app = app.test_client(use_cookies=False)
+        # test snapshots share a snapshot id, so responses cached by one test must not be served to another
+        query_response_cache.clear()
 
     @classmethod
     def setUpClass(cls) -> None:
@@ -729,7 +738,7 @@ class WmgApiV2Tests(unittest.TestCase):
             # output is a function of the single valued ethnicity term IDs.
             ethnicities = [f"self_reported_ethnicity_ontology_term_id_{i}" for i in range(dim_size - 1)]
 
-            (expected_expression_summary, expected_term_id_labels) = gen_expected_output_ethnicity_compare_dim(
+            expected_expression_summary, expected_term_id_labels = gen_expected_output_ethnicity_compare_dim(
                 genes=genes,
                 cell_types=cell_types,
                 tissues=all_tissues,
@@ -785,7 +794,7 @@ class WmgApiV2Tests(unittest.TestCase):
             genes = ["gene_ontology_term_id_0"]
             organism = "organism_ontology_term_id_0"
 
-            (request, _, expected_term_id_labels) = generate_test_inputs_and_expected_outputs(
+            request, _, expected_term_id_labels = generate_test_inputs_and_expected_outputs(
                 genes, organism, dim_size, 1.0, 10, cell_ordering_func=reverse_cell_type_ordering
             )
 
@@ -822,7 +831,7 @@ class WmgApiV2Tests(unittest.TestCase):
             genes = ["gene_ontology_term_id_0"]
             organism = "organism_ontology_term_id_0"
 
-            (request, _, expected_term_id_labels) = generate_test_inputs_and_expected_outputs(
+            request, _, expected_term_id_labels = generate_test_inputs_and_expected_outputs(
                 genes, organism, dim_size, 1.0, expected_count, cell_ordering_func=reverse_cell_type_ordering
             )
 
@@ -833,6 +842,178 @@ class WmgApiV2Tests(unittest.TestCase):
             expected = expected_term_id_labels["cell_types"]
             self.assertEqual(expected, json.loads(response.data)["term_id_labels"]["cell_types"])
 
+    @patch("backend.wmg.api.v2.build_query_response", wraps=build_query_response)
+    @patch("backend.wmg.api.v2.gene_term_label")
+    @patch("backend.wmg.api.v2.ontology_term_label")
+    @patch("backend.wmg.api.v2.load_snapshot")
+    def test__query_repeated_request__returns_cached_response(
+        self, load_snapshot, ontology_term_label, gene_term_label, build_query_response_spy
+    ):
+        with create_temp_wmg_snapshot(
+            dim_size=2,
+            expression_summary_vals_fn=all_ones_expression_summary_values,
+            cell_counts_generator_fn=all_tens_cell_counts_values,
+        ) as snapshot:
+            load_snapshot.return_value = snapshot
+            ontology_term_label.side_effect = lambda ontology_term_id: f"{ontology_term_id}_label"
+            gene_term_label.side_effect = lambda gene_term_id: f"{gene_term_id}_label"
+
+            request = dict(
+                filter=dict(
+                    gene_ontology_term_ids=["gene_ontology_term_id_0"],
+                    organism_ontology_term_id="organism_ontology_term_id_0",
+                    development_stage_ontology_term_ids=[
+                        "development_stage_ontology_term_id_0",
+                        "development_stage_ontology_term_id_1",
+                    ],
+                ),
+            )
+            # same query, with the filter values in a different order
+            equivalent_request = dict(
+                filter=dict(
+                    gene_ontology_term_ids=["gene_ontology_term_id_0"],
+                    organism_ontology_term_id="organism_ontology_term_id_0",
+                    development_stage_ontology_term_ids=[
+                        "development_stage_ontology_term_id_1",
+                        "development_stage_ontology_term_id_0",
+                    ],
+                ),
+            )
+
+            # the response is cached once its body has been streamed
+            first_response = self.app.post("/wmg/v2/query", json=request, buffered=True)
+            second_response = self.app.post("/wmg/v2/query", json=equivalent_request)
+
+        self.assertEqual(200, first_response.status_code)
+        self.assertEqual(200, second_response.status_code)
+        self.assertEqual(json.loads(first_response.data), json.loads(second_response.data))
+        self.assertEqual(first_response.headers["ETag"], second_response.headers["ETag"])
+        self.assertEqual("no-cache", second_response.headers["Cache-Control"])
+        self.assertEqual(1, build_query_response_spy.call_count)
+
+    @patch("backend.wmg.api.v2.build_query_response", wraps=build_query_response)
+    @patch("backend.wmg.api.v2.gene_term_label")
+    @patch("backend.wmg.api.v2.ontology_term_label")
+    @patch("backend.wmg.api.v2.load_snapshot")
+    def test__query_with_matching_if_none_match__returns_412(
+        self, load_snapshot, ontology_term_label, gene_term_label, build_query_response_spy
+    ):
+        with create_temp_wmg_snapshot(dim_size=1) as snapshot:
+            load_snapshot.return_value = snapshot
+            ontology_term_label.side_effect = lambda ontology_term_id: f"{ontology_term_id}_label"
+            gene_term_label.side_effect = lambda gene_term_id: f"{gene_term_id}_label"
+
+            request = dict(
+                filter=dict(
+                    gene_ontology_term_ids=["gene_ontology_term_id_0"],
+                    organism_ontology_term_id="organism_ontology_term_id_0",
+                ),
+            )
+            response = self.app.post("/wmg/v2/query", json=request)
+            etag = response.headers["ETag"]
+
+            query_response_cache.clear()
+            precondition_failed_response = self.app.post("/wmg/v2/query", json=request, headers={"If-None-Match": etag})
+
+            # a different query must not match the ETag
+            request["compare"] = "self_reported_ethnicity"
+            modified_response = self.app.post("/wmg/v2/query", json=request, headers={"If-None-Match": etag})
+
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(412, precondition_failed_response.status_code)
+        self.assertEqual(etag, precondition_failed_response.headers["ETag"])
+        self.assertEqual(b"", precondition_failed_response.data)
+        self.assertEqual(200, modified_response.status_code)
+        self.assertNotEqual(etag, modified_response.headers["ETag"])
+        self.assertEqual(2, build_query_response_spy.call_count)
+
+    @patch("backend.wmg.api.v2.QueryCellCounts.query", wraps=QueryCellCounts.query)
+    @patch("backend.wmg.api.v2.gene_term_label")
+    @patch("backend.wmg.api.v2.ontology_term_label")
+    @patch("backend.wmg.api.v2.load_snapshot")
+    def test__query_batch__returns_query_responses_and_shares_cell_counts(
+        self, load_snapshot, ontology_term_label, gene_term_label, query_cell_counts_spy
+    ):
+        with create_temp_wmg_snapshot(
+            dim_size=3,
+            expression_summary_vals_fn=all_ones_expression_summary_values,
+            cell_counts_generator_fn=all_tens_cell_counts_values,
+        ) as snapshot:
+            load_snapshot.return_value = snapshot
+            ontology_term_label.side_effect = lambda ontology_term_id: f"{ontology_term_id}_label"
+            gene_term_label.side_effect = lambda gene_term_id: f"{gene_term_id}_label"
+
+            def request(genes, compare=None):
+                request = dict(
+                    filter=dict(
+                        gene_ontology_term_ids=genes,
+                        organism_ontology_term_id="organism_ontology_term_id_0",
+                        development_stage_ontology_term_ids=[
+                            "development_stage_ontology_term_id_0",
+                            "development_stage_ontology_term_id_1",
+                        ],
+                    )
+                )
+                if compare:
+                    request["compare"] = compare
+                return request
+
+            # two gene panels with the same filters, and one of them compared by ethnicity
+            queries = [
+                request(["gene_ontology_term_id_0"]),
+                request(["gene_ontology_term_id_1", "gene_ontology_term_id_2"]),
+                request(["gene_ontology_term_id_0"], compare="self_reported_ethnicity"),
+            ]
+            batch_response = self.app.post("/wmg/v2/query_batch", json=dict(queries=queries))
+            batch_result = json.loads(batch_response.data)
+
+            query_response_cache.clear()
+            expected_results = [json.loads(self.app.post("/wmg/v2/query", json=query).data) for query in queries]
+
+        self.assertEqual(200, batch_response.status_code)
+        self.assertEqual(snapshot.snapshot_identifier, batch_result["snapshot_id"])
+        self.assertEqual(expected_results, batch_result["results"])
+        # the cell counts are queried once per filters and compare dimension in the batch, and once per query
+        self.assertEqual(2 + len(queries), query_cell_counts_spy.call_count)
+
+    @patch("backend.wmg.api.v2.gene_term_label")
+    @patch("backend.wmg.api.v2.ontology_term_label")
+    @patch("backend.wmg.api.v2.load_snapshot")
+    def test__query__reports_stage_timings(self, load_snapshot, ontology_term_label, gene_term_label):
+        with create_temp_wmg_snapshot(dim_size=2) as snapshot:
+            load_snapshot.return_value = snapshot
+            ontology_term_label.side_effect = lambda ontology_term_id: f"{ontology_term_id}_label"
+            gene_term_label.side_effect = lambda gene_term_id: f"{gene_term_id}_label"
+
+            request = dict(
+                filter=dict(
+                    gene_ontology_term_ids=["gene_ontology_term_id_0"],
+                    organism_ontology_term_id="organism_ontology_term_id_0",
+                ),
+            )
+            response = self.app.post("/wmg/v2/query", json=request)
+
+        stages = {entry.strip().split(";")[0] for entry in response.headers["Server-Timing"].split(",")}
+        self.assertLessEqual(
+            {
+                "load-snapshot",
+                "read-expression-summary",
+                "read-cell-counts",
+                "aggregate-cell-counts",
+                "aggregate-expression-summary",
+                "rollup-expression-summary",
+                "rollup-cell-counts",
+                "filter-redundant-nodes",
+                "build-cell-type-labels",
+            },
+            stages,
+        )
+
+    def test__query_batch_without_queries__returns_400(self):
+        response = self.app.post("/wmg/v2/query_batch", json=dict(queries=[]))
+
+        self.assertEqual(400, response.status_code)
+
     def test__query_containing_tissue__request_returns_400(self):
         request = dict(
             filter=dict(
@@ -1426,6 +1607,29 @@ class WmgApiV2Tests(unittest.TestCase):
             self.assertEqual(200, response.status_code)
 
 
+class TableNotContainingCommaDelimitedEthnicityValuesTests(unittest.TestCase):
+    def setUp(self):
+        ethnicities = ["HANCESTRO:1", "HANCESTRO:1,HANCESTRO:2", "HANCESTRO:2", "HANCESTRO:1,HANCESTRO:2", "unknown"]
+        self.table = pa.table(
+            dict(self_reported_ethnicity_ontology_term_id=ethnicities, n_cells=list(range(len(ethnicities))))
+        )
+
+    def test__composite_term_ids__are_excluded(self):
+        dictionary_field = pa.field("self_reported_ethnicity_ontology_term_id", pa.dictionary(pa.int32(), pa.string()))
+        dictionary_table = self.table.cast(self.table.schema.set(0, dictionary_field))
+
+        for table in [self.table, dictionary_table]:
+            with self.subTest(type=table.schema.field(0).type):
+                filtered = table_not_containing_comma_delimited_ethnicity_values(table, ["HANCESTRO:1,HANCESTRO:2"])
+
+                self.assertEqual([0, 2, 4], filtered["n_cells"].to_pylist())
+
+    def test__composite_term_ids__default_to_comma_delimited_column_values(self):
+        filtered = table_not_containing_comma_delimited_ethnicity_values(self.table)
+
+        self.assertEqual([0, 2, 4], filtered["n_cells"].to_pylist())
+
+
 # mock the dataset and collection entity data that would otherwise be fetched from the db; in this test
 # we only care that we're building the response correctly from the cube; WMG API integration tests verify
 # with real datasets
@@ -0,0 +1,85 @@
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from backend.common.census_cube.data.cell_counts_index import CellCountsIndex, intersect_masks
+
+
+class CellCountsIndexTest(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        n_rows = 1000
+        self.df = pd.DataFrame(
+            dict(
+                organism_ontology_term_id=rng.choice(["NCBITaxon:9606", "NCBITaxon:10090"], n_rows),
+                tissue_ontology_term_id=rng.choice([f"UBERON:{i}" for i in range(20)], n_rows),
+                sex_ontology_term_id=rng.choice(["PATO:0000383", "PATO:0000384", None], n_rows),
+                n_cells=rng.integers(0, 100, n_rows),
+            )
+        )
+        self.index = CellCountsIndex(self.df)
+
+    def test__only_dimension_columns_are_indexed(self):
+        self.assertEqual(
+            ["organism_ontology_term_id", "tissue_ontology_term_id", "sex_ontology_term_id"], self.index.dims
+        )
+        self.assertNotIn("n_cells", self.index)
+
+    def test__mask__matches_isin_scan(self):
+        filters = dict(
+            organism_ontology_term_id=["NCBITaxon:9606"],
+            tissue_ontology_term_id=["UBERON:1", "UBERON:7", "UBERON:unknown"],
+            sex_ontology_term_id=[],
+            n_cells=[1],
+            dataset_id=["not-indexed"],
+        )
+        expected = (
+            self.df["organism_ontology_term_id"].isin(filters["organism_ontology_term_id"])
+            & self.df["tissue_ontology_term_id"].isin(filters["tissue_ontology_term_id"])
+        ).to_numpy()
+
+        np.testing.assert_array_equal(expected, self.index.mask(filters))
+
+    def test__mask__missing_values_are_never_selected(self):
+        mask = self.index.dim_mask("sex_ontology_term_id", ["PATO:0000383", "PATO:0000384"])
+        np.testing.assert_array_equal(self.df["sex_ontology_term_id"].notna().to_numpy(), mask)
+
+    def test__term_ids__matches_unique_of_selected_rows(self):
+        mask = self.index.mask(dict(tissue_ontology_term_id=["UBERON:3", "UBERON:4"]))
+
+        for dim in self.index.dims:
+            expected = self.df[mask][dim].dropna().unique().tolist()
+            self.assertEqual(expected, self.index.term_ids(dim, mask))
+        self.assertEqual(
+            self.df["tissue_ontology_term_id"].unique().tolist(), self.index.term_ids("tissue_ontology_term_id")
+        )
+
+    def test__term_counts__matches_value_counts_of_selected_rows(self):
+        mask = self.index.mask(dict(organism_ontology_term_id=["NCBITaxon:10090"]))
+
+        counts = self.index.term_counts("tissue_ontology_term_id", mask)
+
+        expected = self.df[mask]["tissue_ontology_term_id"].value_counts()
+        self.assertEqual(expected.to_dict(), counts[counts > 0].to_dict())
+
+    def test__intersect_masks(self):
+        np.testing.assert_array_equal([True, True], intersect_masks([], 2))
+        np.testing.assert_array_equal(
+            [False, True, False], intersect_masks([np.array([True, True, False]), np.array([False, True, True])], 3)
+        )
+
+    def test__available_term_ids__matches_per_dimension_masks(self):
+        filters = dict(
+            organism_ontology_term_id=["NCBITaxon:9606"],
+            tissue_ontology_term_id=["UBERON:1", "UBERON:7"],
+            sex_ontology_term_id=[],
+            dataset_id=["not-indexed"],
+        )
+
+        available_term_ids = self.index.available_term_ids(filters)
+
+        self.assertEqual(self.index.dims, list(available_term_ids))
+        for dim in self.index.dims:
+            other_filters = {d: term_ids for d, term_ids in filters.items() if d != dim}
+            self.assertEqual(self.index.term_ids(dim, self.index.mask(other_filters)), available_term_ids[dim])
@@ -0,0 +1,44 @@
+import unittest
+
+import pandas as pd
+
+from backend.common.census_cube.data.cell_type_ancestors import build_cell_type_ancestor_matrix
+
+
+class CellTypeAncestorMatrixTest(unittest.TestCase):
+    def setUp(self):
+        self.cell_type_ancestors = pd.Series(
+            {
+                "CL:2": ["CL:0", "CL:1", "CL:2"],
+                "CL:1": ["CL:0", "CL:1"],
+                "CL:0": ["CL:0"],
+            }
+        )
+
+    def test__build_cell_type_ancestor_matrix__codes_are_sorted_and_rows_hold_ancestors(self):
+        matrix = build_cell_type_ancestor_matrix(self.cell_type_ancestors, ["CL:2", "CL:1", "CL:0"])
+
+        self.assertEqual(["CL:0", "CL:1", "CL:2"], list(matrix.cell_type_ontology_term_ids))
+        self.assertEqual([[1, 0, 0], [1, 1, 0], [1, 1, 1]], matrix.ancestors.toarray().tolist())
+        self.assertEqual([2, 0, -1], matrix.codes(["CL:2", "CL:0", "CL:3"]).tolist())
+
+    def test__build_cell_type_ancestor_matrix__includes_ancestors_of_the_given_cell_types(self):
+        matrix = build_cell_type_ancestor_matrix(self.cell_type_ancestors, ["CL:1"])
+
+        self.assertEqual(["CL:0", "CL:1"], list(matrix.cell_type_ontology_term_ids))
+        self.assertEqual([[0, 0], [1, 1]], matrix.ancestors.toarray().tolist())
+
+    def test__build_cell_type_ancestor_matrix__unknown_cell_types_are_their_own_ancestor(self):
+        matrix = build_cell_type_ancestor_matrix(self.cell_type_ancestors, ["CL:1", "CL:00"])
+
+        self.assertEqual(["CL:0", "CL:00", "CL:1"], list(matrix.cell_type_ontology_term_ids))
+        self.assertEqual([[0, 0, 0], [0, 1, 0], [1, 0, 1]], matrix.ancestors.toarray().tolist())
+
+    def test__with_cell_types__unknown_cell_types_are_their_own_ancestor(self):
+        matrix = build_cell_type_ancestor_matrix(self.cell_type_ancestors, ["CL:1", "CL:0"])
+
+        extended_matrix = matrix.with_cell_types(["CL:0", "CL:00"])
+
+        self.assertIs(matrix, matrix.with_cell_types(["CL:0"]))
+        self.assertEqual(["CL:0", "CL:00", "CL:1"], list(extended_matrix.cell_type_ontology_term_ids))
+        self.assertEqual([[1, 0, 0], [0, 1, 0], [1, 0, 1]], extended_matrix.ancestors.toarray().tolist())
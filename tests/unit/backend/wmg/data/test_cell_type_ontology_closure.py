@@ -0,0 +1,76 @@
+import unittest
+
+import numpy as np
+
+from backend.common.census_cube.utils import (
+    are_cell_types_colinear,
+    are_cell_types_colinear_array,
+    are_cell_types_not_redundant_nodes,
+    are_cell_types_not_redundant_nodes_array,
+    find_descendants_per_cell_type,
+    get_cell_type_descendant_matrix,
+    ontology_parser,
+    rollup_across_cell_type_descendants_array,
+)
+
+
+class CellTypeOntologyClosureTest(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        neurons = ontology_parser.get_term_descendants("CL:0000540", include_self=True)
+        chain = ontology_parser.get_term_ancestors("CL:0000540", include_self=True)
+        all_cell_types = ontology_parser.get_term_descendants("CL:0000000", include_self=True)
+        sampled = rng.choice(all_cell_types, 100, replace=False).tolist()
+        # cell types that are not in the ontology
+        other = ["unknown", "CL:9999999", "not a term"]
+        self.cell_types = list(dict.fromkeys(neurons[:100] + chain + sampled + other))
+        self.rng = rng
+
+    def test__descendant_matrix__equals_descendants_per_cell_type(self):
+        suffixed_cell_types = [f"{cell_type};;tissue_{i % 2}" for i, cell_type in enumerate(self.cell_types)]
+
+        for cell_types in [self.cell_types, suffixed_cell_types, self.cell_types + suffixed_cell_types]:
+            descendant_matrix = get_cell_type_descendant_matrix(cell_types)
+
+            expected = find_descendants_per_cell_type(cell_types)
+            for i, descendants in enumerate(expected):
+                self.assertEqual(
+                    sorted(descendants), sorted(np.asarray(cell_types, dtype=object)[descendant_matrix[i].indices])
+                )
+
+    def test__descendant_matrix__expands_repeated_cell_types(self):
+        cell_types = ["CL:0000540", "CL:0000000", "CL:0000540", "unknown", "CL:0000000"]
+
+        descendant_matrix = get_cell_type_descendant_matrix(cell_types)
+
+        self.assertEqual(
+            [[0, 2], [0, 1, 2, 4], [0, 2], [], [0, 1, 2, 4]],
+            [descendant_matrix[i].indices.tolist() for i in range(len(cell_types))],
+        )
+
+    def test__not_redundant_nodes__equals_not_redundant_nodes(self):
+        # roll up random counts so that some ancestors have the same number of cells as one of their descendants
+        n_cells = self.rng.integers(0, 3, len(self.cell_types)).astype(float)
+        rolled_up = rollup_across_cell_type_descendants_array(n_cells, np.array(self.cell_types), parallel=False)
+        cell_counts = dict(zip(self.cell_types[:-5], rolled_up[:-5].astype(int).tolist(), strict=False))
+
+        is_not_redundant = are_cell_types_not_redundant_nodes_array(self.cell_types, cell_counts)
+
+        self.assertEqual(are_cell_types_not_redundant_nodes(self.cell_types, cell_counts), is_not_redundant.tolist())
+        self.assertFalse(is_not_redundant.all())
+
+    def test__colinear__equals_colinear(self):
+        cell_types = np.array(self.cell_types[:60], dtype=object)
+
+        is_colinear = are_cell_types_colinear_array(cell_types[:, None], cell_types[None, :])
+
+        expected = [
+            [are_cell_types_colinear(cell_type1, cell_type2) for cell_type2 in cell_types] for cell_type1 in cell_types
+        ]
+        self.assertEqual(expected, is_colinear.tolist())
+        # `ancestors` raises a KeyError for CL ids that are not in the ontology
+        cell_types = [cell_type for cell_type in self.cell_types if cell_type != "CL:9999999"]
+        self.assertEqual(
+            [are_cell_types_colinear(cell_type, "CL:0000540") for cell_type in cell_types],
+            are_cell_types_colinear_array(cell_types, "CL:0000540").tolist(),
+        )
@@ -0,0 +1,71 @@
+import numpy as np
+import pytest
+import tiledb
+
+from backend.common.census_cube.data.cube_handles import CubeHandles, cube_handle_metrics
+
+
+@pytest.fixture
+def cube_uri(tmp_path):
+    uri = str(tmp_path / "cube")
+    tiledb.from_numpy(uri, np.arange(10))
+    return uri
+
+
+@pytest.fixture
+def cube_handles():
+    cube_handles = CubeHandles("snapshot_1", tiledb.Ctx({"sm.tile_cache_size": 1000}))
+    yield cube_handles
+    cube_handles.close()
+
+
+def test_retire_closes_unreferenced_cubes(cube_handles, cube_uri):
+    arrays = [cube_handles.open(cube_uri) for _ in range(2)]
+    assert all(array.isopen for array in arrays)
+
+    cube_handles.retire()
+
+    assert cube_handles.closed
+    assert not any(array.isopen for array in arrays)
+    assert not cube_handles.acquire()
+
+
+def test_retired_cubes_are_closed_when_drained(cube_handles, cube_uri):
+    array = cube_handles.open(cube_uri)
+    assert cube_handles.acquire()
+    assert cube_handles.acquire()
+
+    cube_handles.retire()
+    cube_handles.release()
+    assert array.isopen
+    np.testing.assert_array_equal(np.arange(10), array[:])
+
+    cube_handles.release()
+    assert not array.isopen
+
+
+def test_release_does_not_close_current_cubes(cube_handles, cube_uri):
+    array = cube_handles.open(cube_uri)
+    assert cube_handles.acquire()
+
+    cube_handles.release()
+
+    assert array.isopen
+    assert not cube_handles.closed
+
+
+def test_cube_handle_metrics(cube_handles, cube_uri):
+    cube_handles.open(cube_uri)
+    cube_handles.acquire()
+    metrics_while_open = cube_handle_metrics()
+
+    cube_handles.close()
+
+    metrics = cube_handle_metrics()
+    assert metrics["census_cube.snapshots.open"] == metrics_while_open["census_cube.snapshots.open"] - 1
+    assert metrics["census_cube.cubes.open"] == metrics_while_open["census_cube.cubes.open"] - 1
+    assert metrics["census_cube.cubes.references"] == metrics_while_open["census_cube.cubes.references"] - 1
+    assert (
+        metrics["census_cube.tile_cache.budget_bytes"]
+        == metrics_while_open["census_cube.tile_cache.budget_bytes"] - 1000
+    )
@@ -0,0 +1,85 @@
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from backend.common.census_cube.data.criteria import BaseQueryCriteria
+from backend.common.census_cube.data.snapshot import CensusCubeSnapshot
+from backend.common.census_cube.utils import (
+    build_filter_relationships,
+    find_dim_option_values,
+    find_dims_option_values,
+)
+
+DIMENSIONS = [
+    "dataset_id",
+    "disease_ontology_term_id",
+    "sex_ontology_term_id",
+    "development_stage_ontology_term_id",
+    "self_reported_ethnicity_ontology_term_id",
+    "tissue_ontology_term_id",
+    "cell_type_ontology_term_id",
+    "publication_citation",
+]
+
+
+class FindDimsOptionValuesTest(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        n_rows = 300
+        self.cell_counts_df = pd.DataFrame(
+            dict(
+                organism_ontology_term_id=rng.choice(["NCBITaxon:9606", "NCBITaxon:10090"], n_rows),
+                dataset_id=rng.choice([f"dataset_{i}" for i in range(8)], n_rows),
+                disease_ontology_term_id=rng.choice(["PATO:0000461", "MONDO:1", "MONDO:2"], n_rows),
+                sex_ontology_term_id=rng.choice(["PATO:0000383", "PATO:0000384"], n_rows),
+                development_stage_ontology_term_id=rng.choice([f"HsapDv:{i}" for i in range(5)], n_rows),
+                self_reported_ethnicity_ontology_term_id=rng.choice(["HANCESTRO:1", "HANCESTRO:1,HANCESTRO:2"], n_rows),
+                tissue_ontology_term_id=rng.choice([f"UBERON:{i}" for i in range(10)], n_rows),
+                cell_type_ontology_term_id=rng.choice([f"CL:{i}" for i in range(40)], n_rows),
+                publication_citation=rng.choice(["Author et al. (2024)", "No Publication"], n_rows),
+                n_cells=rng.integers(1, 100, n_rows),
+            )
+        )
+        self.snapshot = CensusCubeSnapshot(filter_relationships=build_filter_relationships(self.cell_counts_df))
+
+    def test__find_dims_option_values__equals_per_dimension_option_values(self):
+        all_criteria = [
+            BaseQueryCriteria(organism_ontology_term_id="NCBITaxon:9606", tissue_ontology_term_ids=["UBERON:1"]),
+            BaseQueryCriteria(
+                organism_ontology_term_id="NCBITaxon:10090",
+                dataset_ids=["dataset_0", "dataset_3"],
+                sex_ontology_term_ids=["PATO:0000383"],
+            ),
+            BaseQueryCriteria(
+                organism_ontology_term_id="NCBITaxon:9606",
+                tissue_ontology_term_ids=["UBERON:2", "UBERON:5"],
+                cell_type_ontology_term_ids=["CL:3", "CL:7", "CL:unknown"],
+                disease_ontology_term_ids=["MONDO:1"],
+                publication_citations=["No Publication"],
+            ),
+            BaseQueryCriteria(
+                organism_ontology_term_id="NCBITaxon:9606",
+                development_stage_ontology_term_ids=["HsapDv:0"],
+                self_reported_ethnicity_ontology_term_ids=["HANCESTRO:1"],
+                dataset_ids=["dataset_1"],
+                cell_type_ontology_term_ids=["CL:11"],
+            ),
+        ]
+
+        for criteria in all_criteria:
+            with self.subTest(criteria=criteria):
+                option_values = find_dims_option_values(criteria, self.snapshot, DIMENSIONS)
+
+                self.assertEqual(DIMENSIONS, list(option_values))
+                for dimension in DIMENSIONS:
+                    self.assertCountEqual(
+                        find_dim_option_values(criteria, self.snapshot, dimension), option_values[dimension]
+                    )
+
+    def test__find_dims_option_values__depluralizes_dimensions(self):
+        criteria = BaseQueryCriteria(organism_ontology_term_id="NCBITaxon:9606", sex_ontology_term_ids=["PATO:0000383"])
+
+        option_values = find_dims_option_values(criteria, self.snapshot, ["sex_ontology_term_ids"])
+
+        self.assertCountEqual(["PATO:0000383", "PATO:0000384"], option_values["sex_ontology_term_id"])
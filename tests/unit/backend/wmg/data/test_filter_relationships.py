@@ -0,0 +1,146 @@
+import io
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from backend.common.census_cube.data.criteria import BaseQueryCriteria
+from backend.common.census_cube.data.filter_relationships import FilterRelationships
+from backend.common.census_cube.data.snapshot import CensusCubeSnapshot
+from backend.common.census_cube.utils import (
+    build_filter_relationships,
+    find_all_dim_option_values,
+    find_dim_option_values,
+    to_dict,
+)
+
+
+def build_string_filter_relationships(cell_counts_df: pd.DataFrame) -> dict:
+    """
+    Reference build of the filter relationships graph, from the pairwise combinations of the prefixed filter values
+    of every row.
+    """
+    df_filters = cell_counts_df.select_dtypes(exclude="number")
+    mat = np.tile(df_filters.columns.values[None, :], (cell_counts_df.shape[0], 1)) + "__" + df_filters.values
+
+    Xs, Ys = [], []
+    for i in range(mat.shape[0]):
+        Xs.extend(np.repeat(mat[i], mat[i].size))
+        Ys.extend(np.tile(mat[i], mat[i].size))
+    Xs, Ys = np.unique(np.array((Xs, Ys)), axis=1)
+    filt = Xs != Ys
+
+    filter_relationships = to_dict(Xs[filt], Ys[filt])
+    for k, v in filter_relationships.items():
+        filter_relationships[k] = to_dict([x.split("__")[0] for x in v], v)
+    return filter_relationships
+
+
+def find_string_dim_option_values(criteria: dict, filter_relationships: dict, dimension: str) -> list:
+    """
+    Reference option values of a dimension, from the intersection of the sets of prefixed filter values linked to
+    each criteria key.
+    """
+    linked_filter_sets = []
+    for key, attrs in criteria.items():
+        key = key[:-1] if key[-1] == "s" else key
+        if key == dimension or key == "gene_ontology_term_id" or not attrs:
+            continue
+        attrs = attrs if isinstance(attrs, list) else [attrs]
+        linked_filter_set = set()
+        for attr in attrs:
+            linked_filter_set |= set(filter_relationships.get(f"{key}__{attr}", {}).get(dimension, []))
+        if linked_filter_set or len(attrs) > 1:
+            linked_filter_sets.append(linked_filter_set)
+
+    if not linked_filter_sets:
+        return []
+    return [option.split("__", 1)[1] for option in set.intersection(*linked_filter_sets)]
+
+
+def sorted_graph(filter_relationships: dict) -> dict:
+    return {
+        key: {dim: sorted(linked_keys) for dim, linked_keys in linked_filters.items()}
+        for key, linked_filters in filter_relationships.items()
+    }
+
+
+class FilterRelationshipsTest(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        n_rows = 400
+        self.cell_counts_df = pd.DataFrame(
+            dict(
+                organism_ontology_term_id=rng.choice(["NCBITaxon:9606", "NCBITaxon:10090"], n_rows),
+                dataset_id=rng.choice([f"dataset_{i}" for i in range(8)], n_rows),
+                disease_ontology_term_id=rng.choice(["PATO:0000461", "MONDO:1", "MONDO:2"], n_rows),
+                sex_ontology_term_id=rng.choice(["PATO:0000383", "PATO:0000384"], n_rows),
+                tissue_ontology_term_id=rng.choice([f"UBERON:{i}" for i in range(10)], n_rows),
+                cell_type_ontology_term_id=rng.choice([f"CL:{i}" for i in range(60)], n_rows),
+                publication_citation=rng.choice(["Author et al. (2024)", "No Publication"], n_rows),
+                n_cells=rng.integers(1, 100, n_rows),
+            )
+        )
+        self.filter_relationships = build_filter_relationships(self.cell_counts_df)
+        self.string_filter_relationships = build_string_filter_relationships(self.cell_counts_df)
+
+    def test__build__equals_string_build(self):
+        self.assertEqual(
+            sorted_graph(self.string_filter_relationships), sorted_graph(self.filter_relationships.to_dict())
+        )
+
+    def test__from_dict__round_trips(self):
+        filter_relationships = FilterRelationships.from_dict(self.string_filter_relationships)
+
+        self.assertEqual(sorted_graph(self.string_filter_relationships), sorted_graph(filter_relationships.to_dict()))
+
+    def test__save__round_trips(self):
+        f = io.BytesIO()
+        self.filter_relationships.save(f)
+
+        filter_relationships = FilterRelationships.load(f.getvalue())
+
+        self.assertEqual(self.filter_relationships.to_dict(), filter_relationships.to_dict())
+        self.assertEqual(self.filter_relationships.dims, filter_relationships.dims)
+
+    def test__links__are_symmetric(self):
+        for (dim, linked_dim), matrix in self.filter_relationships.links.items():
+            with self.subTest(dim=dim, linked_dim=linked_dim):
+                self.assertEqual(0, (matrix != self.filter_relationships.links[linked_dim, dim].T).nnz)
+
+    def test__option_values__equal_string_option_values(self):
+        snapshot = CensusCubeSnapshot(filter_relationships=self.filter_relationships)
+        all_criteria = [
+            BaseQueryCriteria(organism_ontology_term_id="NCBITaxon:9606", tissue_ontology_term_ids=["UBERON:1"]),
+            BaseQueryCriteria(
+                organism_ontology_term_id="NCBITaxon:10090",
+                dataset_ids=["dataset_0", "dataset_3"],
+                sex_ontology_term_ids=["PATO:0000383"],
+                cell_type_ontology_term_ids=["CL:3", "CL:unknown"],
+            ),
+            BaseQueryCriteria(
+                organism_ontology_term_id="NCBITaxon:9606",
+                tissue_ontology_term_ids=["UBERON:2", "UBERON:5"],
+                disease_ontology_term_ids=["MONDO:1"],
+                publication_citations=["No Publication"],
+            ),
+        ]
+
+        for criteria in all_criteria:
+            for dimension in self.filter_relationships.dims:
+                with self.subTest(criteria=criteria, dimension=dimension):
+                    self.assertCountEqual(
+                        find_string_dim_option_values(dict(criteria), self.string_filter_relationships, dimension),
+                        find_dim_option_values(dict(criteria), snapshot, dimension),
+                    )
+
+        for dimension in ["tissue_ontology_term_id", "cell_type_ontology_term_id"]:
+            self.assertCountEqual(
+                [
+                    option.split("__", 1)[1]
+                    for option in self.string_filter_relationships["organism_ontology_term_id__NCBITaxon:9606"][
+                        dimension
+                    ]
+                ],
+                find_all_dim_option_values(snapshot, "NCBITaxon:9606", dimension),
+            )
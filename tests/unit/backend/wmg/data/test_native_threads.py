@@ -0,0 +1,41 @@
+import subprocess
+import sys
+
+import pytest
+
+# Contends for a `native_lock`, and converts Arrow tables to pandas for the first time, on the native threads of a
+# `native_thread_pool` in a process whose `threading` is monkey-patched by gevent, as in the deployed gevent workers.
+_GEVENT_POOL_SCRIPT = """
+from gevent import monkey
+
+monkey.patch_all()
+
+import pyarrow as pa
+
+from backend.common.census_cube.data.native_threads import native_lock, native_thread_pool
+
+native_sleep = monkey.get_original("time", "sleep")
+lock = native_lock()
+
+
+def work(i):
+    for _ in range(10):
+        with lock:
+            native_sleep(0.001)
+    return len(pa.table({"a": [i]}).to_pandas())
+
+
+with native_thread_pool(4) as executor:
+    print(sum(executor.map(work, range(8))))
+"""
+
+
+def test_native_thread_pool_does_not_deadlock_under_gevent():
+    pytest.importorskip("gevent")
+
+    result = subprocess.run(
+        [sys.executable, "-c", _GEVENT_POOL_SCRIPT], capture_output=True, text=True, check=False, timeout=60
+    )
+
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip() == "8"
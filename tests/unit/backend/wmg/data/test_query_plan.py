@@ -0,0 +1,149 @@
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+import tiledb
+
+from backend.common.census_cube.data.criteria import CensusCubeQueryCriteria
+from backend.common.census_cube.data.query import CensusCubeQuery, CensusCubeQueryParams
+from backend.common.census_cube.data.query_plan import plan_cube_query
+from backend.common.census_cube.data.snapshot import CensusCubeSnapshot
+from backend.wmg.api.config import (
+    READER_CENSUS_CUBE_CUBE_QUERY_VALID_ATTRIBUTES,
+    READER_CENSUS_CUBE_CUBE_QUERY_VALID_DIMENSIONS,
+)
+from tests.unit.backend.wmg.fixtures.test_cube_schema import expression_summary_schema
+
+
+class PlanCubeQueryTest(unittest.TestCase):
+    def test__dimension_criteria_become_sorted_ranges(self):
+        plan = plan_cube_query(
+            expression_summary_schema,
+            dict(
+                gene_ontology_term_ids=["gene_2", "gene_1", "gene_2"],
+                organism_ontology_term_id="organism_1",
+                tissue_ontology_term_ids=[],
+            ),
+        )
+
+        self.assertEqual((["gene_1", "gene_2"], [], ["organism_1"]), plan.ranges)
+        self.assertIsNone(plan.cond)
+
+    def test__attribute_criteria_become_condition(self):
+        plan = plan_cube_query(
+            expression_summary_schema,
+            dict(
+                organism_ontology_term_id="organism_1",
+                cell_type_ontology_term_ids=["cell_type_1"],
+                development_stage_ontology_term_ids=["stage_1", "stage_2"],
+                self_reported_ethnicity_ontology_term_ids=[],
+            ),
+        )
+
+        self.assertEqual(([], [], ["organism_1"]), plan.ranges)
+        self.assertEqual(
+            "cell_type_ontology_term_id == val('cell_type_1') and "
+            "development_stage_ontology_term_id in ['stage_1', 'stage_2']",
+            plan.cond,
+        )
+
+    def test__condition_values_are_quoted(self):
+        plan = plan_cube_query(expression_summary_schema, dict(cell_type_ontology_term_ids=["O'Brien", 'say "hi"']))
+
+        self.assertEqual("""cell_type_ontology_term_id in ["O'Brien", 'say "hi"']""", plan.cond)
+
+    def test__partitions__split_leading_dimension_ranges_in_order(self):
+        plan = plan_cube_query(
+            expression_summary_schema,
+            dict(gene_ontology_term_ids=["gene_3", "gene_1", "gene_2"], cell_type_ontology_term_ids=["cell_type_1"]),
+        )
+
+        partitions = plan.partitions(2)
+
+        self.assertEqual([(["gene_1", "gene_2"], [], []), (["gene_3"], [], [])], [p.ranges for p in partitions])
+        self.assertEqual([plan.cond, plan.cond], [p.cond for p in partitions])
+        self.assertEqual([plan], plan.partitions(3))
+
+
+class CensusCubeQueryPlanTest(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        n_rows = 2000
+        self.expression_summary = pd.DataFrame(
+            dict(
+                gene_ontology_term_id=rng.choice([f"gene_{i}" for i in range(20)], n_rows),
+                tissue_ontology_term_id=rng.choice([f"tissue_{i}" for i in range(5)], n_rows),
+                organism_ontology_term_id=rng.choice(["organism_1", "organism_2"], n_rows),
+                cell_type_ontology_term_id=rng.choice([f"cell_type_{i}" for i in range(10)], n_rows),
+                development_stage_ontology_term_id=rng.choice(["stage_1", "stage_2", "stage'3"], n_rows),
+                self_reported_ethnicity_ontology_term_id=rng.choice(["ethnicity_1", "ethnicity_2"], n_rows),
+                nnz=rng.integers(1, 100, n_rows).astype(np.uint64),
+                sum=rng.random(n_rows).astype(np.float32),
+                sqsum=rng.random(n_rows).astype(np.float32),
+            )
+        )
+        self.cube_dir = tempfile.TemporaryDirectory()
+        uri = f"{self.cube_dir.name}/expression_summary"
+        tiledb.Array.create(uri, expression_summary_schema)
+        dims = [dim.name for dim in expression_summary_schema.domain]
+        with tiledb.open(uri, "w") as cube:
+            cube[tuple(self.expression_summary[dim].to_numpy() for dim in dims)] = {
+                attr.name: self.expression_summary[attr.name].to_numpy() for attr in expression_summary_schema
+            }
+        self.cube = tiledb.open(uri)
+
+    def tearDown(self):
+        self.cube.close()
+        self.cube_dir.cleanup()
+
+    def test__expression_summary__matches_filtered_dataframe(self):
+        criteria = CensusCubeQueryCriteria(
+            gene_ontology_term_ids=["gene_3", "gene_1", "gene_17"],
+            organism_ontology_term_id="organism_1",
+            tissue_ontology_term_ids=["tissue_0", "tissue_4"],
+            development_stage_ontology_term_ids=["stage_2", "stage'3"],
+            cell_type_ontology_term_ids=["cell_type_5"],
+        )
+        q = CensusCubeQuery(CensusCubeSnapshot(expression_summary_cube=self.cube))
+
+        result = q.expression_summary(criteria)
+
+        df = self.expression_summary
+        expected = df[
+            df["gene_ontology_term_id"].isin(criteria.gene_ontology_term_ids)
+            & (df["organism_ontology_term_id"] == criteria.organism_ontology_term_id)
+            & df["tissue_ontology_term_id"].isin(criteria.tissue_ontology_term_ids)
+            & df["development_stage_ontology_term_id"].isin(criteria.development_stage_ontology_term_ids)
+            & df["cell_type_ontology_term_id"].isin(criteria.cell_type_ontology_term_ids)
+        ]
+        sort_columns = list(expected.columns)
+        pd.testing.assert_frame_equal(
+            expected.sort_values(sort_columns).reset_index(drop=True),
+            result[sort_columns].sort_values(sort_columns).reset_index(drop=True),
+        )
+
+    def test__partitioned_expression_summary__matches_serial_read(self):
+        criteria = CensusCubeQueryCriteria(
+            gene_ontology_term_ids=[f"gene_{i}" for i in range(17)],
+            organism_ontology_term_id="organism_1",
+            development_stage_ontology_term_ids=["stage_1", "stage'3"],
+        )
+
+        def query(**read_params):
+            cube_query_params = CensusCubeQueryParams(
+                cube_query_valid_attrs=READER_CENSUS_CUBE_CUBE_QUERY_VALID_ATTRIBUTES,
+                cube_query_valid_dims=READER_CENSUS_CUBE_CUBE_QUERY_VALID_DIMENSIONS,
+                **read_params,
+            )
+            q = CensusCubeQuery(CensusCubeSnapshot(expression_summary_cube=self.cube), cube_query_params)
+            return q.expression_summary_table(criteria)
+
+        expected = query()
+        result = query(read_partition_size=3, read_pool_size=4)
+
+        self.assertGreater(result.num_rows, 0)
+        sort_keys = [(name, "ascending") for name in expected.column_names]
+        self.assertTrue(expected.sort_by(sort_keys).equals(result.sort_by(sort_keys)))
+        # the partitions are merged in order, regardless of which read completes first
+        self.assertTrue(result.equals(query(read_partition_size=3, read_pool_size=4)))
@@ -0,0 +1,96 @@
+import tracemalloc
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from backend.common.census_cube.utils import (
+    find_descendants_per_cell_type,
+    ontology_parser,
+    rollup_across_cell_type_descendants,
+)
+
+
+def rollup_reference(df: pd.DataFrame, group_cols: list, value_cols: list) -> pd.DataFrame:
+    """
+    Reference rollup: every row is summed with the rows of its descendants that have the same group.
+    """
+    cell_types = df["cell_type_ontology_term_id"].unique()
+    descendants = pd.DataFrame(
+        dict(cell_type_ontology_term_id=cell_types, descendant=find_descendants_per_cell_type(cell_types))
+    ).explode("descendant")
+    summed = (
+        df[["cell_type_ontology_term_id", *group_cols]]
+        .merge(descendants, on="cell_type_ontology_term_id")
+        .merge(
+            df.rename(columns={"cell_type_ontology_term_id": "descendant"}),
+            on=["descendant", *group_cols],
+        )
+        .groupby(["cell_type_ontology_term_id", *group_cols])[value_cols]
+        .sum()
+    )
+    return df[["cell_type_ontology_term_id", *group_cols]].join(summed, on=["cell_type_ontology_term_id", *group_cols])
+
+
+class RollupAcrossCellTypeDescendantsTest(unittest.TestCase):
+    def setUp(self):
+        self.all_cell_types = ontology_parser.get_term_descendants("CL:0000000", include_self=True)
+        self.rng = np.random.default_rng(0)
+
+    def test__rollup__equals_reference_rollup(self):
+        n_rows = 3000
+        neurons = ontology_parser.get_term_descendants("CL:0000540", include_self=True)
+        cell_types = neurons[:150] + ontology_parser.get_term_ancestors("CL:0000540", include_self=True)
+        df = pd.DataFrame(
+            dict(
+                cell_type_ontology_term_id=self.rng.choice(cell_types, n_rows),
+                tissue_ontology_term_id=self.rng.choice([f"UBERON:{i}" for i in range(5)], n_rows),
+                dataset_id=self.rng.choice([f"dataset_{i}" for i in range(4)], n_rows),
+                n_cells=self.rng.integers(1, 100, n_rows),
+                sum=self.rng.random(n_rows),
+            )
+        ).drop_duplicates(["cell_type_ontology_term_id", "tissue_ontology_term_id", "dataset_id"])
+
+        rolled_up = rollup_across_cell_type_descendants(df)
+
+        expected = rollup_reference(df, ["tissue_ontology_term_id", "dataset_id"], ["n_cells", "sum"])
+        np.testing.assert_array_equal(expected["n_cells"].to_numpy(), rolled_up["n_cells"].to_numpy())
+        np.testing.assert_allclose(expected["sum"].to_numpy(), rolled_up["sum"].to_numpy())
+        self.assertEqual(df["n_cells"].dtype, rolled_up["n_cells"].dtype)
+        pd.testing.assert_index_equal(df.index, rolled_up.index)
+
+    def test__rollup__skips_ignored_columns(self):
+        df = pd.DataFrame(
+            dict(
+                cell_type_ontology_term_id=["CL:0000540", "CL:0000000", "unknown"], n_cells=[1, 2, 4], rollup=[1, 2, 4]
+            )
+        )
+
+        rolled_up = rollup_across_cell_type_descendants(df, ignore_cols=["n_cells"])
+
+        self.assertEqual([1, 2, 4], rolled_up["n_cells"].tolist())
+        # "unknown" has no descendants, not even itself
+        self.assertEqual([1, 3, 0], rolled_up["rollup"].tolist())
+
+    def test__rollup__memory_is_bounded_by_the_rows(self):
+        # 2,000 cell types x 500 tissues x 50 datasets, of which a dense array over every combination would take
+        # 2,000 * 500 * 50 * 8 bytes = 400MB
+        n_rows = 300_000
+        df = pd.DataFrame(
+            dict(
+                cell_type_ontology_term_id=self.rng.choice(self.all_cell_types[:2000], n_rows),
+                tissue_ontology_term_id=self.rng.choice([f"UBERON:{i}" for i in range(500)], n_rows),
+                dataset_id=self.rng.choice([f"dataset_{i}" for i in range(50)], n_rows),
+                n_cells=self.rng.integers(1, 100, n_rows),
+            )
+        ).drop_duplicates(["cell_type_ontology_term_id", "tissue_ontology_term_id", "dataset_id"])
+
+        tracemalloc.start()
+        try:
+            rolled_up = rollup_across_cell_type_descendants(df)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        self.assertLess(peak, 100 * 2**20)
+        self.assertTrue((rolled_up["n_cells"] >= df["n_cells"]).all())
@@ -0,0 +1,94 @@
+import os
+import tempfile
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import Mock
+
+import numpy as np
+import pandas as pd
+
+from backend.common.census_cube.data.shared_artifacts import share_arrays, share_dataframe
+
+
+class ShareDataFrameTest(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        n_rows = 500
+        self.df = pd.DataFrame(
+            dict(
+                tissue_ontology_term_id=rng.choice([f"UBERON:{i}" for i in range(5)], n_rows),
+                cell_type_ontology_term_id=rng.choice([f"CL:{i}" for i in range(20)], n_rows),
+                n_cells=rng.integers(1, 100, n_rows),
+                group_id=np.arange(n_rows, dtype=np.int32),
+            )
+        )
+        self.shared_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.shared_dir.cleanup()
+
+    def test__share_dataframe__maps_the_built_dataframe(self):
+        shared_df = share_dataframe(self.shared_dir.name, "cell_counts", lambda: self.df)
+
+        pd.testing.assert_frame_equal(self.df, shared_df, check_dtype=False)
+        self.assertEqual(pd.StringDtype("pyarrow"), shared_df["cell_type_ontology_term_id"].dtype)
+        self.assertEqual(np.int32, shared_df["group_id"].dtype)
+        # the numeric columns are views of the read-only memory map rather than copies
+        self.assertFalse(shared_df["n_cells"].to_numpy().flags.writeable)
+
+    def test__share_dataframe__builds_once_per_host(self):
+        build = Mock(return_value=self.df)
+
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            shared_dfs = list(
+                executor.map(lambda _: share_dataframe(self.shared_dir.name, "cell_counts", build), range(4))
+            )
+
+        build.assert_called_once()
+        for shared_df in shared_dfs:
+            pd.testing.assert_frame_equal(self.df, shared_df, check_dtype=False)
+
+
+class ShareArraysTest(unittest.TestCase):
+    def setUp(self):
+        self.arrays = dict(
+            term_ids=np.array(["CL:1", "CL:2", "CL:3"], dtype=str),
+            indptr=np.array([0, 2, 3, 3], dtype=np.int32),
+            indices=np.array([0, 2, 1], dtype=np.int32),
+        )
+        self.shared_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.shared_dir.cleanup()
+
+    def test__share_arrays__maps_the_built_arrays(self):
+        shared = share_arrays(self.shared_dir.name, "filter_relationships", lambda: self.arrays)
+
+        self.assertEqual(set(self.arrays), set(shared))
+        for name, array in self.arrays.items():
+            np.testing.assert_array_equal(array, shared[name])
+            self.assertEqual(array.dtype, shared[name].dtype)
+            self.assertIsInstance(shared[name], np.memmap)
+            self.assertFalse(shared[name].flags.writeable)
+
+    def test__share_arrays__does_not_record_missing_artifact(self):
+        build = Mock(side_effect=[None, self.arrays])
+
+        self.assertIsNone(share_arrays(self.shared_dir.name, "filter_relationships", build))
+        shared = share_arrays(self.shared_dir.name, "filter_relationships", build)
+
+        self.assertEqual(2, build.call_count)
+        self.assertEqual(set(self.arrays), set(shared))
+
+    def test__share_arrays__builds_again_after_a_failed_build(self):
+        build = Mock(side_effect=[OSError("transient read error"), self.arrays])
+
+        with self.assertRaises(OSError):
+            share_arrays(self.shared_dir.name, "filter_relationships", build)
+        shared = share_arrays(self.shared_dir.name, "filter_relationships", build)
+
+        self.assertEqual(2, build.call_count)
+        for name, array in self.arrays.items():
+            np.testing.assert_array_equal(array, shared[name])
+        # the failed build leaves no partially written or marker files behind
+        self.assertEqual([".lock", "filter_relationships.arrays"], sorted(os.listdir(self.shared_dir.name)))
@@ -1,13 +1,63 @@
+import json
 import os
+import subprocess
+import sys
 from unittest.mock import patch
 
+import pandas as pd
 import pytest
+import tiledb
+from flask import Flask
 
+import backend.common.census_cube.data.snapshot as snapshot_module
+from backend.common.census_cube.data.cube_handles import CubeHandles
 from backend.common.census_cube.data.snapshot import (
+    CELL_COUNTS_CUBE_NAME,
+    CELL_COUNTS_DIFFEXP_CUBE_NAME,
+    CELL_TYPE_ANCESTORS_FILENAME,
+    CELL_TYPE_ORDERINGS_FILENAME,
+    DATASET_METADATA_FILENAME,
+    EXPRESSION_SUMMARY_CUBE_NAME,
+    EXPRESSION_SUMMARY_DEFAULT_CUBE_NAME,
+    EXPRESSION_SUMMARY_DIFFEXP_CUBE_NAME,
+    EXPRESSION_SUMMARY_DIFFEXP_SIMPLE_CUBE_NAME,
+    FILTER_RELATIONSHIPS_CSR_FILENAME,
+    FILTER_RELATIONSHIPS_FILENAME,
+    MARKER_GENES_CUBE_NAME,
+    PRIMARY_FILTER_DIMENSION_TERM_IDS_FILENAME,
+    PRIMARY_FILTER_DIMENSIONS_FILENAME,
+    CensusCubeSnapshot,
+    LazyArtifact,
     _get_wmg_snapshot_fullpath,
     _get_wmg_snapshot_rel_path,
     _get_wmg_snapshot_schema_dir_rel_path,
+    _load_snapshot,
+    _stop_snapshot_refresher,
+    build_self_reported_ethnicity_composite_term_ids,
+    load_snapshot,
+    release_request_snapshots,
 )
+from backend.common.census_cube.utils import build_filter_relationships
+
+
+@pytest.fixture
+def reset_cached_snapshot():
+    snapshot_module.cached_snapshot = None
+    yield
+    _stop_snapshot_refresher()
+    snapshot_module.cached_snapshot = None
+
+
+def _fake_load_snapshot(*, snapshot_schema_version, snapshot_id, snapshot_fs_root_path=None):
+    return CensusCubeSnapshot(snapshot_identifier=snapshot_id, snapshot_schema_version=snapshot_schema_version)
+
+
+def _fake_load_snapshot_with_cube_handles(*, snapshot_schema_version, snapshot_id, snapshot_fs_root_path=None):
+    return CensusCubeSnapshot(
+        snapshot_identifier=snapshot_id,
+        snapshot_schema_version=snapshot_schema_version,
+        cube_handles=CubeHandles(snapshot_id, tiledb.Ctx()),
+    )
 
 
 def test_get_wmg_snapshot_schema_dir_rel_path():
@@ -35,3 +85,376 @@ def test_get_wmg_snapshot_fullpath(mock_wmg_config, snapshot_fs_root_path):
         assert full_path == os.path.join(snapshot_fs_root_path, snapshot_rel_path)
     else:
         assert full_path == os.path.join("s3://test-bucket", snapshot_rel_path)
+
+
+@patch("backend.common.census_cube.data.snapshot._load_snapshot", side_effect=_fake_load_snapshot)
+@patch("backend.common.census_cube.data.snapshot._get_latest_snapshot_id", return_value="snapshot_1")
+def test_load_snapshot_without_ttl_checks_latest_snapshot_id_on_every_call(
+    mock_get_latest_snapshot_id, mock_load_snapshot, reset_cached_snapshot
+):
+    for _ in range(3):
+        snapshot = load_snapshot(snapshot_schema_version="v5", snapshot_fs_root_path=None)
+
+    assert snapshot.snapshot_identifier == "snapshot_1"
+    assert mock_get_latest_snapshot_id.call_count == 3
+    assert mock_load_snapshot.call_count == 1
+
+
+@patch("backend.common.census_cube.data.snapshot._load_snapshot", side_effect=_fake_load_snapshot)
+@patch("backend.common.census_cube.data.snapshot._get_latest_snapshot_id", return_value="snapshot_1")
+def test_load_snapshot_with_ttl_serves_cached_snapshot_without_checking_latest_snapshot_id(
+    mock_get_latest_snapshot_id, mock_load_snapshot, reset_cached_snapshot
+):
+    for _ in range(3):
+        snapshot = load_snapshot(
+            snapshot_schema_version="v5", snapshot_fs_root_path=None, snapshot_refresh_ttl_seconds=3600
+        )
+
+    assert snapshot.snapshot_identifier == "snapshot_1"
+    assert mock_get_latest_snapshot_id.call_count == 1
+    assert mock_load_snapshot.call_count == 1
+    assert snapshot_module._snapshot_refresher.is_alive()
+
+
+@patch("backend.common.census_cube.data.snapshot._load_snapshot", side_effect=_fake_load_snapshot)
+@patch("backend.common.census_cube.data.snapshot._get_latest_snapshot_id")
+def test_snapshot_refresher_swaps_in_new_snapshot(
+    mock_get_latest_snapshot_id, mock_load_snapshot, reset_cached_snapshot
+):
+    mock_get_latest_snapshot_id.return_value = "snapshot_1"
+    in_flight_snapshot = load_snapshot(
+        snapshot_schema_version="v5", snapshot_fs_root_path=None, snapshot_refresh_ttl_seconds=3600
+    )
+
+    mock_get_latest_snapshot_id.return_value = "snapshot_2"
+    snapshot_module._snapshot_refresher.refresh()
+
+    new_snapshot = load_snapshot(
+        snapshot_schema_version="v5", snapshot_fs_root_path=None, snapshot_refresh_ttl_seconds=3600
+    )
+    assert new_snapshot.snapshot_identifier == "snapshot_2"
+    # requests holding the previous snapshot are unaffected by the swap
+    assert in_flight_snapshot.snapshot_identifier == "snapshot_1"
+    assert mock_load_snapshot.call_count == 2
+
+
+@patch("backend.common.census_cube.data.snapshot._load_snapshot", side_effect=_fake_load_snapshot)
+@patch("backend.common.census_cube.data.snapshot._get_latest_snapshot_id")
+def test_load_snapshot_with_ttl_and_explicit_snapshot_id_does_not_start_refresher(
+    mock_get_latest_snapshot_id, mock_load_snapshot, reset_cached_snapshot
+):
+    for _ in range(3):
+        snapshot = load_snapshot(
+            snapshot_schema_version="v5",
+            explicit_snapshot_id_to_load="snapshot_1",
+            snapshot_fs_root_path=None,
+            snapshot_refresh_ttl_seconds=3600,
+        )
+
+    assert snapshot.snapshot_identifier == "snapshot_1"
+    mock_get_latest_snapshot_id.assert_not_called()
+    assert mock_load_snapshot.call_count == 1
+    assert snapshot_module._snapshot_refresher is None
+
+
+@patch("backend.common.census_cube.data.snapshot._load_snapshot", side_effect=_fake_load_snapshot_with_cube_handles)
+@patch("backend.common.census_cube.data.snapshot._get_latest_snapshot_id")
+def test_replaced_snapshot_cubes_are_closed_after_in_flight_request_completes(
+    mock_get_latest_snapshot_id, mock_load_snapshot, reset_cached_snapshot
+):
+    mock_get_latest_snapshot_id.return_value = "snapshot_1"
+    app = Flask(__name__)
+    with app.test_request_context():
+        in_flight_snapshot = load_snapshot(
+            snapshot_schema_version="v5", snapshot_fs_root_path=None, snapshot_refresh_ttl_seconds=3600
+        )
+        assert in_flight_snapshot.cube_handles.ref_count == 1
+
+        mock_get_latest_snapshot_id.return_value = "snapshot_2"
+        snapshot_module._snapshot_refresher.refresh()
+
+        # the replaced snapshot stays open while the request that uses it is in flight
+        assert in_flight_snapshot.cube_handles.retired
+        assert not in_flight_snapshot.cube_handles.closed
+
+        release_request_snapshots()
+
+    assert in_flight_snapshot.cube_handles.closed
+    new_snapshot = snapshot_module.cached_snapshot
+    assert new_snapshot.snapshot_identifier == "snapshot_2"
+    assert new_snapshot.cube_handles.ref_count == 0
+    assert not new_snapshot.cube_handles.closed
+    new_snapshot.cube_handles.close()
+
+
+def _write_snapshot(snapshot_fs_root_path, snapshot_rel_path):
+    snapshot_dir = os.path.join(snapshot_fs_root_path, snapshot_rel_path)
+    os.makedirs(snapshot_dir)
+
+    json_artifacts = {
+        CELL_TYPE_ORDERINGS_FILENAME: [
+            dict(tissue_ontology_term_id="UBERON:1", cell_type_ontology_term_id="CL:1", order=0),
+            dict(tissue_ontology_term_id="UBERON:1", cell_type_ontology_term_id="CL:2", order=1),
+        ],
+        PRIMARY_FILTER_DIMENSIONS_FILENAME: dict(organism_terms=[{"NCBITaxon:9606": "Homo sapiens"}]),
+        PRIMARY_FILTER_DIMENSION_TERM_IDS_FILENAME: dict(tissue_ontology_term_id={"NCBITaxon:9606": ["UBERON:1"]}),
+        FILTER_RELATIONSHIPS_FILENAME: {
+            "tissue_ontology_term_id__UBERON:1": {
+                "cell_type_ontology_term_id": ["cell_type_ontology_term_id__CL:1", "cell_type_ontology_term_id__CL:2"]
+            },
+            "cell_type_ontology_term_id__CL:1": {"tissue_ontology_term_id": ["tissue_ontology_term_id__UBERON:1"]},
+            "cell_type_ontology_term_id__CL:2": {"tissue_ontology_term_id": ["tissue_ontology_term_id__UBERON:1"]},
+        },
+        DATASET_METADATA_FILENAME: dict(dataset_1=dict(id="dataset_1", label="Dataset 1")),
+        CELL_TYPE_ANCESTORS_FILENAME: {"CL:1": ["CL:1"], "CL:2": ["CL:2", "CL:1"]},
+    }
+    for filename, artifact in json_artifacts.items():
+        with open(os.path.join(snapshot_dir, filename), "w") as f:
+            json.dump(artifact, f)
+
+    cell_counts = pd.DataFrame(
+        dict(
+            tissue_ontology_term_id=["UBERON:1", "UBERON:1"],
+            cell_type_ontology_term_id=["CL:1", "CL:2"],
+            n_cells=[10, 20],
+        )
+    )
+    build_filter_relationships(cell_counts).save(os.path.join(snapshot_dir, FILTER_RELATIONSHIPS_CSR_FILENAME))
+
+    cube_schema = tiledb.ArraySchema(
+        domain=tiledb.Domain(
+            tiledb.Dim(name="tissue_ontology_term_id", domain=None, tile=None, dtype="ascii"),
+            tiledb.Dim(name="cell_type_ontology_term_id", domain=None, tile=None, dtype="ascii"),
+        ),
+        attrs=[tiledb.Attr(name="n_cells", dtype="int64")],
+        sparse=True,
+    )
+    for cube_name in [
+        CELL_COUNTS_CUBE_NAME,
+        CELL_COUNTS_DIFFEXP_CUBE_NAME,
+        EXPRESSION_SUMMARY_CUBE_NAME,
+        EXPRESSION_SUMMARY_DEFAULT_CUBE_NAME,
+        MARKER_GENES_CUBE_NAME,
+        EXPRESSION_SUMMARY_DIFFEXP_CUBE_NAME,
+        EXPRESSION_SUMMARY_DIFFEXP_SIMPLE_CUBE_NAME,
+    ]:
+        uri = os.path.join(snapshot_dir, cube_name)
+        tiledb.Array.create(uri, cube_schema)
+        with tiledb.open(uri, "w") as cube:
+            cube[cell_counts["tissue_ontology_term_id"].values, cell_counts["cell_type_ontology_term_id"].values] = {
+                "n_cells": cell_counts["n_cells"].values
+            }
+    return json_artifacts, cell_counts
+
+
+@patch("backend.common.census_cube.data.snapshot._create_cube_ctx", side_effect=lambda: tiledb.Ctx())
+def test_load_snapshot_defers_only_dataset_metadata_to_first_access(mock_create_cube_ctx, tmp_path):
+    snapshot_fs_root_path = str(tmp_path)
+    json_artifacts, cell_counts = _write_snapshot(snapshot_fs_root_path, _get_wmg_snapshot_rel_path("v5", "snapshot_1"))
+
+    snapshot = _load_snapshot(
+        snapshot_schema_version="v5", snapshot_id="snapshot_1", snapshot_fs_root_path=snapshot_fs_root_path
+    )
+    try:
+        assert snapshot.cell_type_orderings == {("UBERON:1", "CL:1"): 0, ("UBERON:1", "CL:2"): 1}
+        assert snapshot.primary_filter_dimensions == json_artifacts[PRIMARY_FILTER_DIMENSIONS_FILENAME]
+        assert snapshot.primary_filter_dimension_term_ids == json_artifacts[PRIMARY_FILTER_DIMENSION_TERM_IDS_FILENAME]
+        assert snapshot.cell_type_ancestors.to_dict() == json_artifacts[CELL_TYPE_ANCESTORS_FILENAME]
+        assert snapshot.cell_counts_df["n_cells"].tolist() == cell_counts["n_cells"].tolist()
+        # the artifacts read by every WMG and DE query are loaded before the snapshot is published
+        assert snapshot.filter_relationships.to_dict() == json_artifacts[FILTER_RELATIONSHIPS_FILENAME]
+        assert snapshot.cell_counts_diffexp_df["n_cells"].tolist() == cell_counts["n_cells"].tolist()
+        assert snapshot.cell_counts_diffexp_index is not None
+        assert snapshot.cube_handles.n_open_arrays == 7
+        # the cell counts of the test snapshot have no self reported ethnicity
+        assert snapshot.self_reported_ethnicity_composite_term_ids == {}
+
+        assert isinstance(snapshot.__dict__["_dataset_metadata"], LazyArtifact)
+        assert {
+            "cell_type_orderings",
+            "primary_filter_dimensions",
+            "cell_type_ancestors",
+            "cell_counts",
+            "cell_counts_diffexp",
+            "filter_relationships",
+            "cell_type_ancestor_matrix",
+            "total",
+        } <= set(snapshot.load_timings)
+
+        assert snapshot.dataset_metadata == json_artifacts[DATASET_METADATA_FILENAME]
+        # the artifact is loaded once, and its load time is recorded with the others
+        assert snapshot.dataset_metadata is snapshot.dataset_metadata
+        assert "dataset_metadata" in set(snapshot.load_timings)
+    finally:
+        snapshot.cube_handles.close()
+
+
+def test_build_self_reported_ethnicity_composite_term_ids():
+    composite_term_ids = build_self_reported_ethnicity_composite_term_ids(
+        ["HANCESTRO:2,HANCESTRO:1", "HANCESTRO:1", "HANCESTRO:3", "HANCESTRO:1,HANCESTRO:3", "unknown"]
+    )
+
+    assert composite_term_ids == {
+        "HANCESTRO:1": ["HANCESTRO:1,HANCESTRO:3", "HANCESTRO:2,HANCESTRO:1"],
+        "HANCESTRO:2": ["HANCESTRO:2,HANCESTRO:1"],
+        "HANCESTRO:3": ["HANCESTRO:1,HANCESTRO:3"],
+        "unknown": [],
+    }
+
+
+def test_snapshot_fields_assigned_directly_are_not_lazy():
+    snapshot = CensusCubeSnapshot(dataset_metadata={"dataset_1": {}})
+
+    assert snapshot.dataset_metadata == {"dataset_1": {}}
+    assert snapshot.filter_relationships is None
+    assert snapshot.cell_counts_diffexp_df is None
+
+
+@patch("backend.common.census_cube.data.snapshot._create_cube_ctx", side_effect=lambda: tiledb.Ctx())
+def test_load_snapshot_maps_shared_artifacts(mock_create_cube_ctx, tmp_path):
+    snapshot_fs_root_path = str(tmp_path)
+    snapshot_rel_path = _get_wmg_snapshot_rel_path("v5", "snapshot_1")
+    json_artifacts, cell_counts = _write_snapshot(snapshot_fs_root_path, snapshot_rel_path)
+
+    with (
+        patch.object(snapshot_module, "SNAPSHOT_SHARED_MEMORY_ENABLED", True),
+        patch.object(snapshot_module, "SNAPSHOT_FS_ROOT_PATH", snapshot_fs_root_path),
+    ):
+        snapshots = [
+            _load_snapshot(
+                snapshot_schema_version="v5", snapshot_id="snapshot_1", snapshot_fs_root_path=snapshot_fs_root_path
+            )
+            for _ in range(2)
+        ]
+        try:
+            for snapshot in snapshots:
+                assert snapshot.cell_counts_df["n_cells"].tolist() == cell_counts["n_cells"].tolist()
+                assert not snapshot.cell_counts_df["n_cells"].to_numpy().flags.writeable
+                assert snapshot.cell_counts_diffexp_df["n_cells"].tolist() == cell_counts["n_cells"].tolist()
+                assert snapshot.filter_relationships.to_dict() == json_artifacts[FILTER_RELATIONSHIPS_FILENAME]
+                assert not snapshot.filter_relationships.links[
+                    "tissue_ontology_term_id", "cell_type_ontology_term_id"
+                ].indices.flags.writeable
+        finally:
+            for snapshot in snapshots:
+                snapshot.cube_handles.close()
+
+    shared_artifacts_dir = tmp_path / "shared" / snapshot_rel_path
+    assert sorted(path.name for path in shared_artifacts_dir.glob("*.arrow")) == [
+        f"{CELL_COUNTS_CUBE_NAME}.arrow",
+        f"{CELL_COUNTS_DIFFEXP_CUBE_NAME}.arrow",
+    ]
+    assert (shared_artifacts_dir / "filter_relationships.arrays").is_dir()
+
+
+@patch("backend.common.census_cube.data.snapshot._create_cube_ctx", side_effect=lambda: tiledb.Ctx())
+def test_load_snapshot_reads_legacy_filter_relationships(mock_create_cube_ctx, tmp_path):
+    snapshot_fs_root_path = str(tmp_path)
+    snapshot_rel_path = _get_wmg_snapshot_rel_path("v5", "snapshot_1")
+    json_artifacts, _ = _write_snapshot(snapshot_fs_root_path, snapshot_rel_path)
+    os.remove(os.path.join(snapshot_fs_root_path, snapshot_rel_path, FILTER_RELATIONSHIPS_CSR_FILENAME))
+
+    snapshot = _load_snapshot(
+        snapshot_schema_version="v5", snapshot_id="snapshot_1", snapshot_fs_root_path=snapshot_fs_root_path
+    )
+    try:
+        assert snapshot.filter_relationships.to_dict() == json_artifacts[FILTER_RELATIONSHIPS_FILENAME]
+    finally:
+        snapshot.cube_handles.close()
+
+
+# Refreshes the snapshot in a process whose `threading` is monkey-patched by gevent, as in the deployed gevent
+# workers, while a greenlet ticks on the event loop. The snapshot id check, the artifact reads and the ancestor matrix
+# build each block their thread for half a second without yielding, like the TileDB, S3 and pandas calls they stand
+# in for, so the event loop stalls for at least that long if any of them runs on it.
+_GEVENT_REFRESH_SCRIPT = """
+from gevent import monkey
+
+monkey.patch_all()
+
+import sys
+import time
+from unittest.mock import patch
+
+import gevent
+import tiledb
+
+import backend.common.census_cube.data.snapshot as snapshot_module
+from tests.unit.backend.wmg.data.test_snapshot import _write_snapshot
+
+snapshot_fs_root_path = sys.argv[1]
+_write_snapshot(snapshot_fs_root_path, snapshot_module._get_wmg_snapshot_rel_path("v5", "snapshot_1"))
+with open(f"{snapshot_fs_root_path}/{snapshot_module._get_latest_snapshot_identifier_file_rel_path('v5')}", "w") as f:
+    f.write("snapshot_1")
+native_sleep = monkey.get_original("time", "sleep")
+
+
+def blocking(f):
+    def blocking_f(*args, **kwargs):
+        native_sleep(0.5)
+        return f(*args, **kwargs)
+
+    return blocking_f
+
+
+ticks = []
+
+
+def tick():
+    while True:
+        ticks.append(time.perf_counter())
+        gevent.sleep(0.01)
+
+
+with (
+    patch.object(snapshot_module, "_create_cube_ctx", lambda: tiledb.Ctx()),
+    patch.object(snapshot_module, "_get_latest_snapshot_id", blocking(lambda *args, **kwargs: "snapshot_1")),
+    patch.object(snapshot_module, "_load_cell_type_ancestors", blocking(snapshot_module._load_cell_type_ancestors)),
+    patch.object(
+        snapshot_module, "build_cell_type_ancestor_matrix", blocking(snapshot_module.build_cell_type_ancestor_matrix)
+    ),
+):
+    ticker = gevent.spawn(tick)
+    gevent.sleep(0.05)
+    snapshot_module._SnapshotRefresher(
+        snapshot_schema_version="v5", snapshot_fs_root_path=snapshot_fs_root_path, ttl_seconds=3600
+    ).refresh()
+    ticker.kill()
+
+assert snapshot_module.cached_snapshot.snapshot_identifier == "snapshot_1"
+print(max(later - earlier for earlier, later in zip(ticks, ticks[1:], strict=False)))
+"""
+
+
+def test_snapshot_refresher_does_not_block_gevent_event_loop(tmp_path):
+    pytest.importorskip("gevent")
+
+    result = subprocess.run(
+        [sys.executable, "-c", _GEVENT_REFRESH_SCRIPT, str(tmp_path)],
+        capture_output=True,
+        text=True,
+        check=False,
+        env=dict(os.environ, DEPLOYMENT_STAGE="test"),
+    )
+
+    assert result.returncode == 0, result.stderr
+    assert float(result.stdout.strip().splitlines()[-1]) < 0.25
+
+
+@patch("backend.common.census_cube.data.snapshot._create_cube_ctx", side_effect=lambda: tiledb.Ctx())
+def test_load_snapshot_with_cell_types_missing_from_cell_type_ancestors(mock_create_cube_ctx, tmp_path):
+    snapshot_fs_root_path = str(tmp_path)
+    snapshot_rel_path = _get_wmg_snapshot_rel_path("v5", "snapshot_1")
+    _write_snapshot(snapshot_fs_root_path, snapshot_rel_path)
+    with open(os.path.join(snapshot_fs_root_path, snapshot_rel_path, CELL_TYPE_ANCESTORS_FILENAME), "w") as f:
+        json.dump({"CL:1": ["CL:1"]}, f)
+
+    snapshot = _load_snapshot(
+        snapshot_schema_version="v5", snapshot_id="snapshot_1", snapshot_fs_root_path=snapshot_fs_root_path
+    )
+    try:
+        matrix = snapshot.cell_type_ancestor_matrix
+        assert list(matrix.cell_type_ontology_term_ids) == ["CL:1", "CL:2"]
+        assert matrix.ancestors.toarray().tolist() == [[1, 0], [0, 1]]
+    finally:
+        snapshot.cube_handles.close()
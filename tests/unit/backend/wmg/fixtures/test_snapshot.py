@@ -15,6 +15,7 @@ import tiledb
 from numpy.random import randint, random
 from pandas import DataFrame
 
+from backend.common.census_cube.data.filter_relationships import FilterRelationships
 from backend.common.census_cube.data.schemas.cube_schema import cell_counts_schema as cell_counts_schema_actual
 from backend.common.census_cube.data.schemas.cube_schema import (
     expression_summary_schema as expression_summary_schema_actual,
@@ -45,6 +46,7 @@ from backend.common.census_cube.data.snapshot import (
     MARKER_GENES_CUBE_NAME,
     PRIMARY_FILTER_DIMENSIONS_FILENAME,
     CensusCubeSnapshot,
+    build_self_reported_ethnicity_composite_term_ids,
 )
 from backend.common.census_cube.data.tiledb import create_ctx
 from backend.common.census_cube.utils import build_filter_relationships
@@ -285,7 +287,7 @@ def load_realistic_test_snapshot(snapshot_name: str) -> CensusCubeSnapshot:
                 gzip.open(f"{FIXTURES_ROOT}/{snapshot_name}/{CELL_TYPE_ANCESTORS_FILENAME}.gz", "rt")
             )
 
-            filter_relationships = json.load(fr)
+            filter_relationships = FilterRelationships.from_dict(json.load(fr))
             primary_filter_dimensions = json.load(fp)
             dataset_metadata = json.load(fd)
             cell_type_ancestors = json.load(fca)
@@ -427,6 +429,9 @@ def create_temp_wmg_snapshot(
                 cell_type_orderings=cell_type_orderings,
                 primary_filter_dimensions=primary_filter_dimensions,
                 filter_relationships=filter_relationships,
+                self_reported_ethnicity_composite_term_ids=build_self_reported_ethnicity_composite_term_ids(
+                    cc["self_reported_ethnicity_ontology_term_id"].unique()
+                ),
             )
 
 
@@ -10,10 +10,12 @@ from backend.common.census_cube.data.query import (
     MarkerGeneQueryCriteria,
     retrieve_top_n_markers,
 )
+from backend.common.census_cube.data.snapshot import CensusCubeSnapshot
 from backend.wmg.api.config import (
     READER_CENSUS_CUBE_CUBE_QUERY_VALID_ATTRIBUTES,
     READER_CENSUS_CUBE_CUBE_QUERY_VALID_DIMENSIONS,
 )
+from backend.wmg.pipeline.primary_filter_dimensions import list_organism_primary_filter_dimension_term_ids
 from tests.test_utils import sort_dataframe
 from tests.unit.backend.wmg.fixtures.test_snapshot import create_temp_wmg_snapshot, load_realistic_test_snapshot
 
@@ -185,3 +187,34 @@ class QueryPrimaryFilterDimensionsTest(unittest.TestCase):
                 },
                 result,
             )
+
+    def test__precomputed_term_ids__match_cell_counts_cube_scan(self):
+        def exclude_one_tissue_per_organism(logical_coord: NamedTuple) -> bool:
+            return logical_coord.tissue_ontology_term_id == logical_coord.organism_ontology_term_id.replace(
+                "organism", "tissue"
+            )
+
+        with create_temp_wmg_snapshot(dim_size=3, exclude_logical_coord_fn=exclude_one_tissue_per_organism) as snapshot:
+            scan = CensusCubeQuery(snapshot, self.cube_query_params)
+            precomputed = CensusCubeQuery(
+                CensusCubeSnapshot(
+                    primary_filter_dimension_term_ids=list_organism_primary_filter_dimension_term_ids(
+                        snapshot.cell_counts_cube.df[:]
+                    )
+                ),
+                self.cube_query_params,
+            )
+
+            for dim_name in ["tissue_ontology_term_id", "organism_ontology_term_id"]:
+                self.assertEqual(
+                    scan.list_primary_filter_dimension_term_ids(dim_name),
+                    precomputed.list_primary_filter_dimension_term_ids(dim_name),
+                )
+            self.assertEqual(
+                scan.list_grouped_primary_filter_dimensions_term_ids(
+                    "tissue_ontology_term_id", "organism_ontology_term_id"
+                ),
+                precomputed.list_grouped_primary_filter_dimensions_term_ids(
+                    "tissue_ontology_term_id", "organism_ontology_term_id"
+                ),
+            )
@@ -1,7 +1,8 @@
 import json
 import unittest
 
-from backend.common.census_cube.data.snapshot import FILTER_RELATIONSHIPS_FILENAME
+from backend.common.census_cube.data.filter_relationships import FilterRelationships
+from backend.common.census_cube.data.snapshot import FILTER_RELATIONSHIPS_CSR_FILENAME, FILTER_RELATIONSHIPS_FILENAME
 from backend.wmg.pipeline.constants import (
     EXPRESSION_SUMMARY_AND_CELL_COUNTS_CUBE_CREATED_FLAG,
     FILTER_RELATIONSHIPS_CREATED_FLAG,
@@ -35,8 +36,11 @@ class FilterRelationshipsTests(unittest.TestCase):
 
     def test_filter_relationships(self):
         create_filter_relationships_graph(self.temp_cube_dir.name)
+        with open(f"{self.temp_cube_dir.name}/{FILTER_RELATIONSHIPS_CSR_FILENAME}", "rb") as f:
+            filter_relationships = FilterRelationships.load(f.read()).to_dict()
         with open(f"{self.temp_cube_dir.name}/{FILTER_RELATIONSHIPS_FILENAME}") as f:
-            filter_relationships = json.load(f)
+            legacy_filter_relationships = json.load(f)
         pipeline_state = load_pipeline_state(self.temp_cube_dir.name)
         self.assertTrue(pipeline_state.get(FILTER_RELATIONSHIPS_CREATED_FLAG))
         self.assertTrue(compare_dicts(filter_relationships, self.expected_filter_relationships))
+        self.assertTrue(compare_dicts(legacy_filter_relationships, self.expected_filter_relationships))